@@ -5,7 +5,9 @@ from phame.agents.librarian import LibrarianDeps
 from phame.agents.utils import SolidworksExampleDeps
 
 # from phame.haystack.agent_calls_rag import build_rag_pipeline
-from phame.haystack.trusted_references_rag import make_chroma_document_store, build_rag_pipeline
+from phame.haystack.rag_pipeline import make_chroma_document_store, build_rag_pipeline
+from phame.rag_utils.sparse_index import sparse_index_path
+from phame.rag_utils.globals import DEFAULTS_RAG
 from phame.llm.utils import pretty_print_ctx_messages
 
 
@@ -56,7 +58,10 @@ EMBED_MODEL = "intfloat/e5-large-v2"
 SOLIDWORKS_MACRO_EXAMPLES = [Path("./solidworks/human_gen_examples")]
 # textbook_rag = build_rag_pipeline()
 document_store = make_chroma_document_store(persist_path=CHROMA_PERSIST)
-textbook_rag = build_rag_pipeline(document_store, EMBED_MODEL)
+# BM25 + embedding fusion only when retrieval.hybrid is set (the index is built with sparse.enabled)
+textbook_rag = build_rag_pipeline(document_store, EMBED_MODEL,
+                                  sparse_index=str(sparse_index_path(CHROMA_PERSIST, "documents"))
+                                  if DEFAULTS_RAG["retrieval"]["hybrid"] else None)
 
    
 
@@ -2,6 +2,8 @@
 from dataclasses import dataclass
 from pydantic_ai import Agent, RunContext
 from haystack import Pipeline
+from phame.haystack.rag_pipeline import rag_inputs
+from phame.rag_utils.filters import RetrievalFilter
 from pydantic_ai.models.openai import OpenAIChatModel
 from pydantic_ai.providers.openai import OpenAIProvider
 import os
@@ -33,12 +35,23 @@ librarian_agent = Agent(
 )
 
 @librarian_agent.tool
-def kb_basic(ctx: RunContext[LibrarianDeps], question: str) -> str:
-    """Answer using the basic Haystack RAG pipeline."""
+def kb_basic(ctx: RunContext[LibrarianDeps], question: str, source: str | None = None,
+             page_min: int | None = None, page_max: int | None = None, tag: str | None = None) -> str:
+    """Answer using the basic Haystack RAG pipeline.
+
+    Args:
+        question: the question to answer
+        source: optional glob over the source file path, e.g. "*shigley*"
+        page_min: optional first page to search, inclusive
+        page_max: optional last page to search, inclusive
+        tag: optional collection tag given at ingestion
+    """
     p = ctx.deps.textbook_rag
-    out = p.run({
-        "text_embedder": {"text": question},
-        "prompt_builder": {"question": question},  # matches your template variable
-        "answer_builder": {"query": question},     # AnswerBuilder expects query
-    })
+    filters = RetrievalFilter(source=source, page_min=page_min, page_max=page_max, tag=tag)
+    # text_embedder/prompt_builder/answer_builder inputs, plus the BM25 query when the pipeline is hybrid
+    try:
+        inputs = rag_inputs(p, question, filters=filters)
+    except ValueError as e:  # source glob matching no document
+        return str(e)
+    out = p.run(inputs)
     return out["first_answer"]["answer"]
@@ -0,0 +1,58 @@
+from dataclasses import replace
+
+import numpy as np
+from haystack import Document, component
+
+from phame.rag_utils.embedding_cache import EmbeddingCache
+
+
+@component
+class CachedDocumentEmbedder:
+    """
+    Wraps a Haystack document embedder with the on-disk EmbeddingCache: only documents whose content
+    has not been embedded before are passed to the wrapped embedder.
+    """
+    def __init__(self, embedder, cache: EmbeddingCache):
+        self.embedder = embedder
+        self.cache = cache
+
+    def warm_up(self):
+        if hasattr(self.embedder, "warm_up"):
+            self.embedder.warm_up()
+
+    @component.output_types(documents=list[Document])
+    def run(self, documents: list[Document]):
+        texts = [d.content or "" for d in documents]
+        vecs, missing = self.cache.get_many(texts)
+        if missing:
+            embedded = self.embedder.run(documents=[documents[i] for i in missing])["documents"]
+            new = np.array([d.embedding for d in embedded], dtype="float32")
+            self.cache.put_many([texts[i] for i in missing], new)
+            if vecs is None:
+                vecs = new
+            else:
+                vecs[missing] = new
+        return {"documents": [replace(d, embedding=v.tolist()) for d, v in zip(documents, vecs)]}
+
+
+@component
+class CachedTextEmbedder:
+    """
+    Wraps a Haystack text embedder with the on-disk EmbeddingCache.
+    """
+    def __init__(self, embedder, cache: EmbeddingCache):
+        self.embedder = embedder
+        self.cache = cache
+
+    def warm_up(self):
+        if hasattr(self.embedder, "warm_up"):
+            self.embedder.warm_up()
+
+    @component.output_types(embedding=list[float])
+    def run(self, text: str):
+        vecs, missing = self.cache.get_many([text])
+        if not missing:
+            return {"embedding": vecs[0].tolist()}
+        embedding = self.embedder.run(text=text)["embedding"]
+        self.cache.put_many([text], np.array([embedding], dtype="float32"))
+        return {"embedding": embedding}
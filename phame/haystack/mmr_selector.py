@@ -0,0 +1,40 @@
+from typing import Optional
+
+import numpy as np
+from haystack import Document, component
+
+from phame.rag_utils.mmr import mmr_select
+
+
+@component
+class MMRSelector:
+    """
+    Keeps top_k of the retrieved documents by maximal marginal relevance, so overlapping windows of one page do
+    not take several context slots. Documents returned without an embedding are embedded with document_embedder
+    (a CachedDocumentEmbedder serves the vectors cached when the store was indexed).
+    """
+    def __init__(self, top_k: int = 5, lambda_mult: float = 0.5, document_embedder=None):
+        self.top_k = top_k
+        self.lambda_mult = lambda_mult
+        self.document_embedder = document_embedder
+        self._embedder_ready = False
+
+    def _embed(self, documents: list[Document]) -> list[Document]:
+        if not self._embedder_ready and hasattr(self.document_embedder, "warm_up"):
+            self.document_embedder.warm_up()
+        self._embedder_ready = True
+        return self.document_embedder.run(documents=documents)["documents"]
+
+    @component.output_types(documents=list[Document])
+    def run(self, documents: list[Document], query_embedding: list[float], top_k: Optional[int] = None):
+        top_k = top_k or self.top_k
+        missing = [i for i, d in enumerate(documents) if d.embedding is None]
+        if missing:
+            if self.document_embedder is None:
+                return {"documents": documents[:top_k]}
+            documents = list(documents)
+            for i, d in zip(missing, self._embed([documents[i] for i in missing])):
+                documents[i] = d
+        keep = mmr_select(np.array(query_embedding), np.array([d.embedding for d in documents]), top_k,
+                          self.lambda_mult)
+        return {"documents": [documents[i] for i in keep]}
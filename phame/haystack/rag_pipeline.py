@@ -0,0 +1,350 @@
+"""
+Haystack indexing and RAG pipelines over a Chroma document store, shared by trusted_references_rag.py (PDF
+subset) and trusted_references_rag_full.py (all PDFs), which only differ in the corpus they point at.
+"""
+
+import argparse, json
+from pathlib import Path
+
+from haystack import Pipeline, component
+from haystack.components.converters import PyPDFToDocument
+from haystack.components.preprocessors import DocumentCleaner, DocumentSplitter
+from haystack.components.embedders import SentenceTransformersDocumentEmbedder
+from haystack.components.writers import DocumentWriter
+from haystack_integrations.document_stores.chroma import ChromaDocumentStore
+from haystack.utils import Secret
+from haystack.components.embedders import OpenAIDocumentEmbedder, OpenAITextEmbedder
+from haystack.components.embedders import SentenceTransformersTextEmbedder
+from haystack.components.builders import ChatPromptBuilder, AnswerBuilder
+from haystack.components.joiners import AnswerJoiner, DocumentJoiner
+from haystack.components.generators.chat import OpenAIChatGenerator
+from haystack.dataclasses import ChatMessage, GeneratedAnswer
+
+from haystack_integrations.components.retrievers.chroma import ChromaEmbeddingRetriever
+import os
+
+from phame.haystack.cached_embedders import CachedDocumentEmbedder, CachedTextEmbedder
+from phame.haystack.sparse_retriever import SparseIndexWriter, SparseRetriever
+from phame.haystack.reranker import BudgetedReranker
+from phame.haystack.mmr_selector import MMRSelector
+from phame.rag_utils.embedding_cache import EmbeddingCache, QueryEmbeddingCache
+from phame.rag_utils.sparse_index import SparseIndex, sparse_index_path
+from phame.rag_utils.filters import RetrievalFilter
+from phame.rag_utils.globals import DEFAULTS_RAG
+
+EMBEDDING_CACHE_DIR = DEFAULTS_RAG["embedding"]["cache_dir"]
+
+def make_chroma_document_store(persist_path: str | None = None) -> ChromaDocumentStore:
+    # persist_path keeps your collection across runs (optional)
+    return ChromaDocumentStore(persist_path=persist_path) if persist_path else ChromaDocumentStore()
+    # Connection options (persist_path / host+port) are documented here. :contentReference[oaicite:2]{index=2}
+
+
+def build_indexing_pipeline(document_store: ChromaDocumentStore, embedding_model: str,
+                            cache_dir: str | None = EMBEDDING_CACHE_DIR, sparse_index: str | None = None) -> Pipeline:
+    pdf_converter = PyPDFToDocument()
+    cleaner = DocumentCleaner()
+    splitter = DocumentSplitter(split_by="word", split_length=150, split_overlap=50)
+    doc_embedder = SentenceTransformersDocumentEmbedder(model=embedding_model)    
+    if cache_dir:
+        # rebuilding the store only encodes chunks whose text was never embedded with this model
+        doc_embedder = CachedDocumentEmbedder(doc_embedder, EmbeddingCache(cache_dir, embedding_model, False))
+    # doc_embedder = OpenAIDocumentEmbedder(
+    #     api_key=Secret.from_env_var("PORTKEY_API_KEY"),
+    #     api_base_url=os.environ["PORTKEY_BASE_URL"],
+    #     model=embedding_model,  # or whatever your Portkey config routes to
+    # )
+    writer = DocumentWriter(document_store=document_store)
+
+    # doc_embedder.warm_up()
+
+    p = Pipeline()
+    p.add_component("pdf_converter", pdf_converter)
+    p.add_component("cleaner", cleaner)
+    p.add_component("splitter", splitter)
+    p.add_component("doc_embedder", doc_embedder)
+    p.add_component("writer", writer)
+
+    # p.connect("pdf_converter", "cleaner")
+    # p.connect("cleaner", "splitter")
+    # p.connect("splitter", "doc_embedder")
+    # p.connect("doc_embedder.documents", "writer.documents")  # embedder outputs documents w/ embeddings
+    
+    # ✅ Explicit ports: everything passes a list of Documents via "documents"
+    p.connect("pdf_converter.documents", "cleaner.documents")
+    p.connect("cleaner.documents", "splitter.documents")
+    p.connect("splitter.documents", "doc_embedder.documents")
+    p.connect("doc_embedder.documents", "writer.documents")
+
+    if sparse_index:
+        # BM25 postings are written from the same split documents, next to the dense store
+        p.add_component("sparse_writer", SparseIndexWriter(SparseIndex(sparse_index)))
+        p.connect("splitter.documents", "sparse_writer.documents")
+
+    return p
+
+
+def index_pdf_dir(pdf_root_dir: str, indexing_pipeline: Pipeline, tag: str | None = None) -> int:
+    pdf_paths = [str(p) for p in Path(pdf_root_dir).rglob("*.pdf") if p.is_file()]
+    if not pdf_paths:
+        raise FileNotFoundError(f"No PDFs found under: {pdf_root_dir}")
+
+    # listed before the run, so a store indexed before sources were recorded is scanned while it is still small
+    document_store = indexing_pipeline.get_component("writer").document_store
+    known = store_sources(document_store)
+
+    # the tag lands in every document's meta, for RetrievalFilter(tag=...)
+    out = indexing_pipeline.run({
+        "pdf_converter": {"sources": pdf_paths, **({"meta": {"tag": tag}} if tag else {})}
+        }, include_outputs_from={"pdf_converter"})
+    # the converter's file_path values are what source filters match against
+    new = {d.meta.get("file_path") for d in out["pdf_converter"]["documents"]}
+    save_sources(document_store, set(known) | new)
+    
+    # out = indexing_pipeline.run(
+    #     {"pdf_converter": {"sources": pdf_paths[:1]}},
+    #     include_outputs_from={"pdf_converter", "cleaner", "splitter", "doc_embedder"},
+    # )
+        
+    # print("converter docs:", out["pdf_converter"]["documents"])
+    # print("splitter docs:", out["splitter"]["documents"])
+    
+    # conv = PyPDFToDocument()
+    # docs = conv.run(sources=[pdf_paths[0]])["documents"]
+    # print(len(docs), docs[0].content[:200] if docs else "NO TEXT")
+    
+    
+    return out["writer"]["documents_written"]
+
+
+
+
+@component
+class FirstAnswerText:
+    @component.output_types(answer=str)
+    def run(self, answers: list[GeneratedAnswer]):
+        return {"answer": answers[0].data if answers else ""}
+
+def build_rag_pipeline(document_store: ChromaDocumentStore, embedding_model: str, llm_model: str = "openai/gpt-oss-120b",
+                       cache_dir: str | None = EMBEDDING_CACHE_DIR, sparse_index: str | None = None,
+                       top_k: int = 10, rerank: dict | None = None, mmr_lambda: float | None = None,
+                       mmr_fetch_k: int = 20) -> Pipeline:
+    # with rerank (a config like DEFAULTS_RAG["rerank"]) the retrievers fetch rerank["candidates"] documents and
+    # a cross-encoder keeps the best rerank["top_n"] for the prompt; with mmr_lambda the final documents are
+    # picked by MMR out of mmr_fetch_k (retrieved, or kept by the reranker)
+    mmr = mmr_lambda is not None
+    n_docs = rerank["top_n"] if rerank else top_k
+    fetch_k = rerank["candidates"] if rerank else (max(top_k, mmr_fetch_k) if mmr else top_k)
+    text_embedder = SentenceTransformersTextEmbedder(model=embedding_model)
+    # repeated questions are served from the in-process LRU (and the on-disk cache behind it)
+    text_embedder = CachedTextEmbedder(text_embedder, QueryEmbeddingCache(
+        embedding_model,
+        disk=EmbeddingCache(cache_dir, embedding_model, False, namespace="query") if cache_dir else None))
+    # text_embedder = OpenAITextEmbedder(
+    #     api_base_url=os.environ["PORTKEY_BASE_URL"],  # Portkey OpenAI-compatible URL
+    #     api_key=Secret.from_env_var("PORTKEY_API_KEY"),
+    #     model=embedding_model,
+    # )
+    retriever = ChromaEmbeddingRetriever(document_store=document_store, top_k=fetch_k)  # key change :contentReference[oaicite:4]{index=4}
+
+    template = [
+        ChatMessage.from_user(
+            """
+Given the following information, answer the question.
+
+Context:
+{% for document in documents %}
+{{ document.content }}
+{% endfor %}
+
+Question: {{ question }}
+Answer:
+""".strip()
+        )
+    ]
+    prompt_builder = ChatPromptBuilder(template=template, required_variables="*")
+    llm = OpenAIChatGenerator(
+        model=llm_model,
+        api_base_url=os.environ["PORTKEY_BASE_URL"],  # Portkey OpenAI-compatible URL
+        api_key=Secret.from_env_var("PORTKEY_API_KEY")
+        )
+    answer_builder = AnswerBuilder()
+    # first_answer = AnswerJoiner(top_k=1)
+    first_answer = FirstAnswerText()
+
+    p = Pipeline()
+    p.add_component("text_embedder", text_embedder)
+    p.add_component("retriever", retriever)
+    docs_out = "retriever.documents"
+    if sparse_index and Path(sparse_index).exists():
+        # hybrid: BM25 hits and embedding hits are fused by reciprocal rank
+        p.add_component("sparse_retriever", SparseRetriever(SparseIndex(sparse_index, readonly=True), top_k=fetch_k))
+        p.add_component("joiner", DocumentJoiner(join_mode="reciprocal_rank_fusion", top_k=fetch_k))
+        p.connect("retriever.documents", "joiner.documents")
+        p.connect("sparse_retriever.documents", "joiner.documents")
+        docs_out = "joiner.documents"
+    elif sparse_index:
+        print(f"No sparse index at {sparse_index}; using embedding retrieval only.")
+    if rerank:
+        p.add_component("ranker", BudgetedReranker(rerank["model"], top_k=mmr_fetch_k if mmr else n_docs,
+                                                   batch_size=rerank.get("batch_size", 16),
+                                                   max_length=rerank.get("max_length", 256),
+                                                   budget_ms=rerank.get("budget_ms")))
+        p.connect(docs_out, "ranker.documents")
+        docs_out = "ranker.documents"
+    if mmr:
+        # documents that come back without vectors are embedded through the cache filled at indexing time
+        doc_embedder = SentenceTransformersDocumentEmbedder(model=embedding_model)
+        if cache_dir:
+            doc_embedder = CachedDocumentEmbedder(doc_embedder, EmbeddingCache(cache_dir, embedding_model, False))
+        p.add_component("mmr", MMRSelector(top_k=n_docs, lambda_mult=mmr_lambda, document_embedder=doc_embedder))
+        p.connect(docs_out, "mmr.documents")
+        p.connect("text_embedder.embedding", "mmr.query_embedding")
+        docs_out = "mmr.documents"
+    p.add_component("prompt_builder", prompt_builder)
+    p.add_component("llm", llm)
+    p.add_component("answer_builder", answer_builder)
+    p.add_component("first_answer", first_answer)
+
+    # same wiring pattern you had:
+    p.connect("text_embedder.embedding", "retriever.query_embedding")  # ChromaEmbeddingRetriever expects query_embedding :contentReference[oaicite:5]{index=5}
+    p.connect(docs_out, "prompt_builder.documents")
+    p.connect("prompt_builder.prompt", "llm.messages")
+    p.connect("llm.replies", "answer_builder.replies")
+    p.connect(docs_out, "answer_builder.documents")
+    p.connect("answer_builder.answers", "first_answer.answers")
+
+    return p
+
+
+# distinct file paths of in-memory document stores; persisted stores keep theirs in SOURCES_FILE
+_STORE_SOURCES: dict = {}
+SOURCES_FILE = "sources.json"
+
+
+def sources_path(document_store: ChromaDocumentStore) -> Path | None:
+    """
+    :return: file listing the store's sources, next to its Chroma files (None for an in-memory store)
+    """
+    persist_path = document_store.to_dict()["init_parameters"].get("persist_path")
+    return Path(persist_path) / SOURCES_FILE if persist_path else None
+
+
+def save_sources(document_store: ChromaDocumentStore, sources) -> list[str]:
+    """
+    Records the distinct meta.file_path values of a store (index_pdf_dir calls this after each run).
+    :return: the sorted sources
+    """
+    sources = sorted(p for p in sources if p)
+    path = sources_path(document_store)
+    if path is None:
+        _STORE_SOURCES[id(document_store)] = sources
+    else:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(sources, indent=2), encoding="utf-8")
+    return sources
+
+
+def store_sources(document_store: ChromaDocumentStore) -> list[str]:
+    """
+    :return: distinct meta.file_path values of the store, as recorded at indexing time
+    """
+    path = sources_path(document_store)
+    if path is None and id(document_store) in _STORE_SOURCES:
+        return _STORE_SOURCES[id(document_store)]
+    if path is not None and path.exists():
+        return json.loads(path.read_text(encoding="utf-8"))
+    if not document_store.count_documents():
+        return []
+    # store indexed before sources were recorded: list them once (this loads every document) and keep the list
+    print("Listing the sources of the document store (once)…")
+    return save_sources(document_store, {d.meta.get("file_path") for d in document_store.filter_documents()})
+
+
+def rag_inputs(pipeline: Pipeline, question: str, top_k: int | None = None,
+               filters: RetrievalFilter | None = None) -> dict:
+    """
+    Builds the run() inputs of a pipeline from build_rag_pipeline, feeding the question to the BM25 branch and
+    the reranker when the pipeline has them. top_k applies to the last selection stage.
+    :param pipeline: RAG pipeline
+    :param question: user question
+    :param top_k: documents per retriever (defaults to the retrievers' own)
+    :param filters: optional restriction to sources / pages / tag, pushed into the Chroma query
+    :return: dict for pipeline.run (ValueError when the source glob matches no indexed file)
+    """
+    inputs = {
+        "text_embedder": {"text": question},
+        "prompt_builder": {"question": question},
+        "answer_builder": {"query": question},
+    }
+    if filters is not None and not filters.is_empty():
+        sources = None
+        if filters.source is not None:
+            sources = filters.match_sources(store_sources(pipeline.get_component("retriever").document_store))
+            if not sources:
+                raise ValueError(f"No indexed source matches {filters.source!r}.")
+        inputs["retriever"] = {"filters": filters.to_haystack(sources)}
+        if "sparse_retriever" in pipeline.graph.nodes:
+            inputs["sparse_retriever"] = {"filter": filters}
+    if "mmr" in pipeline.graph.nodes:
+        # earlier stages keep their candidate depth
+        inputs["mmr"] = {"top_k": top_k}
+        top_k = None
+    if "ranker" in pipeline.graph.nodes:
+        # the retrievers keep their candidate depth; top_k applies to what the reranker keeps
+        inputs["ranker"] = {"query": question, "top_k": top_k}
+        top_k = None
+    if top_k:
+        inputs.setdefault("retriever", {})["top_k"] = top_k
+    if "sparse_retriever" in pipeline.graph.nodes:
+        inputs.setdefault("sparse_retriever", {}).update(query=question, top_k=top_k)
+        if top_k:
+            inputs["joiner"] = {"top_k": top_k}
+    return inputs
+
+
+def main(pdf_dir: str, persist_path: str, rebuild: bool = False,
+         embedding_model: str = "intfloat/e5-large-v2"):
+    """
+    Command line entry point of the trusted references scripts: optionally (re)indexes a PDF directory, then
+    answers one question. Reranking, MMR and the BM25 index are off unless asked for (or enabled in DEFAULTS_RAG).
+    :param pdf_dir: default PDF directory
+    :param persist_path: default Chroma persist path
+    :param rebuild: index the PDFs by default
+    :param embedding_model: default embedding model
+    """
+    ap = argparse.ArgumentParser(description="Index trusted reference PDFs with Haystack and ask a question.")
+    ap.add_argument("--pdf_dir", type=str, default=pdf_dir)
+    ap.add_argument("--persist_dir", type=str, default=persist_path)
+    ap.add_argument("--rebuild", action=argparse.BooleanOptionalAction, default=rebuild,
+                    help="index the PDFs before querying")
+    ap.add_argument("--embedding_model", type=str, default=embedding_model)
+    ap.add_argument("--question", type=str, default="What is this collection about?")
+    ap.add_argument("--top_k", type=int, default=5)
+    ap.add_argument("--sparse", action=argparse.BooleanOptionalAction, default=DEFAULTS_RAG["sparse"]["enabled"],
+                    help="also write a BM25 index when rebuilding (default: sparse.enabled)")
+    ap.add_argument("--hybrid", action=argparse.BooleanOptionalAction, default=DEFAULTS_RAG["retrieval"]["hybrid"],
+                    help="fuse BM25 hits with the embedding hits (default: retrieval.hybrid)")
+    ap.add_argument("--rerank", action="store_true",
+                    help="rerank retrieved candidates with the cross-encoder in DEFAULTS_RAG['rerank']")
+    ap.add_argument("--mmr-lambda", type=float, default=None,
+                    help="pick the final documents by MMR (1.0 = relevance only, 0.0 = diversity only)")
+    ap.add_argument("--mmr-fetch-k", type=int, default=DEFAULTS_RAG["retrieval"]["mmr_fetch_k"],
+                    help="candidates MMR chooses from")
+    args = ap.parse_args()
+
+    sparse_index = str(sparse_index_path(args.persist_dir, "documents"))
+    document_store = make_chroma_document_store(persist_path=args.persist_dir)
+
+    if args.rebuild:
+        indexing = build_indexing_pipeline(document_store, args.embedding_model,
+                                           sparse_index=sparse_index if args.sparse else None)
+        written = index_pdf_dir(args.pdf_dir, indexing)
+        print("Indexed PDFs chunks:", written)
+
+    rag = build_rag_pipeline(document_store, args.embedding_model, sparse_index=sparse_index if args.hybrid else None,
+                             rerank=DEFAULTS_RAG["rerank"] if args.rerank else None,
+                             mmr_lambda=args.mmr_lambda, mmr_fetch_k=args.mmr_fetch_k)
+
+    result = rag.run(rag_inputs(rag, args.question, top_k=args.top_k))
+    print(result["first_answer"]["answer"])
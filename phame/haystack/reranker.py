@@ -0,0 +1,36 @@
+from dataclasses import replace
+from typing import Optional
+
+from haystack import Document, component
+
+from phame.rag_utils.rerank import CrossEncoderReranker
+
+
+@component
+class BudgetedReranker:
+    """
+    Reranks retrieved documents with a CPU cross-encoder and keeps the best top_k. Scoring stops early when the
+    next batch would overrun budget_ms; documents it did not reach keep their retrieval order.
+    """
+    def __init__(self, model: str = "cross-encoder/ms-marco-MiniLM-L-6-v2", top_k: int = 5,
+                 batch_size: int = 16, max_length: int = 256, budget_ms: Optional[float] = None):
+        self.model = model
+        self.top_k = top_k
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.budget_ms = budget_ms
+        self.reranker = None
+
+    def warm_up(self):
+        if self.reranker is None:
+            self.reranker = CrossEncoderReranker(self.model, self.batch_size, self.max_length)
+            self.reranker.warm_up()
+
+    @component.output_types(documents=list[Document])
+    def run(self, query: str, documents: list[Document], top_k: Optional[int] = None):
+        if not documents:
+            return {"documents": []}
+        self.warm_up()
+        hits = self.reranker.rerank(query, [d.content or "" for d in documents], top_k or self.top_k,
+                                    self.budget_ms)
+        return {"documents": [documents[i] if s is None else replace(documents[i], score=s) for i, s in hits]}
@@ -0,0 +1,45 @@
+from typing import Optional
+
+from haystack import Document, component
+
+from phame.rag_utils.filters import RetrievalFilter
+from phame.rag_utils.sparse_index import SparseIndex
+
+
+@component
+class SparseIndexWriter:
+    """
+    Writes split documents into a BM25 SparseIndex (text and meta included, so hits can be returned as
+    Documents without going back to the document store).
+    """
+    def __init__(self, index: SparseIndex):
+        self.index = index
+
+    @component.output_types(documents_written=int)
+    def run(self, documents: list[Document]):
+        self.index.add([d.id for d in documents], [d.content or "" for d in documents],
+                       metas=[d.meta for d in documents], store_text=True)
+        return {"documents_written": len(documents)}
+
+
+@component
+class SparseRetriever:
+    """
+    BM25 retriever over a SparseIndex written by SparseIndexWriter. Exact identifiers (part numbers, material
+    grades) that the embedding retriever misses are matched literally. A RetrievalFilter is applied to the stored
+    meta of an over-fetched hit list, since the BM25 index has no metadata columns.
+    """
+    def __init__(self, index: SparseIndex, top_k: int = 10):
+        self.index = index
+        self.top_k = top_k
+
+    @component.output_types(documents=list[Document])
+    def run(self, query: str, top_k: Optional[int] = None, filter: Optional[RetrievalFilter] = None):
+        top_k = top_k or self.top_k
+        filtered = filter is not None and not filter.is_empty()
+        hits = self.index.search(query, 4 * top_k if filtered else top_k)
+        stored = self.index.documents([i for i, _ in hits])
+        docs = [Document(id=i, content=stored[i][0], meta=stored[i][1], score=s) for i, s in hits if i in stored]
+        if filtered:
+            docs = [d for d in docs if filter.matches(d.meta, "file_path", "page_number", "tag")]
+        return {"documents": docs[:top_k]}
@@ -1,9 +1,12 @@
-from phame.rag_utils.query_rag import run_query
+from phame.rag_utils.query_rag import Retriever
 from phame.rag_utils.build_rag import load_config
+from phame.rag_utils.blob_store import BlobStore
 
 from phame.llm.generation_chain import generation_with_query_top_k
 from argparse import ArgumentParser
 import os
+from contextlib import closing
+from pathlib import Path
 from langchain_openai import ChatOpenAI
 
 
@@ -28,6 +31,7 @@ def main():
 
     if args.persist_dir:
         config["chroma"]["persist_dir"] = args.persist_dir
+        config["outputs"]["code_store_dir"] = args.persist_dir + "/code"
 
     if args.collection:
         config["chroma"]["collection"] = args.collection
@@ -53,15 +57,26 @@ def main():
     chain = generation_with_query_top_k(llm, top_k)
 
     # run rag query
-    res = run_query(description, config)
+    retriever = Retriever(config)
+    res = retriever.query(description)
+
+    # the CadQuery sources live in the code store; only the top-k hits are read
+    ids = res['ids'][0]
+    code_dir = config["outputs"]["code_store_dir"]
+    codes = [None] * len(ids)
+    if (Path(code_dir) / "index.sqlite").exists():
+        with closing(BlobStore(code_dir, readonly=True)) as code_store:
+            codes = code_store.get_many(ids)
+    # collections built before the code store carry the code in their metadata
+    codes = [c if c is not None else m.get('cad_query_code', '') for c, m in zip(codes, res['metadatas'][0])]
 
     chain_dict = {
         **{
-            f"Description_{i}": res['metadatas'][0][i]['beginner_description']
+            f"Description_{i}": res['documents'][0][i]
             for i in range(top_k)
         },
         **{
-            f"Code_{i}": res['metadatas'][0][i]['cad_query_code']
+            f"Code_{i}": codes[i]
             for i in range(top_k)
 
         }
@@ -84,7 +99,7 @@ def main():
 
         fp.write("## Based on \n")
         for i in range(top_k):
-            text =  "## CQ/" + res['metadatas'][0][i]['id']
+            text =  "## CQ/" + ids[i]
             fp.write(text + "\n")
 
         rationale = "## " + spec['rationale'].replace('\n', '\n## ')
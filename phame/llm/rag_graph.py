@@ -7,6 +7,7 @@ from pathlib import Path
 from typing import TypedDict, List, Optional, Dict, Any
 
 import yaml
+import numpy as np
 
 from langgraph.graph import StateGraph, END
 from langgraph.checkpoint.memory import MemorySaver
@@ -16,6 +17,10 @@ from langchain_community.embeddings import OpenAIEmbeddings
 from langchain_community.vectorstores import Chroma
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from phame.rag_utils.embedding_cache import EmbeddingCache, QueryEmbeddingCache, cached_embedder
+from phame.rag_utils.mmr import mmr_select
 
 # -------------------------
 # Logging
@@ -42,6 +47,10 @@ def get_embedding_cfg(cfg: Dict[str, Any]) -> Dict[str, Any]:
         "normalize": bool(emb.get("normalize", False)),
         "base_url": emb.get("base_url"),
         "api_key": emb.get("api_key"),
+        "cache_dir": emb.get("cache_dir"),
+        "cache_max_mb": int(emb.get("cache_max_mb", 4096) or 4096),
+        "query_cache_size": int(emb.get("query_cache_size", 4096)),
+        "query_cache_ttl": emb.get("query_cache_ttl", 3600),
     }
 
 def get_chat_cfg(cfg: Dict[str, Any]) -> Dict[str, Any]:
@@ -84,6 +93,26 @@ def build_embeddings(
         normalize=emb_cfg["normalize"],
     )
 
+class CachedEmbeddings(Embeddings):
+    """
+    LangChain Embeddings wrapper that serves repeated texts from the on-disk EmbeddingCache, and repeated
+    queries from an in-process QueryEmbeddingCache.
+    """
+    def __init__(self, inner: Embeddings, cache: EmbeddingCache | None,
+                 query_cache: QueryEmbeddingCache | None = None):
+        self.inner = inner
+        self.cache = cache
+        self.query_cache = query_cache
+        self._embed = cached_embedder(lambda texts: np.array(inner.embed_documents(texts), dtype="float32"), cache)
+        self._embed_query = cached_embedder(
+            lambda texts: np.array([inner.embed_query(t) for t in texts], dtype="float32"), query_cache or cache)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(list(texts)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_query([text])[0].tolist()
+
 def read_model_name(default_path: str, override: Optional[str]) -> str:
     if override:
         return override
@@ -122,14 +151,29 @@ class RAGState(TypedDict):
     citations: List[Dict[str, Any]]  # <-- we’ll keep (id/meta/score) here
     answer: str
 
-def make_nodes(retriever, llm, k: int):
+def mmr_search_with_score(vectorstore, query: str, k: int, fetch_k: int, lambda_mult: float):
+    """
+    Like similarity_search_with_score, but picks the k results out of fetch_k candidates by maximal marginal
+    relevance, using the embeddings stored in the collection (no re-embedding of the candidates).
+    """
+    q = np.array(vectorstore.embeddings.embed_query(query), dtype="float32")
+    res = vectorstore._collection.query(query_embeddings=[q], n_results=max(k, fetch_k),
+                                        include=["documents", "metadatas", "distances", "embeddings"])
+    keep = mmr_select(q, np.asarray(res["embeddings"][0]), k, lambda_mult)
+    return [(Document(page_content=res["documents"][0][i], metadata=res["metadatas"][0][i] or {}),
+             res["distances"][0][i]) for i in keep]
+
+def make_nodes(retriever, llm, k: int, mmr_lambda: Optional[float] = None, fetch_k: int = 20):
     def retrieve_node(state: RAGState) -> dict:
         """Retrieve with scores + timing; stash citations."""
         query = state["question"]
         logger.info(f"🔍 Retrieving docs for query: {query!r}")
 
         t0 = time.time()
-        results = retriever.vectorstore.similarity_search_with_score(query, k=k)
+        if mmr_lambda is None:
+            results = retriever.vectorstore.similarity_search_with_score(query, k=k)
+        else:
+            results = mmr_search_with_score(retriever.vectorstore, query, k, fetch_k, mmr_lambda)
         dt = (time.time() - t0) * 1000
         docs = [doc for doc, _ in results]
 
@@ -178,6 +222,9 @@ def main():
     parser.add_argument("--persist-dir", default="outputs/chroma")
     parser.add_argument("--collection", default="rag_chunks")
     parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--mmr-lambda", type=float, default=None,
+                        help="Pick the k docs by maximal marginal relevance (1.0 = relevance only, 0.0 = diversity).")
+    parser.add_argument("--fetch-k", type=int, default=20, help="Candidates MMR chooses from.")
 
     # Chat overrides / fallbacks
     parser.add_argument("--chat-model", default=None)
@@ -214,6 +261,16 @@ def main():
 
     # Build embeddings + vector store/retriever
     embeddings = build_embeddings(emb_cfg, api_key=embed_api_key, base_url=embed_base_url)
+    disk_cache = query_disk_cache = None
+    if emb_cfg["cache_dir"]:
+        disk_cache = EmbeddingCache(
+            emb_cfg["cache_dir"], emb_cfg["model"], emb_cfg["normalize"], emb_cfg["cache_max_mb"] << 20)
+        # embed_query may differ from embed_documents, so queries get their own namespace
+        query_disk_cache = EmbeddingCache(
+            emb_cfg["cache_dir"], emb_cfg["model"], emb_cfg["normalize"], emb_cfg["cache_max_mb"] << 20,
+            namespace="query")
+    embeddings = CachedEmbeddings(embeddings, disk_cache, QueryEmbeddingCache(
+        emb_cfg["model"], emb_cfg["query_cache_size"], emb_cfg["query_cache_ttl"], query_disk_cache))
     vectorstore = Chroma(
         persist_directory=args.persist_dir,
         collection_name=args.collection,
@@ -234,7 +291,8 @@ def main():
     )
 
     # Build graph
-    retrieve_node, generate_node = make_nodes(retriever, llm, k=args.k)
+    retrieve_node, generate_node = make_nodes(retriever, llm, k=args.k, mmr_lambda=args.mmr_lambda,
+                                              fetch_k=args.fetch_k)
     graph = StateGraph(RAGState)
     graph.add_node("retrieve", retrieve_node)
     graph.add_node("generate", generate_node)
@@ -251,6 +309,9 @@ def main():
         config={"configurable": {"thread_id": args.thread_id}},
     )
     logger.info("✅ Pipeline complete")
+    st = embeddings.query_cache.stats()
+    logger.info(f"Query embedding cache: {st['hits']} hits, {st['disk_hits']} disk hits, {st['misses']} misses "
+                f"({st['hit_rate']:.1%} hit rate)")
 
     # Print answer + citations
     print("\n--- FINAL ANSWER ---\n", out["answer"])
@@ -0,0 +1,141 @@
+"""
+Concurrent embedding against the Portkey (OpenAI-compatible) /embeddings endpoint.
+
+Up to `concurrency` requests are in flight at once. Each request is retried on 429/5xx and transport errors
+with jittered exponential backoff (honouring Retry-After when the gateway sends it). A request rejected as too
+large is split in half, and the batch size used for the remaining requests shrinks with it. Vectors are always
+returned in input order.
+"""
+
+from __future__ import annotations
+import asyncio, random
+from typing import Dict, List
+
+import httpx
+import numpy as np
+from portkey_ai import createHeaders
+
+
+# substrings of 400 responses that mean "this request was too big", not "this request is wrong"
+PAYLOAD_ERROR_HINTS = ("too large", "too long", "maximum context", "max_tokens", "maximum input", "payload")
+
+
+class PayloadTooLarge(Exception):
+    pass
+
+
+def _is_payload_error(r: httpx.Response) -> bool:
+    if r.status_code == 413:
+        return True
+    return r.status_code == 400 and any(h in r.text.lower() for h in PAYLOAD_ERROR_HINTS)
+
+
+def _backoff(attempt: int, base: float, cap: float, retry_after: str | None) -> float:
+    if retry_after:
+        try:
+            return min(cap, float(retry_after))
+        except ValueError:
+            pass
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+async def _post_embeddings(client: httpx.AsyncClient, url: str, model: str, texts: List[str],
+                           max_retries: int, backoff_base: float, backoff_cap: float) -> np.ndarray:
+    for attempt in range(max_retries + 1):
+        try:
+            r = await client.post(url, json={"model": model, "input": texts, "encoding_format": "float"})
+        except httpx.TransportError:
+            if attempt == max_retries:
+                raise
+            await asyncio.sleep(_backoff(attempt, backoff_base, backoff_cap, None))
+            continue
+
+        if _is_payload_error(r):
+            raise PayloadTooLarge(f"{r.status_code}: {r.text[:200]}")
+        if r.status_code == 429 or r.status_code >= 500:
+            if attempt == max_retries:
+                r.raise_for_status()
+            await asyncio.sleep(_backoff(attempt, backoff_base, backoff_cap, r.headers.get("retry-after")))
+            continue
+        r.raise_for_status()
+
+        data = sorted(r.json()["data"], key=lambda d: d.get("index", 0))
+        return np.array([d["embedding"] for d in data], dtype="float32")
+    raise RuntimeError("unreachable")
+
+
+async def aembed_texts_portkey(
+        texts: List[str],
+        model: str,
+        base_url: str,
+        api_key: str,
+        batch_size: int = 64,
+        concurrency: int = 8,
+        normalize: bool = False,
+        max_retries: int = 6,
+        backoff_base: float = 0.5,
+        backoff_cap: float = 30.0,
+        timeout: float = 60.0,
+        headers: Dict[str, str] | None = None,
+) -> np.ndarray:
+    """
+    Embeds texts with up to `concurrency` requests in flight.
+    :param texts: list of texts
+    :param model: model name
+    :param base_url: gateway base url, e.g. $PORTKEY_BASE_URL (…/v1)
+    :param api_key: portkey api key
+    :param batch_size: texts per request (shrinks automatically on payload-size errors)
+    :param concurrency: max in-flight requests
+    :param normalize: bool for normalizing resulting embeddings
+    :param max_retries: retries per request on 429/5xx/transport errors
+    :param backoff_base: first backoff window in seconds (doubles per attempt, full jitter)
+    :param backoff_cap: max backoff in seconds
+    :param timeout: per-request timeout in seconds
+    :param headers: extra headers (merged over the Portkey auth headers)
+    :return: float32 array of vectors in input order
+    """
+    n = len(texts)
+    if n == 0:
+        return np.zeros((0, 0), dtype="float32")
+
+    url = base_url.rstrip("/") + "/embeddings"
+    hdrs = {**createHeaders(api_key=api_key), **(headers or {})}
+    parts: Dict[int, np.ndarray] = {}
+    state = {"cursor": 0, "batch_size": max(1, batch_size)}
+
+    async with httpx.AsyncClient(timeout=timeout, headers=hdrs) as client:
+
+        async def embed_range(start: int, end: int):
+            try:
+                parts[start] = await _post_embeddings(client, url, model, texts[start:end],
+                                                      max_retries, backoff_base, backoff_cap)
+            except PayloadTooLarge:
+                if end - start == 1:
+                    raise
+                mid = (start + end) // 2
+                state["batch_size"] = max(1, min(state["batch_size"], mid - start))
+                await embed_range(start, mid)
+                await embed_range(mid, end)
+
+        async def worker():
+            # the cursor is only touched between awaits, so no lock is needed
+            while state["cursor"] < n:
+                start = state["cursor"]
+                end = min(n, start + state["batch_size"])
+                state["cursor"] = end
+                await embed_range(start, end)
+
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+
+    vecs = np.concatenate([parts[s] for s in sorted(parts)])
+    if normalize:
+        vecs = vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+    return vecs
+
+
+def embed_texts_portkey_async(texts: List[str], model: str, base_url: str, api_key: str, **kwargs) -> np.ndarray:
+    """
+    Synchronous entry point for aembed_texts_portkey (runs its own event loop, so call it from plain
+    synchronous code, not from inside a running loop).
+    """
+    return asyncio.run(aembed_texts_portkey(texts, model, base_url, api_key, **kwargs))
@@ -0,0 +1,388 @@
+"""
+Ingestion benchmark: where the time and memory of building a RAG index go.
+
+Runs on a set of PDFs (a sample directory, or synthetic PDFs generated here) and reports, as JSON:
+1) build_rag stages run one after another - extract (pypdf), chunk, dedup, embed, upsert (vector store) and
+   metadata (metadata store + BM25 index) - with items/s and the peak RSS seen while each stage ran
+2) build_rag end to end, as a subprocess, where the stages overlap - wall time, chunks/s and peak RSS
+3) the Haystack build_indexing_pipeline on the same PDFs, timed per component (skipped when Haystack is missing)
+The stage runs and the Haystack run each happen in a fresh process, so one does not inherit the other's
+models or memory. The embedding cache is disabled, so every chunk is embedded.
+RSS is read with psutil when it is installed, else from /proc (Linux); without either, peaks are reported as null.
+
+Pass --json with a .jsonl path to append one line per run and keep a history for regression tracking.
+"""
+
+from __future__ import annotations
+import argparse, json, multiprocessing, os, random, subprocess, sys, tempfile, threading, time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from functools import wraps
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import yaml
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+try:
+    import resource  # Unix only
+except ImportError:
+    resource = None
+
+from phame.rag_utils.build_rag import (load_config, list_pdfs, read_pdf_pages, make_chunker, chunk_pages,
+                                       file_sha256, make_deduplicator, make_embedder, open_collection,
+                                       upsert_chunks, finish_collection, write_db_metadata)
+from phame.rag_utils.metadata_store import MetadataStore
+from phame.rag_utils.sparse_index import SparseIndex, sparse_index_path
+
+
+VOCAB = ("bolt nut washer shaft bearing gear spline key torque preload fatigue stress strain yield tensile "
+         "shear modulus steel aluminum alloy 6061-T6 weld fillet clearance tolerance fit hole thread pitch "
+         "diameter load factor safety deflection beam column buckling spring rate housing flange gasket seal "
+         "lubrication friction wear surface hardness heat treatment casting forging machining assembly").split()
+
+
+def write_synthetic_pdf(path: Path, pages: List[List[str]]):
+    """
+    Writes a minimal text-only PDF (Helvetica, one text object per page) without any PDF library.
+    :param path: output file
+    :param pages: lines of text per page (latin-1)
+    """
+    n = len(pages)
+    kids = " ".join(f"{4 + 2 * i} 0 R" for i in range(n))
+    objs = [b"<< /Type /Catalog /Pages 2 0 R >>",
+            f"<< /Type /Pages /Kids [{kids}] /Count {n} >>".encode(),
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    for i, lines in enumerate(pages):
+        text = "".join("(" + line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ") '\n"
+                       for line in lines)
+        stream = f"BT /F1 10 Tf 12 TL 50 770 Td\n{text}ET".encode("latin-1")
+        objs.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> "
+                    f"/Contents {5 + 2 * i} 0 R >>".encode())
+        objs.append(f"<< /Length {len(stream)} >>\nstream\n".encode() + stream + b"\nendstream")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, body in enumerate(objs, start=1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objs) + 1}\n0000000000 65535 f \n".encode()
+    out += b"".join(f"{o:010d} 00000 n \n".encode() for o in offsets)
+    out += f"trailer\n<< /Size {len(objs) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    path.write_bytes(bytes(out))
+
+
+def make_synthetic_pdfs(out_dir: str | Path, n_pdfs: int = 20, pages: int = 30, lines: int = 50,
+                        seed: int = 0) -> List[Path]:
+    """
+    :param out_dir: directory the PDFs are written to
+    :param n_pdfs: number of PDFs
+    :param pages: pages per PDF
+    :param lines: lines of ~12 words per page (50 lines is about a dense textbook page)
+    :param seed: random seed; the same arguments always produce the same files
+    :return: paths of the PDFs
+    """
+    rng = random.Random(seed)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for d in range(n_pdfs):
+        doc = [[" ".join(rng.choices(VOCAB, k=12)) + ("." if rng.random() < 0.3 else "") for _ in range(lines)]
+               for _ in range(pages)]
+        path = out_dir / f"synthetic_{d:04d}.pdf"
+        write_synthetic_pdf(path, doc)
+        paths.append(path)
+    return paths
+
+
+def process_rss(pid: int | None = None) -> int | None:
+    """
+    :param pid: process to read (default: this one); with psutil its child processes are counted too
+    :return: resident set size in bytes, or None when it cannot be read (process gone, or no psutil / procfs)
+    """
+    if psutil is not None:
+        try:
+            proc = psutil.Process(pid)
+            procs = [proc] + (proc.children(recursive=True) if pid is not None else [])
+            return sum(p.memory_info().rss for p in procs)
+        except psutil.Error:
+            return None
+    try:
+        with open(f"/proc/{pid or 'self'}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        pass
+    if pid is None and resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024  # bytes on macOS, KiB elsewhere; peak so far
+    return None
+
+
+class RssSampler:
+    """
+    Samples the RSS of a process on a background thread while the block runs; .peak is the highest value seen
+    (None when the RSS cannot be read on this platform).
+    """
+    def __init__(self, pid: int | None = None, interval: float = 0.01):
+        """
+        :param pid: process to sample (default: this one)
+        :param interval: seconds between samples
+        """
+        self.pid = pid
+        self.interval = interval
+        self.peak: int | None = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        rss = process_rss(self.pid)
+        if rss is not None:
+            self.peak = rss if self.peak is None else max(self.peak, rss)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._sample()
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+def mb(n_bytes: int | None) -> float | None:
+    return None if n_bytes is None else n_bytes / 2**20
+
+
+def measure(stages: Dict[str, Any], name: str, unit: str, fn: Callable[[], Any],
+            count: Callable[[Any], int]) -> Any:
+    """
+    Runs one stage and records seconds, item count, throughput and peak RSS under stages[name].
+    :param count: maps the stage's result to the number of items it processed
+    :return: the stage's result
+    """
+    with RssSampler() as rss:
+        t0 = time.perf_counter()
+        result = fn()
+        seconds = time.perf_counter() - t0
+    n = count(result)
+    stages[name] = {"seconds": seconds, unit: n, f"{unit}_per_s": n / seconds if seconds > 0 else None,
+                    "peak_rss_mb": mb(rss.peak)}
+    return result
+
+
+def bench_build_rag_stages(pdfs: List[Path], config: Dict[str, Any], persist_dir: str) -> Dict[str, Any]:
+    """
+    Runs the build_rag stages one at a time over all PDFs, so each is timed on its own.
+    :param pdfs: PDFs to ingest
+    :param config: config dictionary (chunking, dedup, embedding, chroma, sparse and outputs sections are used)
+    :param persist_dir: scratch directory for the collection, metadata store and BM25 index
+    :return: per-stage results
+    """
+    stages: Dict[str, Any] = {}
+    chunker = make_chunker(config)
+    batch = config["chroma"].get("upsert_batch_size", 2048)
+
+    pages = measure(stages, "extract", "pages", lambda: [read_pdf_pages(p) for p in pdfs],
+                    lambda r: sum(len(p) for p in r))
+    hashes = [file_sha256(p) for p in pdfs]
+    chunks = measure(stages, "chunk", "chunks",
+                     lambda: [c for p, pg, h in zip(pdfs, pages, hashes) for c in chunk_pages(pg, str(p), chunker, h)],
+                     len)
+    dedup = make_deduplicator(config)
+    if dedup is not None:
+        n_in = len(chunks)
+        chunks = measure(stages, "dedup", "chunks", lambda: dedup.filter(chunks)[0], lambda _: n_in)
+        stages["dedup"]["kept"] = len(chunks)
+
+    embed_fn = measure(stages, "model_load", "models", lambda: make_embedder(config, show_progress=False),
+                       lambda _: 1)
+    texts = [c.text for c in chunks]
+    vecs = measure(stages, "embed", "embeddings", lambda: embed_fn(texts), len)
+
+    def upsert():
+        col = open_collection(persist_dir, config["chroma"]["collection"], True,
+                              backend=config["chroma"].get("backend", "chroma"),
+                              quantization=config["chroma"].get("quantization"),
+                              shards=config["chroma"].get("shards", 1))
+        for i in range(0, len(chunks), batch):
+            upsert_chunks(col, chunks[i:i + batch], texts[i:i + batch], vecs[i:i + batch])
+        finish_collection(col)
+        return len(chunks)
+    measure(stages, "upsert", "upserts", upsert, lambda n: n)
+
+    def metadata():
+        meta_dir = Path(persist_dir) / "metadata"
+        if config["outputs"].get("metadata_format", "jsonl") == "sqlite":
+            with closing(MetadataStore(meta_dir / "metadata.sqlite")) as store:
+                store.clear()
+                store.add(chunks)
+        else:
+            meta_dir.mkdir(parents=True, exist_ok=True)
+            with open(meta_dir / "metadata.jsonl", "w", encoding="utf-8") as f:
+                write_db_metadata(f, chunks)
+        if config.get("sparse", {}).get("enabled", False):
+            with closing(SparseIndex(sparse_index_path(persist_dir, config["chroma"]["collection"]))) as sparse:
+                sparse.clear()
+                for i in range(0, len(chunks), batch):
+                    sparse.add([c.id for c in chunks[i:i + batch]], texts[i:i + batch])
+        return len(chunks)
+    measure(stages, "metadata", "rows", metadata, lambda n: n)
+    return stages
+
+
+def bench_build_rag_e2e(pdf_dir: str, config: Dict[str, Any], work_dir: Path) -> Dict[str, Any]:
+    """
+    Runs build_rag.py as a subprocess (stages overlapping, as in production) on a fresh persist dir.
+    :return: wall time, chunks/s and the subprocess's peak RSS
+    """
+    persist_dir = work_dir / "build_rag_e2e"
+    cfg_path = work_dir / "build_rag_e2e.yml"
+    cfg_path.write_text(yaml.safe_dump(config), encoding="utf-8")
+    cmd = [sys.executable, "-m", "phame.rag_utils.build_rag", "--config", str(cfg_path),
+           "--pdf_dir", pdf_dir, "--persist_dir", str(persist_dir), "--recreate"]
+    # the package root goes on the child's path, so phame imports work without an installed package
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(Path(__file__).resolve().parents[2]),
+                                                      env.get("PYTHONPATH")]))
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=env)
+    with RssSampler(proc.pid) as rss:
+        output, _ = proc.communicate()
+    seconds = time.perf_counter() - t0
+    if proc.returncode != 0:
+        return {"error": output[-2000:]}
+    # build_rag puts the metadata under --persist_dir, in the configured format
+    if config["outputs"].get("metadata_format", "jsonl") == "sqlite":
+        with closing(MetadataStore(persist_dir / "metadata" / "metadata.sqlite", readonly=True)) as store:
+            n_chunks = store.count()
+    else:
+        with open(persist_dir / "metadata" / "metadata.jsonl", "r", encoding="utf-8") as f:
+            n_chunks = sum(1 for line in f if line.strip())
+    return {"seconds": seconds, "chunks": n_chunks, "chunks_per_s": n_chunks / seconds,
+            "peak_rss_mb": mb(rss.peak)}
+
+
+def bench_haystack(pdf_dir: str, embedding_model: str, persist_dir: str, sparse: bool = True) -> Dict[str, Any]:
+    """
+    Runs the Haystack indexing pipeline of rag_pipeline.py, timing each component's run().
+    :return: per-component results, plus total wall time and peak RSS
+    """
+    try:
+        from phame.haystack.rag_pipeline import (make_chroma_document_store, build_indexing_pipeline,
+                                                           index_pdf_dir)
+    except ImportError as e:
+        return {"error": f"Haystack not available: {e}"}
+
+    store = make_chroma_document_store(persist_path=persist_dir)
+    sparse_path = str(sparse_index_path(persist_dir, "documents")) if sparse else None
+    pipeline = build_indexing_pipeline(store, embedding_model, cache_dir=None, sparse_index=sparse_path)
+    stages: Dict[str, Any] = {}
+
+    def timed(name: str, run: Callable) -> Callable:
+        @wraps(run)
+        def wrapper(**kwargs):
+            out = measure(stages, name, "documents", lambda: run(**kwargs),
+                          lambda o: len(o["documents"]) if "documents" in o else o.get("documents_written", 0))
+            return out
+        return wrapper
+
+    for name in list(pipeline.graph.nodes):
+        comp = pipeline.get_component(name)
+        comp.run = timed(name, comp.run)  # the pipeline calls instance.run, so the instance attribute wins
+    with RssSampler() as rss:
+        t0 = time.perf_counter()
+        written = index_pdf_dir(pdf_dir, pipeline)
+        seconds = time.perf_counter() - t0
+    return {"components": stages, "seconds": seconds, "documents_written": written,
+            "documents_per_s": written / seconds, "peak_rss_mb": mb(rss.peak)}
+
+
+def run_isolated(fn: Callable, *args) -> Dict[str, Any]:
+    """
+    Runs fn(*args) in a fresh (spawned) process, so its memory is measured from a clean start.
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(fn, *args).result()
+
+
+def fmt_mb(value: float | None) -> str:
+    return "      - MB" if value is None else f"{value:7.1f} MB"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark RAG ingestion throughput and memory per stage.")
+    ap.add_argument("--config", type=str, default=None)
+    ap.add_argument("--pdf_dir", type=str, default=None, help="sample PDFs (default: generate synthetic ones)")
+    ap.add_argument("--pdfs", type=int, default=20, help="synthetic PDFs to generate")
+    ap.add_argument("--pages", type=int, default=30, help="pages per synthetic PDF")
+    ap.add_argument("--skip", type=str, nargs="*", default=[], choices=["stages", "e2e", "haystack"])
+    ap.add_argument("--work_dir", type=str, default=None, help="scratch directory (default: a temp dir)")
+    ap.add_argument("--json", type=str, default="outputs/bench/ingest.json",
+                    help="results file; a .jsonl path gets one line appended per run")
+    args = ap.parse_args()
+
+    config = load_config(args.config)
+    config["embedding"]["cache_dir"] = None  # measure real embedding work
+    config["chroma"]["incremental"] = False
+
+    with tempfile.TemporaryDirectory(dir=args.work_dir) as tmp:
+        work_dir = Path(tmp)
+        pdf_dir = args.pdf_dir or str(work_dir / "pdfs")
+        if not args.pdf_dir:
+            make_synthetic_pdfs(pdf_dir, args.pdfs, args.pages)
+        pdfs = list_pdfs(pdf_dir)
+        if not pdfs:
+            raise SystemExit(f"No PDFs found under: {pdf_dir}")
+
+        result: Dict[str, Any] = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "inputs": {"pdf_dir": args.pdf_dir or "synthetic", "pdfs": len(pdfs),
+                       "bytes": sum(p.stat().st_size for p in pdfs)},
+            "settings": {"chunking": config["chunking"], "embedding_model": config["embedding"]["model"],
+                         "backend": config["chroma"].get("backend", "chroma"), "shards": config["chroma"].get("shards", 1),
+                         "dedup": config["dedup"].get("enabled", False), "sparse": config["sparse"].get("enabled", False)},
+        }
+        if "stages" not in args.skip:
+            print(f"build_rag stages on {len(pdfs)} PDFs…")
+            result["build_rag_stages"] = run_isolated(bench_build_rag_stages, pdfs, config,
+                                                      str(work_dir / "build_rag_stages"))
+        if "e2e" not in args.skip:
+            print("build_rag end to end…")
+            result["build_rag_e2e"] = bench_build_rag_e2e(pdf_dir, config, work_dir)
+        if "haystack" not in args.skip:
+            print("Haystack indexing pipeline…")
+            result["haystack"] = run_isolated(bench_haystack, pdf_dir, config["embedding"]["model"],
+                                              str(work_dir / "haystack"), config["sparse"].get("enabled", False))
+
+    for name, stage in result.get("build_rag_stages", {}).items():
+        unit = next(k for k in stage if k.endswith("_per_s"))
+        rate = "-" if stage[unit] is None else f"{stage[unit]:.1f}"
+        print(f"  {name:11} {stage['seconds']:8.2f}s {rate:>10} {unit:18} peak {fmt_mb(stage['peak_rss_mb'])}")
+    for name in ("build_rag_e2e", "haystack"):
+        r = result.get(name)
+        if r is not None:
+            print(f"  {name:11} " + (r["error"].splitlines()[-1] if "error" in r else
+                                     f"{r['seconds']:8.2f}s peak {fmt_mb(r['peak_rss_mb'])}"))
+
+    out = Path(args.json)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    if out.suffix == ".jsonl":
+        with open(out, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result) + "\n")
+    else:
+        out.write_text(json.dumps(result, indent=2), encoding="utf-8")
+    print(f"Results written to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+Retrieval benchmark: quality and latency of a built index against a labelled query set.
+
+The query set is a JSONL file, one query per line:
+    {"query": "preload of a 1/2-13 bolt", "relevant": [{"source": "shigley.pdf", "page": 431}, {"source": "*bolts*"}]}
+A label matches a hit when the hit's source path matches `source` (a glob, case-insensitive; a plain name matches
+as a path suffix) and, if `page` is given, the hit is on that page (1-based, as stored by build_rag and Haystack).
+
+Each configuration is run query by query, so the timings are per-query latencies (embedding + search), and
+scored with:
+1) recall@k - fraction of a query's labels matched by at least one of the top k hits
+2) MRR - reciprocal rank of the first relevant hit
+3) nDCG@k - binary gains, a hit counting once for each label it is the first to match
+The on-disk size of the vector index (and of the BM25 index, when hybrid retrieval uses it) is reported with them.
+
+Backends: the query_rag Retriever over a Chroma collection or a flat index (any chroma/retrieval settings of the
+config apply, including hybrid, MMR and shards), or a Haystack ChromaEmbeddingRetriever over a document store
+written by phame/haystack/trusted_references_rag.py. Models are only loaded from the local Hugging Face cache (or
+a local path in embedding.model), so runs need no network; export HF_HUB_OFFLINE=0 to allow downloads.
+"""
+
+from __future__ import annotations
+import os
+
+# must be set before sentence_transformers / huggingface_hub are imported
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+import argparse, copy, json, math, time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+
+from phame.rag_utils.build_rag import load_config
+from phame.rag_utils.filters import RetrievalFilter
+from phame.rag_utils.flat_index import flat_index_dir
+from phame.rag_utils.shards import shard_dir
+from phame.rag_utils.sparse_index import sparse_index_path
+
+
+BACKENDS = ("chroma", "flat", "haystack")
+
+
+@dataclass
+class LabelledQuery:
+    query: str
+    relevant: List[RetrievalFilter] = field(default_factory=list)
+
+
+def load_queries(path: str | Path) -> List[LabelledQuery]:
+    """
+    :param path: JSONL query set (see module docstring)
+    :return: labelled queries (lines without labels are skipped)
+    """
+    out: List[LabelledQuery] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            d = json.loads(line)
+            labels = []
+            for lab in d.get("relevant", []):
+                src = lab.get("source")
+                if src is not None and not any(ch in src for ch in "*?["):
+                    src = "*" + src
+                labels.append(RetrievalFilter(source=src, page_min=lab.get("page"), page_max=lab.get("page")))
+            if labels:
+                out.append(LabelledQuery(d["query"], labels))
+    return out
+
+
+def score_hits(metas: List[Dict[str, Any]], labels: List[RetrievalFilter], ks: List[int],
+               source_key: str = "source", page_key: str = "page") -> Dict[str, float]:
+    """
+    :param metas: metadata of the hits, best first
+    :param labels: relevance labels of the query
+    :param ks: cut-offs for recall@k; nDCG is computed at max(ks)
+    :param source_key: metadata key holding the source path
+    :param page_key: metadata key holding the page number
+    :return: {"recall@k": ..., "mrr": ..., "ndcg@K": ...}
+    """
+    first: List[int | None] = []
+    for lab in labels:
+        rank = next((r for r, m in enumerate(metas, start=1) if lab.matches(m, source_key, page_key)), None)
+        first.append(rank)
+    out = {f"recall@{k}": sum(r is not None and r <= k for r in first) / len(labels) for k in ks}
+    found = [r for r in first if r is not None]
+    out["mrr"] = 1.0 / min(found) if found else 0.0
+
+    k_max = max(ks)
+    dcg = sum(1.0 / math.log2(r + 1) for r in found if r <= k_max)
+    idcg = sum(1.0 / math.log2(r + 1) for r in range(1, min(k_max, len(labels)) + 1))
+    out[f"ndcg@{k_max}"] = min(1.0, dcg / idcg)
+    return out
+
+
+def dir_bytes(path: Path) -> int:
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file()) if path.exists() else 0
+
+
+def index_bytes(config: Dict[str, Any], backend: str) -> Dict[str, int]:
+    """
+    :return: on-disk bytes of the vector index and of the BM25 index (0 when it is not used)
+    """
+    persist_dir = Path(config["chroma"]["persist_dir"])
+    collection = config["chroma"]["collection"]
+    if backend == "haystack":
+        return {"vectors": dir_bytes(persist_dir), "sparse": 0}
+    shards = config["chroma"].get("shards", 1)
+    roots = [shard_dir(persist_dir, i) for i in range(shards)] if shards > 1 else [persist_dir]
+    vectors = 0
+    for root in roots:
+        if backend == "flat":
+            vectors += dir_bytes(flat_index_dir(root, collection))
+        else:
+            # chroma.sqlite3 plus one directory per HNSW segment (named by segment uuid)
+            vectors += (root / "chroma.sqlite3").stat().st_size if (root / "chroma.sqlite3").exists() else 0
+            vectors += sum(dir_bytes(p) for p in root.iterdir() if p.is_dir() and len(p.name) == 36)
+    sparse = sparse_index_path(persist_dir, collection)
+    hybrid = config["retrieval"].get("hybrid", False) and sparse.exists()
+    return {"vectors": vectors, "sparse": sparse.stat().st_size if hybrid else 0}
+
+
+def make_search(config: Dict[str, Any], backend: str, k: int) -> Tuple[Callable[[str], List[Dict]], str, str]:
+    """
+    Opens the backend once and warms it up.
+    :param config: config dictionary
+    :param backend: chroma | flat | haystack
+    :param k: hits per query
+    :return: (function from query text to hit metadata, source metadata key, page metadata key)
+    """
+    if backend == "haystack":
+        from haystack.components.embedders import SentenceTransformersTextEmbedder
+        from haystack_integrations.components.retrievers.chroma import ChromaEmbeddingRetriever
+        from phame.haystack.rag_pipeline import make_chroma_document_store
+
+        store = make_chroma_document_store(persist_path=config["chroma"]["persist_dir"])
+        embedder = SentenceTransformersTextEmbedder(model=config["embedding"]["model"])
+        embedder.warm_up()
+        retriever = ChromaEmbeddingRetriever(document_store=store, top_k=k)
+
+        def search(text: str) -> List[Dict]:
+            emb = embedder.run(text=text)["embedding"]
+            return [d.meta for d in retriever.run(query_embedding=emb, top_k=k)["documents"]]
+        search("warm up")
+        return search, "file_path", "page_number"
+
+    from phame.rag_utils.query_rag import Retriever
+
+    retriever = Retriever(config)  # warms itself up
+
+    def search(text: str) -> List[Dict]:
+        return retriever.query(text, top_k=k)["metadatas"][0]
+    return search, "source", "page"
+
+
+def run_benchmark(config: Dict[str, Any], backend: str, queries: List[LabelledQuery], ks: List[int],
+                  use_cache: bool = False) -> Dict[str, Any]:
+    """
+    :param config: config dictionary (chroma.persist_dir / collection point at the built index)
+    :param backend: chroma | flat | haystack
+    :param queries: labelled queries
+    :param ks: recall cut-offs
+    :param use_cache: keep the configured query-embedding caches (default: every query is embedded)
+    :return: averaged metrics, latency percentiles (ms) and index sizes (bytes)
+    """
+    config = copy.deepcopy(config)
+    if backend != "haystack":
+        config["chroma"]["backend"] = backend
+    if config["embedding"].get("source", "").lower().startswith("portkey"):
+        raise SystemExit("The benchmark runs offline; set embedding.source to sentence-transformers.")
+    if not use_cache:
+        config["embedding"]["cache_dir"] = None
+        config["embedding"]["query_cache_size"] = 0
+    k_max = max(ks)
+    search, source_key, page_key = make_search(config, backend, k_max)
+
+    scores: List[Dict[str, float]] = []
+    ms: List[float] = []
+    for q in queries:
+        t0 = time.perf_counter()
+        metas = search(q.query)
+        ms.append((time.perf_counter() - t0) * 1000)
+        scores.append(score_hits(metas[:k_max], q.relevant, ks, source_key, page_key))
+
+    out: Dict[str, Any] = {k: float(np.mean([s[k] for s in scores])) for k in scores[0]}
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    out.update({"p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99),
+                "mean_ms": float(np.mean(ms)), "queries": len(queries)})
+    out.update({f"{name}_bytes": n for name, n in index_bytes(config, backend).items()})
+    return out
+
+
+def print_report(rows: List[Dict[str, Any]], ks: List[int]):
+    cols = [f"recall@{k}" for k in ks] + ["mrr", f"ndcg@{max(ks)}"]
+    print(f"{'run':30} " + " ".join(f"{c:>9}" for c in cols)
+          + f" {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'index MB':>9}")
+    for r in rows:
+        size = (r["vectors_bytes"] + r["sparse_bytes"]) / 2**20
+        print(f"{r['run'][:30]:30} " + " ".join(f"{r[c]:>9.3f}" for c in cols)
+              + f" {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} {size:>9.1f}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark retrieval quality and latency on a labelled query set.")
+    ap.add_argument("--queries", type=str, required=True, help="JSONL of {query, relevant: [{source, page}]}")
+    ap.add_argument("--config", type=str, action="append", default=None,
+                    help="config to benchmark; repeat to compare several (default: DEFAULTS_RAG)")
+    ap.add_argument("--backend", type=str, choices=BACKENDS, action="append", default=None,
+                    help="repeat to compare backends (default: chroma.backend of each config)")
+    ap.add_argument("--persist_dir", type=str, default=None)
+    ap.add_argument("--collection", type=str, default=None)
+    ap.add_argument("--k", type=int, nargs="+", default=[1, 5, 10], help="recall@k cut-offs")
+    ap.add_argument("--cache", action="store_true", help="keep query-embedding caches (measures warm repeats)")
+    ap.add_argument("--json", type=str, default=None, help="also write the results to this file")
+    args = ap.parse_args()
+
+    queries = load_queries(args.queries)
+    if not queries:
+        raise SystemExit(f"No labelled queries in {args.queries}")
+    ks = sorted(set(args.k))
+
+    rows: List[Dict[str, Any]] = []
+    for cfg_path in args.config or [None]:
+        config = load_config(cfg_path)
+        if args.persist_dir:
+            config["chroma"]["persist_dir"] = args.persist_dir
+        if args.collection:
+            config["chroma"]["collection"] = args.collection
+        for backend in args.backend or [config["chroma"].get("backend", "chroma")]:
+            name = f"{Path(cfg_path).stem if cfg_path else 'defaults'}/{backend}"
+            print(f"Running {name} ({len(queries)} queries)…")
+            rows.append({"run": name, "config": cfg_path, "backend": backend,
+                         **run_benchmark(config, backend, queries, ks, args.cache)})
+
+    print_report(rows, ks)
+    if args.json:
+        Path(args.json).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.json).write_text(json.dumps(rows, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
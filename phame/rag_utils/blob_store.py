@@ -0,0 +1,141 @@
+"""
+Content store for large per-record payloads (e.g. text2cad CadQuery sources) kept out of Chroma metadata.
+
+Payloads are appended as utf-8 to a single blobs.bin file and read back through a memory map. index.sqlite maps
+each key (uid) to its (offset, length). Re-putting a key appends the new payload and repoints the index; the old
+bytes stay behind until compact() is called.
+"""
+
+from __future__ import annotations
+import mmap, os, sqlite3
+from pathlib import Path
+from typing import Dict, List
+
+
+class BlobStore:
+    def __init__(self, root: str | Path, readonly: bool = False):
+        """
+        :param root: directory holding blobs.bin and index.sqlite
+        :param readonly: open for lookups only
+        """
+        self.root = Path(root)
+        self.blob_path = self.root / "blobs.bin"
+        if readonly:
+            self.db = sqlite3.connect(f"file:{(self.root / 'index.sqlite').as_posix()}?mode=ro", uri=True,
+                                      check_same_thread=False)
+        else:
+            self.root.mkdir(parents=True, exist_ok=True)
+            self.blob_path.touch()
+            self.db = sqlite3.connect(str(self.root / "index.sqlite"), check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS blobs (key TEXT PRIMARY KEY, offset INTEGER NOT NULL, "
+                            "length INTEGER NOT NULL)")
+            self.db.commit()
+        self._f = None
+        self._mm = None
+
+    def _view(self, need: int) -> mmap.mmap | bytes:
+        if need == 0:
+            return b""  # an empty file cannot be mapped
+        # remap only when the file has grown past what the current map covers
+        if self._mm is None or len(self._mm) < need:
+            if self._mm is not None:
+                self._mm.close()
+            if self._f is None:
+                self._f = open(self.blob_path, "rb")
+            self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mm
+
+    def put_many(self, keys: List[str], texts: List[str]):
+        """
+        Appends payloads and points their keys at them.
+        :param keys: record keys
+        :param texts: payloads, one per key
+        """
+        if not keys:
+            return
+        data = [t.encode("utf-8") for t in texts]
+        offset = self.blob_path.stat().st_size
+        rows = []
+        # payloads first, index second: a crash in between only leaves unreferenced bytes behind
+        with open(self.blob_path, "ab") as f:
+            for k, d in zip(keys, data):
+                rows.append((k, offset, len(d)))
+                offset += len(d)
+            f.write(b"".join(data))
+            f.flush()
+            os.fsync(f.fileno())
+        self.db.executemany("INSERT OR REPLACE INTO blobs (key, offset, length) VALUES (?, ?, ?)", rows)
+        self.db.commit()
+
+    def get_many(self, keys: List[str]) -> List[str | None]:
+        """
+        Looks up payloads.
+        :param keys: record keys
+        :return: payload per key, None where the key is unknown
+        """
+        found: Dict[str, tuple] = {}
+        uniq = list(dict.fromkeys(keys))
+        for i in range(0, len(uniq), 900):
+            part = uniq[i:i + 900]
+            q = f"SELECT key, offset, length FROM blobs WHERE key IN ({','.join('?' * len(part))})"
+            found.update((k, (o, n)) for k, o, n in self.db.execute(q, part))
+        if not found:
+            return [None] * len(keys)
+        mm = self._view(max(o + n for o, n in found.values()))
+        out = []
+        for k in keys:
+            if k in found:
+                o, n = found[k]
+                out.append(mm[o:o + n].decode("utf-8"))
+            else:
+                out.append(None)
+        return out
+
+    def get(self, key: str) -> str | None:
+        return self.get_many([key])[0]
+
+    def delete(self, keys: List[str]):
+        for i in range(0, len(keys), 900):
+            part = keys[i:i + 900]
+            self.db.execute(f"DELETE FROM blobs WHERE key IN ({','.join('?' * len(part))})", part)
+        self.db.commit()
+
+    def clear(self):
+        self.close_view()
+        self.db.execute("DELETE FROM blobs")
+        self.db.commit()
+        self.blob_path.write_bytes(b"")
+
+    def compact(self):
+        """
+        Rewrites blobs.bin keeping only the payloads the index still points at.
+        """
+        rows = self.db.execute("SELECT key, offset, length FROM blobs ORDER BY offset").fetchall()
+        mm = self._view(max((o + n for _, o, n in rows), default=0)) if rows else None
+        tmp = self.blob_path.with_suffix(".tmp")
+        new_rows, pos = [], 0
+        with open(tmp, "wb") as f:
+            for k, o, n in rows:
+                f.write(mm[o:o + n])
+                new_rows.append((k, pos, n))
+                pos += n
+        self.close_view()
+        os.replace(tmp, self.blob_path)
+        self.db.execute("DELETE FROM blobs")
+        self.db.executemany("INSERT INTO blobs (key, offset, length) VALUES (?, ?, ?)", new_rows)
+        self.db.commit()
+
+    def count(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM blobs").fetchone()[0]
+
+    def close_view(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def close(self):
+        self.close_view()
+        self.db.close()
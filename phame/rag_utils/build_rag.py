@@ -8,10 +8,14 @@ This python file is meant for building a RAG database using Chroma. It does so w
 
 
 from __future__ import annotations
-import argparse, os, json, uuid
-from dataclasses import dataclass, asdict
+import argparse, copy, os, re, json, uuid, time, queue, threading, hashlib
+from collections import deque
+from contextlib import ExitStack, closing
+from itertools import chain, islice
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, asdict, field
 from pathlib import Path
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any, Iterator, Iterable, Callable
 
 import yaml
 from tqdm import tqdm
@@ -23,6 +27,13 @@ import chromadb
 from chromadb.config import Settings
 
 from phame.rag_utils.globals import DEFAULTS_RAG
+from phame.rag_utils.embedding_cache import make_cache, cached_embedder
+from phame.rag_utils.async_embed import embed_texts_portkey_async
+from phame.rag_utils.dedup import ChunkDeduplicator, iter_deduped_batches
+from phame.rag_utils.metadata_store import MetadataStore
+from phame.rag_utils.flat_index import open_flat_index
+from phame.rag_utils.sparse_index import SparseIndex, sparse_index_path
+from phame.rag_utils.shards import open_shards
 
 from portkey_ai import Portkey
 
@@ -36,6 +47,19 @@ class Chunk:
     start: int
     end: int
     text: str
+    tag: str | None = None  # collection tag given at ingestion, for filtered retrieval
+
+
+@dataclass
+class PdfResult:
+    path: Path
+    chunks: List[Chunk] = field(default_factory=list)
+    pages: int = 0
+    n_chunks: int = 0
+    sha256: str = ""
+    chunk_ids: List[str] = field(default_factory=list)
+    seconds: float = 0.0
+    error: str | None = None
 
 
 # I/O
@@ -46,7 +70,8 @@ def load_config(path: str | None) -> Dict[str, Any]:
     :param path: config path (yaml file)
     :return: config dictionary
     """
-    cfg = DEFAULTS_RAG.copy()
+    # deep copy: the sections are updated in place below and must not leak into DEFAULTS_RAG
+    cfg = copy.deepcopy(DEFAULTS_RAG)
     if path:
         with open(path, "r", encoding="utf-8") as f:
             user = yaml.safe_load(f) or {}
@@ -61,7 +86,7 @@ def list_pdfs(root: str='.') -> List[Path]:
     :param root: directotry root
     :return: list of pdf locations on disk
     """
-    return [Path(p) for p in Path(root).rglob('*.pdf')]
+    return sorted(Path(p) for p in Path(root).rglob('*.pdf'))
 
 def read_pdf_pages(pdf_path: Path) -> List[str]:
     """
@@ -105,25 +130,281 @@ def sliding_chunks(text: str, size: int, overlap: int) -> List[Tuple[int,int,str
         start = end - overlap
     return chunks
 
-def chunk_pdf(pdf_path: Path, chunk_size: int, overlap: int) -> List[Chunk]:
+@dataclass
+class CharChunker:
+    """Fixed character windows (sliding_chunks)."""
+    size: int
+    overlap: int
+
+    def __post_init__(self):
+        if self.overlap >= self.size:
+            raise ValueError("overlap must be < chunk_size")
+
+    def settings(self) -> Dict[str, Any]:
+        return {"method": "chars", "size": self.size, "overlap": self.overlap}
+
+    def __call__(self, text: str) -> List[Tuple[int, int, str]]:
+        return sliding_chunks(text, self.size, self.overlap)
+
+
+@dataclass
+class TokenChunker:
     """
-    This function takes a list of page texts, and chunks each one and returns a list of Chunk classes.
-    :param pdf_path: dir to all pdfs
-    :param chunk_size: size for chunk
-    :param overlap: size of overlap between chunks (i.e. the end of one chunk starts another)
+    Windows of at most max_tokens model tokens. The page is tokenized once with offsets, so windows are cut on
+    token boundaries and never split a word mid-token. The tokenizer is loaded lazily, once per process.
+    """
+    tokenizer: str
+    max_tokens: int
+    overlap_tokens: int
+    _tok: Any = field(default=None, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        if self.overlap_tokens >= self.max_tokens:
+            raise ValueError("overlap_tokens must be < max_tokens")
+
+    def __getstate__(self):
+        # ship only the settings to pool workers; each worker loads its own tokenizer
+        return {k: v for k, v in self.__dict__.items() if k != "_tok"}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._tok = None
+
+    def settings(self) -> Dict[str, Any]:
+        return {"method": "tokens", "tokenizer": self.tokenizer, "max_tokens": self.max_tokens,
+                "overlap_tokens": self.overlap_tokens}
+
+    def __call__(self, text: str) -> List[Tuple[int, int, str]]:
+        if not text:
+            return []
+        if self._tok is None:
+            from transformers import AutoTokenizer
+            self._tok = AutoTokenizer.from_pretrained(self.tokenizer, use_fast=True)
+        enc = self._tok(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+        offs = np.asarray(enc["offset_mapping"], dtype=np.int64).reshape(-1, 2)
+        n = len(offs)
+        if n == 0:
+            return []
+        step = self.max_tokens - self.overlap_tokens
+        first = np.arange(0, max(n - self.overlap_tokens, 1), step)
+        last = np.minimum(first + self.max_tokens, n) - 1
+        chunks = []
+        for s, e in zip(offs[first, 0], offs[last, 1]):
+            t = text[s:e].strip()
+            if t:
+                chunks.append((int(s), int(e), t))
+        return chunks
+
+
+# sentence ends followed by whitespace, or blank lines (paragraph breaks)
+_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+
+@dataclass
+class SentenceChunker:
+    """
+    Packs whole sentences/paragraphs greedily into chunks of at most size characters. Consecutive chunks share
+    trailing sentences worth up to overlap characters. A single sentence longer than size falls back to
+    character windows.
+    """
+    size: int
+    overlap: int
+
+    def __post_init__(self):
+        if self.overlap >= self.size:
+            raise ValueError("overlap must be < chunk_size")
+
+    def settings(self) -> Dict[str, Any]:
+        return {"method": "sentences", "size": self.size, "overlap": self.overlap}
+
+    def __call__(self, text: str) -> List[Tuple[int, int, str]]:
+        if not text:
+            return []
+        # (start, end) spans of sentences, in one regex pass over the page
+        spans, pos = [], 0
+        for m in _BOUNDARY.finditer(text):
+            if m.start() > pos:
+                spans.append((pos, m.start()))
+            pos = m.end()
+        if pos < len(text):
+            spans.append((pos, len(text)))
+
+        chunks: List[Tuple[int, int, str]] = []
+        def emit(s: int, e: int):
+            t = text[s:e].strip()
+            if t:
+                chunks.append((s, e, t))
+
+        i, n = 0, len(spans)
+        while i < n:
+            s0, e0 = spans[i]
+            if e0 - s0 > self.size:
+                for s, e, t in sliding_chunks(text[s0:e0], self.size, self.overlap):
+                    chunks.append((s0 + s, s0 + e, t))
+                i += 1
+                continue
+            j = i + 1
+            while j < n and spans[j][1] - s0 <= self.size:
+                j += 1
+            emit(s0, spans[j - 1][1])
+            if j >= n:
+                break
+            # step back over trailing sentences that fit in the overlap, but always make progress
+            k = j
+            while k - 1 > i and spans[j - 1][1] - spans[k - 1][0] <= self.overlap:
+                k -= 1
+            i = k
+        return chunks
+
+
+def make_chunker(config: Dict[str, Any]):
+    """
+    Builds the chunker selected by chunking.method ("chars", "tokens" or "sentences"). A chunker is a picklable
+    callable mapping a page of text to (start, end, text) tuples, so it can be shipped to pool workers.
+    :param config: config dictionary
+    :return: chunker
+    """
+    c = config["chunking"]
+    method = c.get("method", "chars")
+    if method == "chars":
+        return CharChunker(c["chunk_size"], c["overlap"])
+    if method == "tokens":
+        return TokenChunker(c.get("tokenizer") or config["embedding"]["model"],
+                            c.get("max_tokens", 256), c.get("overlap_tokens", 32))
+    if method == "sentences":
+        return SentenceChunker(c["chunk_size"], c["overlap"])
+    raise ValueError(f"Unknown chunking.method: {method!r} (expected chars, tokens or sentences)")
+
+def file_sha256(path: Path) -> str:
+    """
+    Content hash of a file, read in 1 MB blocks.
+    :param path: file location on disk
+    :return: hex digest
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def chunk_id(doc_hash: str, page: int, start: int) -> str:
+    """
+    Deterministic chunk id, so re-ingesting the same file upserts onto the same records.
+    :param doc_hash: content hash of the source document
+    :param page: page number
+    :param start: start offset of the chunk within the page
+    :return: chunk id
+    """
+    return hashlib.sha1(f"{doc_hash}:{page}:{start}".encode()).hexdigest()
+
+def chunk_pages(pages: List[str], source: str, chunker: Callable[[str], List[Tuple[int, int, str]]],
+                doc_hash: str | None = None) -> List[Chunk]:
+    """
+    This function chunks already-extracted page texts of one document and returns a list of Chunk classes.
+    :param pages: list of pages as strings
+    :param source: document the pages came from (stored on each Chunk)
+    :param chunker: chunker from make_chunker
+    :param doc_hash: content hash of the document; chunk ids are derived from it (random ids if None)
     :return: list of Chunks
     """
     out: List[Chunk] = []
-    pdfs_pages = read_pdf_pages(pdf_path)
-    for page_i, page_txt in enumerate(pdfs_pages, start=1):
-        for s, e, txt in sliding_chunks(page_txt, chunk_size, overlap):
+    for page_i, page_txt in enumerate(pages, start=1):
+        for s, e, txt in chunker(page_txt):
             out.append(Chunk(
-                id=str(uuid.uuid4()),
-                source=str(pdf_path.resolve()),
+                id=chunk_id(doc_hash, page_i, s) if doc_hash else str(uuid.uuid4()),
+                source=source,
                 page=page_i, start=s, end=e, text=txt
             ))
     return out
 
+def chunk_pdf(pdf_path: Path, chunk_size: int, overlap: int) -> List[Chunk]:
+    """
+    This function takes a list of page texts, and chunks each one and returns a list of Chunk classes.
+    :param pdf_path: dir to all pdfs
+    :param chunk_size: size for chunk
+    :param overlap: size of overlap between chunks (i.e. the end of one chunk starts another)
+    :return: list of Chunks
+    """
+    return chunk_pages(read_pdf_pages(pdf_path), str(pdf_path.resolve()), CharChunker(chunk_size, overlap),
+                       file_sha256(pdf_path))
+
+def _chunk_pdf_task(pdf_path: Path, chunker, doc_hash: str | None = None) -> PdfResult:
+    """
+    Worker task: chunk one PDF and time it. Exceptions are caught here so one bad PDF does not take
+    down the pool; the error is reported on the returned PdfResult instead.
+    :param pdf_path: PDF location on disk
+    :param chunker: chunker from make_chunker
+    :param doc_hash: precomputed content hash (computed here if None)
+    :return: PdfResult for this PDF
+    """
+    t0 = time.perf_counter()
+    res = PdfResult(path=pdf_path)
+    try:
+        res.sha256 = doc_hash or file_sha256(pdf_path)
+        pages = read_pdf_pages(pdf_path)
+        res.pages = len(pages)
+        res.chunks = chunk_pages(pages, str(pdf_path.resolve()), chunker, res.sha256)
+        res.n_chunks = len(res.chunks)
+        res.chunk_ids = [c.id for c in res.chunks]
+    except Exception as e:
+        res.error = f"{type(e).__name__}: {e}"
+    res.seconds = time.perf_counter() - t0
+    return res
+
+def iter_chunked_pdfs(pdfs: List[Path], chunker, workers: int = 1,
+                      hashes: Dict[Path, str] | None = None) -> Iterator[PdfResult]:
+    """
+    Chunks PDFs, optionally across a process pool, yielding one PdfResult per PDF in the same order as pdfs.
+    At most 2 * workers PDFs are in flight at once, so results are consumed as they finish rather than
+    piling up in memory.
+    :param pdfs: list of pdf locations on disk
+    :param chunker: chunker from make_chunker
+    :param workers: number of worker processes (<= 1 runs in this process)
+    :param hashes: optional precomputed content hashes keyed by pdf path
+    :return: iterator of PdfResult
+    """
+    hashes = hashes or {}
+    if workers <= 1:
+        for p in pdfs:
+            yield _chunk_pdf_task(p, chunker, hashes.get(p))
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        it = iter(pdfs)
+        submit = lambda p: pool.submit(_chunk_pdf_task, p, chunker, hashes.get(p))
+        pending = deque((p, submit(p)) for p in islice(it, 2 * workers))
+        while pending:
+            p, fut = pending.popleft()
+            try:
+                res = fut.result()
+            except Exception as e:
+                # worker process died (e.g. segfault in a native pdf dependency)
+                res = PdfResult(path=p, error=f"{type(e).__name__}: {e}")
+            nxt = next(it, None)
+            if nxt is not None:
+                pending.append((nxt, submit(nxt)))
+            yield res
+
+def print_timing_report(results: List[PdfResult], top: int = 10):
+    """
+    Prints a per-file timing summary for chunked PDFs (slowest first) and lists any failures.
+    :param results: PdfResults from iter_chunked_pdfs
+    :param top: number of slowest files to list
+    """
+    if not results:
+        return
+    total = sum(r.seconds for r in results)
+    pages = sum(r.pages for r in results)
+    failed = [r for r in results if r.error]
+    print(f"Chunked {len(results)} PDFs ({pages} pages) in {total:.1f}s of worker time"
+          f" ({pages / total if total else 0:.1f} pages/s per worker)")
+    print(f"  {'seconds':>8}  {'pages':>6}  {'chunks':>7}  file")
+    for r in sorted(results, key=lambda r: r.seconds, reverse=True)[:top]:
+        print(f"  {r.seconds:8.2f}  {r.pages:6d}  {r.n_chunks:7d}  {r.path}")
+    if failed:
+        print(f"{len(failed)} PDFs failed:")
+        for r in failed:
+            print(f"  {r.path}: {r.error}")
+
 
 # Embedding
 
@@ -131,7 +412,8 @@ def embed_texts_sentence_transformer(
         model: SentenceTransformer,
         texts: List[str],
         batch_size: int,
-        normalize: bool = False
+        normalize: bool = False,
+        show_progress: bool = True
 ) -> np.ndarray:
     """
     This function is for embedding text using a SentenceTransformer model
@@ -139,10 +421,11 @@ def embed_texts_sentence_transformer(
     :param texts: list of texts
     :param batch_size: number of texts to embed at once
     :param normalize: bool for normalizing resulting embeddings
+    :param show_progress: show a progress bar while encoding
     :return: list of vectors
     """
     vecs = model.encode(texts, batch_size=batch_size, convert_to_numpy=True,
-                        normalize_embeddings=normalize, show_progress_bar=True)
+                        normalize_embeddings=normalize, show_progress_bar=show_progress)
     return vecs.astype("float32")
 
 
@@ -151,7 +434,8 @@ def embed_texts_portkey(
         model: str = 'text-embedding-3-small',
         texts: List[str] = [],
         batch_size: int = 64,
-        normalize: bool = False
+        normalize: bool = False,
+        show_progress: bool = True
 ) -> np.ndarray:
     """
     This function is for embedding text using a portkey client tied to an ai model
@@ -159,11 +443,12 @@ def embed_texts_portkey(
     :param model: model name
     :param texts: list of texts
     :param normalize: bool for normalizing resulting embeddings
+    :param show_progress: show a progress bar over request batches
     :return: list of vectors
     """
     vecs = []
     n = len(texts)
-    for start in tqdm(range(0, n, batch_size)):
+    for start in tqdm(range(0, n, batch_size), disable=not show_progress):
         end = min(start + batch_size, n)
         response = client.embeddings.create(
             model = model,
@@ -187,38 +472,462 @@ def ensure_parent(p: str | Path):
     """
     Path(p).parent.mkdir(parents=True, exist_ok=True)
 
-def upload_embeddings_to_db(chunks, texts, vecs, persist_dir: str, collection: str, recreate: bool):
+def make_deduplicator(config: Dict[str, Any]) -> ChunkDeduplicator | None:
+    """
+    Builds the duplicate filter described by the `dedup` config section.
+    :param config: config dictionary
+    :return: ChunkDeduplicator, or None if dedup.enabled is false
+    """
+    d = config.get("dedup", {})
+    if not d.get("enabled", False):
+        return None
+    return ChunkDeduplicator(d.get("threshold", 0.85), d.get("num_perm", 64), d.get("bands", 16),
+                             d.get("shingle", 5))
+
+def make_embedder(config: Dict[str, Any], show_progress: bool = True) -> Callable[[List[str]], np.ndarray]:
+    """
+    Builds the embedding function described by the `embedding` config section. The client/model is
+    created once here and reused for every call, behind the on-disk embedding cache if embedding.cache_dir
+    is set (the cache is reachable as `.cache` on the returned function).
+    :param config: config dictionary
+    :param show_progress: show progress bars inside the embedder
+    :return: function mapping a list of texts to a float32 array of vectors
+    """
+    emb_source = config["embedding"]["source"]
+    emb_model = config["embedding"]["model"]
+    batch_size = config["embedding"]["batch_size"]
+    normalize = config["embedding"]["normalize"]
+
+    if emb_source.lower().startswith("portkey"):
+        api_key = os.environ.get('PORTKEY_API_KEY')
+        base_url = os.environ.get('PORTKEY_BASE_URL')
+        if not api_key or not base_url:
+            raise ValueError("Missing or empty PORTKEY_API_KEY or PORTKEY_BASE_URL environment variable.")
+        concurrency = config["embedding"].get("concurrency", 1)
+        if concurrency > 1:
+            embed_fn = lambda texts: embed_texts_portkey_async(
+                texts, emb_model, base_url, api_key, batch_size=batch_size, concurrency=concurrency,
+                normalize=normalize, max_retries=config["embedding"].get("max_retries", 6))
+        else:
+            client = Portkey(
+                base_url = base_url,
+                api_key = api_key,
+            )
+            embed_fn = lambda texts: embed_texts_portkey(client, emb_model, texts, batch_size, normalize, show_progress)
+
+    else:
+        # default to sentence transformer
+        model = SentenceTransformer(emb_model)
+        embed_fn = lambda texts: embed_texts_sentence_transformer(model, texts, batch_size, normalize, show_progress)
+
+    return cached_embedder(embed_fn, make_cache(config))
+
+def load_manifest(path: str | Path) -> Dict[str, Any]:
+    """
+    Loads the ingestion manifest (file path -> size/mtime/content hash/chunk ids) written by the last run.
+    :param path: manifest location
+    :return: manifest dictionary (empty if none exists yet)
+    """
+    if not Path(path).exists():
+        return {"settings": {}, "files": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(path: str | Path, manifest: Dict[str, Any]):
+    """
+    Writes the manifest atomically so an interrupted run never leaves a truncated file behind.
+    :param path: manifest location
+    :param manifest: manifest dictionary
+    """
+    ensure_parent(path)
+    tmp = str(path) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, path)
+
+def plan_incremental(pdfs: List[Path], files: Dict[str, Any]) -> Tuple[List[Path], Dict[Path, str], List[str]]:
+    """
+    Compares the PDFs on disk to the manifest. Files whose size and mtime are unchanged are skipped without
+    being read; the rest are hashed and only re-indexed if their content changed.
+    :param pdfs: list of pdf locations on disk
+    :param files: manifest["files"] from the previous run (stat info refreshed in place)
+    :return: (pdfs to index, their content hashes, manifest keys of PDFs that no longer exist)
+    """
+    to_index, hashes = [], {}
+    for p in pdfs:
+        key = str(p.resolve())
+        st = p.stat()
+        ent = files.get(key)
+        if ent and ent["size"] == st.st_size and ent["mtime_ns"] == st.st_mtime_ns:
+            continue
+        h = file_sha256(p)
+        if ent and ent["sha256"] == h:
+            ent["size"], ent["mtime_ns"] = st.st_size, st.st_mtime_ns
+            continue
+        hashes[p] = h
+        to_index.append(p)
+    on_disk = {str(p.resolve()) for p in pdfs}
+    removed = [k for k in files if k not in on_disk]
+    return to_index, hashes, removed
+
+def plan_dedup_dependents(files: Dict[str, Any], to_index: List[Path], removed: List[str]) -> List[str]:
+    """
+    Finds unchanged PDFs that must be re-chunked because some of their chunks were dropped as duplicates of a
+    chunk owned by a PDF that is being removed or re-indexed: once that owner's chunks are deleted, the dropped
+    copies are the only remaining source of the content.
+    :param files: manifest files, with "dups" mapping each dropped chunk id to the kept chunk id
+    :param to_index: PDFs re-indexed this run
+    :param removed: manifest keys of PDFs removed this run
+    :return: manifest keys of the unchanged PDFs to re-index as well
+    """
+    changing = set(removed) | {str(p.resolve()) for p in to_index}
+    owned = {i for k in changing if k in files for i in files[k]["chunk_ids"]}
+    return [k for k, ent in files.items()
+            if k not in changing and any(kept in owned for kept in ent.get("dups", {}).values())]
+
+def seed_deduplicator(dedup: ChunkDeduplicator, col, ids: List[str], batch_size: int = 2048):
+    """
+    Replays the chunks an interrupted run already wrote into a fresh deduplicator, so the resumed run drops the
+    same duplicates a clean run would.
+    :param dedup: deduplicator of the resumed run
+    :param col: collection holding the written chunks
+    :param ids: chunk ids of the PDFs completed before the interruption, in processing order (dropped
+                duplicates among them are not in the collection and are skipped)
+    :param batch_size: ids per get call
+    """
+    for i in range(0, len(ids), batch_size):
+        part = ids[i:i + batch_size]
+        got = col.get(ids=part, include=["documents"])
+        texts = dict(zip(got["ids"], got["documents"]))
+        for j in part:
+            if j in texts:
+                dedup.check(j, texts[j])
+
+def delete_chunk_ids(col, ids: List[str], batch_size: int = 2048):
+    """
+    Deletes chunks from a collection in batches.
+    :param col: Chroma collection
+    :param ids: chunk ids to delete
+    :param batch_size: ids per delete call
+    """
+    for i in range(0, len(ids), batch_size):
+        col.delete(ids=ids[i:i + batch_size])
+
+def prefetch(iterable: Iterable, maxsize: int = 2) -> Iterator:
+    """
+    Runs an iterable on a background thread and hands its items over through a bounded queue. The producer
+    blocks once `maxsize` items are waiting, so a fast stage can only run that far ahead of a slow one.
+    Exceptions raised by the producer are re-raised in the consumer.
+    :param iterable: upstream stage
+    :param maxsize: max number of items buffered between the stages
+    :return: iterator over the same items
+    """
+    q: queue.Queue = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((False, item)):
+                    return
+        except BaseException as e:
+            put((True, e))
+            return
+        put((True, None))
+
+    t = threading.Thread(target=produce, daemon=True)
+    t.start()
+    try:
+        while True:
+            done, item = q.get()
+            if done:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        stop.set()
+
+@dataclass
+class ChunkBatch:
+    chunks: List[Chunk]
+    # position of the first chunk not yet emitted: PDFs [0, pdfs_done) are fully contained in this and earlier
+    # batches, plus the first `offset` chunks of PDF pdfs_done
+    pdfs_done: int = 0
+    offset: int = 0
+
+def iter_chunk_batches(results: Iterable[PdfResult], batch_size: int,
+                       report: List[PdfResult] | None = None,
+                       start_pdf: int = 0, skip: int = 0,
+                       on_skip: Callable[[List[Chunk]], Any] | None = None) -> Iterator[ChunkBatch]:
+    """
+    Regroups per-PDF chunk lists into batches of at most batch_size chunks, each tagged with the stream position
+    after it so a checkpoint can resume from there.
+    :param results: PdfResults from iter_chunked_pdfs
+    :param batch_size: chunks per batch
+    :param report: optional list collecting each PdfResult (without its chunks) for print_timing_report
+    :param start_pdf: index of the first PDF in `results` within the full PDF list (when resuming)
+    :param skip: number of leading chunks of the first PDF that were already written (when resuming)
+    :param on_skip: called with those already written chunks before the rest of the PDF is batched
+    :return: iterator of ChunkBatch
+    """
+    buf: List[Chunk] = []
+    pos: List[Tuple[int, int]] = []
+    consumed = start_pdf
+    for res in results:
+        first = skip if consumed == start_pdf else 0
+        if first and on_skip is not None:
+            on_skip(res.chunks[:first])
+        buf.extend(res.chunks[first:])
+        pos.extend((consumed, j) for j in range(first, len(res.chunks)))
+        consumed += 1
+        if report is not None:
+            res.chunks = []
+            report.append(res)
+        while len(buf) >= batch_size:
+            batch, buf, pos = buf[:batch_size], buf[batch_size:], pos[batch_size:]
+            yield ChunkBatch(batch, *(pos[0] if pos else (consumed, 0)))
+    if buf:
+        yield ChunkBatch(buf, consumed, 0)
+
+def iter_embedded_batches(batches: Iterable[ChunkBatch],
+                          embed_fn: Callable[[List[str]], np.ndarray],
+                          timings: Dict[str, float] | None = None,
+                          text_attr: str = "text") -> Iterator[Tuple[ChunkBatch, np.ndarray]]:
+    """
+    Embeds each chunk batch as it arrives.
+    :param batches: iterator of ChunkBatch
+    :param embed_fn: function from make_embedder
+    :param timings: optional dict; seconds spent embedding are added under "embed"
+    :param text_attr: name of the chunk attribute holding the text to embed
+    :return: iterator of (batch, vectors) pairs
+    """
+    for batch in batches:
+        t0 = time.perf_counter()
+        vecs = embed_fn([getattr(c, text_attr) for c in batch.chunks])
+        if timings is not None:
+            timings["embed"] = timings.get("embed", 0.0) + time.perf_counter() - t0
+        yield batch, vecs
+
+class IngestCheckpoint:
+    """
+    Append-only JSONL log of build_rag progress. The first line holds the run plan (settings, PDFs to index);
+    every following line is written after a batch has been upserted and records the stream position, the
+    metadata file offset and the PDFs completed since the previous line.
+    """
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+
+    def load(self) -> Tuple[Dict[str, Any] | None, List[Dict[str, Any]]]:
+        """
+        :return: (plan header or None if there is no checkpoint, progress records)
+        """
+        if not self.path.exists():
+            return None, []
+        with open(self.path, "r", encoding="utf-8") as f:
+            lines = []
+            for line in f:
+                try:
+                    lines.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break  # torn last line from a crash mid-write
+        if not lines:
+            return None, []
+        return lines[0], lines[1:]
+
+    def start(self, header: Dict[str, Any]):
+        ensure_parent(self.path)
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(header) + "\n")
+
+    def record(self, entry: Dict[str, Any]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def clear(self):
+        if self.path.exists():
+            self.path.unlink()
+
+def _result_summary(res: PdfResult) -> Dict[str, Any]:
+    return {"path": str(res.path), "pages": res.pages, "n_chunks": res.n_chunks, "sha256": res.sha256,
+            "chunk_ids": res.chunk_ids, "seconds": res.seconds, "error": res.error}
+
+class BackgroundWriter:
+    """
+    Runs a write function on a worker thread fed by a bounded queue, so writes overlap with whatever produces
+    the next batch. submit() blocks while `maxsize` batches are already waiting. An exception in the worker is
+    re-raised by the next submit() or by close().
+    """
+    _STOP = object()
+
+    def __init__(self, write_fn: Callable, maxsize: int = 2):
+        self.write_fn = write_fn
+        self.q: queue.Queue = queue.Queue(maxsize=maxsize)
+        self.error: BaseException | None = None
+        self.write_seconds = 0.0  # time spent inside write_fn
+        self.wait_seconds = 0.0   # time submit() was blocked on a full queue (writer is the bottleneck)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.q.get()
+            if item is self._STOP:
+                return
+            if self.error is not None:
+                continue  # drain so submit() never blocks forever after a failure
+            t0 = time.perf_counter()
+            try:
+                self.write_fn(*item)
+            except BaseException as e:
+                self.error = e
+            self.write_seconds += time.perf_counter() - t0
+
+    def submit(self, *args):
+        if self.error is not None:
+            raise self.error
+        t0 = time.perf_counter()
+        self.q.put(args)
+        self.wait_seconds += time.perf_counter() - t0
+
+    def close(self):
+        self.q.put(self._STOP)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.q.put(self._STOP)
+            self.thread.join()
+
+def open_collection(persist_dir: str, collection: str, recreate: bool, metadata: Dict[str, Any] | None = None,
+                    backend: str = "chroma", quantization: str | None = None, shards: int = 1):
+    """
+    Opens (or creates) the Chroma collection the embeddings are written to.
+    :param persist_dir: Chroma persist directory
+    :param collection: collection name
+    :param recreate: drop the collection first if it exists
+    :param metadata: extra collection-level metadata, set when the collection is created
+    :param backend: "chroma", or "flat" for an exact FlatIndex under persist_dir/flat/ with the same API
+    :param quantization: flat backend only; "int8"/"binary" opens a QuantizedIndex (codes built by finish_collection)
+    :param shards: >1 hashes chunks over that many collections under persist_dir/shards/, written in parallel
+    :return: Chroma collection (or FlatIndex, or ShardedCollection)
+    """
+    if shards > 1:
+        return open_shards(persist_dir, shards, lambda path, i: open_collection(
+            str(path), collection, recreate, {**(metadata or {}), "shard": i, "shards": shards}, backend, quantization))
+    if backend == "flat":
+        return open_flat_index(persist_dir, collection, recreate, metadata, quantization=quantization)
     client = chromadb.PersistentClient(path=persist_dir)
     if recreate and any(col.name == collection for col in client.list_collections()):
         client.delete_collection(collection)
 
-    col = client.get_or_create_collection(
+    return client.get_or_create_collection(
         name=collection,
         # we pass embeddings manually; no embedding function needed here
-        metadata={"hnsw:space": "cosine"}  # cosine distance for normalized embeddings
+        metadata={"hnsw:space": "cosine", **(metadata or {})}  # cosine distance for normalized embeddings
     )
 
+def finish_collection(col, compact_dead_fraction: float | None = None):
+    """
+    Post-ingestion step for backends that need one: a FlatIndex drops the rows of deleted records once they
+    make up compact_dead_fraction of vectors.npy, then a QuantizedIndex rebuilds its codes over the final rows.
+    :param col: collection from open_collection
+    :param compact_dead_fraction: dead-row fraction that triggers compaction (None = never compact)
+    """
+    if compact_dead_fraction is not None and hasattr(col, "compact"):
+        col.compact(compact_dead_fraction)
+    if hasattr(col, "build_codes"):
+        col.build_codes()
+
+
+def upsert_chunks(col, chunks: List, texts: List[str], vecs: np.ndarray, fields: Tuple[str, ...] | None = None):
+    """
+    Upserts one batch of chunks with their embeddings.
+    :param col: Chroma collection
+    :param chunks: dataclass chunks (stored as metadata)
+    :param texts: documents stored alongside the embeddings
+    :param vecs: embeddings, one row per chunk
+    :param fields: chunk fields kept as metadata (None = all of them)
+    """
+    # Chroma metadata cannot hold None, so unset fields (e.g. no tag) are left out
+    metas = [{k: v for k, v in asdict(c).items() if v is not None} for c in chunks]
+    if fields is not None:
+        metas = [{k: m[k] for k in fields if k in m} for m in metas]
+    col.upsert(
+        ids=[c.id for c in chunks],
+        embeddings=vecs,  # Chroma takes the ndarray as-is; no nested python lists
+        documents=texts,
+        metadatas=metas,
+    )
+
+def upload_embeddings_to_db(chunks, texts, vecs, persist_dir: str, collection: str, recreate: bool,
+                            backend: str = "chroma"):
+    col = open_collection(persist_dir, collection, recreate, backend=backend)
+
     print("Upserting to Chroma…")
     B = 2048
-    ids = [c.id for c in chunks]
-    metadatas = [asdict(c) for c in chunks]
-    documents = texts
     # upsert in batches
     for i in tqdm(range(0, len(chunks), B), desc="Upserts"):
-        col.upsert(
-            ids=ids[i:i + B],
-            embeddings=vecs[i:i + B].tolist(),
-            documents=documents[i:i + B],
-            metadatas=metadatas[i:i + B],
-        )
+        upsert_chunks(col, chunks[i:i + B], texts[i:i + B], vecs[i:i + B])
+
+def write_db_metadata(f, chunks: Iterable, exclude: Tuple[str, ...] = ()):
+    """
+    Writes chunks as JSON lines to an open metadata file.
+    :param f: text file handle
+    :param chunks: dataclass chunks
+    :param exclude: fields left out of the lines
+    """
+    for c in chunks:
+        d = asdict(c)
+        for k in exclude:
+            d.pop(k, None)
+        f.write(json.dumps(d, ensure_ascii=False) + "\n")
+
+def merge_db_metadata(meta_path: str, new_path: str, drop_ids: set):
+    """
+    Folds a freshly written metadata file into the existing one: lines whose id is in drop_ids are removed
+    from the old file and the new lines are appended. The result replaces meta_path atomically.
+    :param meta_path: existing metadata.jsonl (may not exist yet)
+    :param new_path: metadata.jsonl holding only the chunks written this run
+    :param drop_ids: ids of chunks that were deleted or rewritten this run
+    """
+    tmp_path = meta_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as out:
+        if Path(meta_path).exists():
+            with open(meta_path, "r", encoding="utf-8") as old:
+                for line in old:
+                    if json.loads(line)["id"] not in drop_ids:
+                        out.write(line)
+        with open(new_path, "r", encoding="utf-8") as new:
+            for line in new:
+                out.write(line)
+    os.replace(tmp_path, meta_path)
+    os.remove(new_path)
 
 def create_db_metadata(meta_path: str, model_path: str, emb_model:str, chunks: List):
 
     # Persist convenience files
     ensure_parent(meta_path)
     with open(meta_path, "w", encoding="utf-8") as f:
-        for c in chunks:
-            f.write(json.dumps(asdict(c), ensure_ascii=False) + "\n")
+        write_db_metadata(f, chunks)
     ensure_parent(model_path)
     Path(model_path).write_text(emb_model, encoding="utf-8")
 
@@ -229,16 +938,30 @@ def main():
     ap.add_argument("--persist_dir", type=str, default=None)
     ap.add_argument("--collection", type=str, default=None)
     ap.add_argument("--recreate", action="store_true")
+    ap.add_argument("--workers", type=int, default=None, help="processes used for PDF extraction/chunking")
+    ap.add_argument("--incremental", action="store_true", help="only embed new/changed PDFs, drop removed ones")
+    ap.add_argument("--resume", action="store_true", help="continue an interrupted run from its checkpoint")
+    ap.add_argument("--tag", type=str, default=None, help="tag stored on every chunk, for filtered retrieval")
+    ap.add_argument("--shards", type=int, default=None, help="hash chunks over this many collections")
+    ap.add_argument("--compact", action="store_true",
+                    help="flat backend: drop the rows of deleted chunks from vectors.npy, however few")
     args = ap.parse_args()
 
     # load in configs
     config = load_config(args.config)
+    if args.workers:
+        config["chunking"]["workers"] = args.workers
+
     if args.pdf_dir:
         config["data"]["raw_dir"] = args.pdf_dir
 
+    if args.tag:
+        config["data"]["tag"] = args.tag
+
     if args.persist_dir:
         config["chroma"]["persist_dir"] = args.persist_dir
         config["outputs"]["metadata_path"] = args.persist_dir + "/metadata/metadata.jsonl"
+        config["outputs"]["metadata_db_path"] = args.persist_dir + "/metadata/metadata.sqlite"
         config["outputs"]["model_name_path"] = args.persist_dir + "/outputs/index/model_name.txt"
 
     if args.collection:
@@ -247,35 +970,39 @@ def main():
     if args.recreate:
         config["chroma"]["recreate"] = True
 
+    if args.incremental:
+        config["chroma"]["incremental"] = True
+
+    if args.shards:
+        config["chroma"]["shards"] = args.shards
+
+    if args.compact:
+        config["chroma"]["compact_dead_fraction"] = 0.0
+
     # pull out vars
     raw_dir = config["data"]["raw_dir"]
-    chunk_size = config["chunking"]["chunk_size"]
-    overlap = config["chunking"]["overlap"]
+    tag = config["data"].get("tag")
+    chunker = make_chunker(config)
+    workers = config["chunking"].get("workers", 1)
 
-    emb_source = config["embedding"]["source"]
     emb_model = config["embedding"]["model"]
-    batch_size = config["embedding"]["batch_size"]
-    normalize = config["embedding"]["normalize"]
 
     persist_dir = config["chroma"]["persist_dir"]
     collection = config["chroma"]["collection"]
     recreate = config["chroma"]["recreate"]
+    backend = config["chroma"].get("backend", "chroma")
+    shards = config["chroma"].get("shards", 1)
+    upsert_batch = config["chroma"].get("upsert_batch_size", 2048)
+    prefetch_batches = config["chroma"].get("prefetch_batches", 2)
+    incremental = config["chroma"].get("incremental", False) and not recreate
+    manifest_path = Path(persist_dir) / "manifest.json"
 
-    meta_path = config["outputs"]["metadata_path"]
+    meta_format = config["outputs"].get("metadata_format", "jsonl")
+    meta_path = config["outputs"]["metadata_path"] if meta_format == "jsonl" else config["outputs"]["metadata_db_path"]
     model_path = config["outputs"]["model_name_path"]
 
-    #
-    api_key = None
-    base_url = None
-    if emb_source.lower().startswith("portkey"):
-        api_key = os.environ.get('PORTKEY_API_KEY')
-        base_url = os.environ.get('PORTKEY_BASE_URL')
-        
-        if not api_key or not base_url:
-            raise ValueError("Missing or empty PORTKEY_API_KEY or PORTKEY_BASE_URL environment variable.")
-
-
-
+    # fail fast on missing credentials before any PDF is read
+    embed_fn = make_embedder(config, show_progress=False)
 
     # get list of pdfs
     pdfs = list_pdfs(raw_dir)
@@ -283,47 +1010,224 @@ def main():
     if not pdfs:
         raise SystemExit(f"No PDFs found under: {raw_dir}")
 
-    print(f"Found {len(pdfs)} PDFs. Chunking…")
+    # settings that change chunk ids or vectors; if they differ from the manifest everything is re-indexed
+    settings = {"chunking": chunker.settings(), "model": emb_model}
+    if tag:
+        settings["tag"] = tag
+    if shards > 1:
+        settings["shards"] = shards
+    checkpoint = IngestCheckpoint(Path(persist_dir) / "ingest_state.jsonl")
+    header, records = checkpoint.load() if args.resume else (None, [])
+    if args.resume and header is None:
+        print("No checkpoint found; starting a fresh run.")
+    if header is not None and header["settings"] != settings:
+        raise SystemExit("Checkpoint was written with different chunking/embedding settings; rerun without --resume.")
+
+    if header is not None:
+        # replay the interrupted run's plan; never recreate the collection we are resuming into
+        recreate, incremental = False, header["incremental"]
+        to_index = [Path(p) for p in header["pdfs"]]
+        hashes = {Path(k): v for k, v in header["hashes"].items()}
+        removed = header["removed"]
+        manifest = {"settings": {}, "files": {}} if header["recreate"] else load_manifest(manifest_path)
+    else:
+        manifest = {"settings": {}, "files": {}} if recreate else load_manifest(manifest_path)
+        removed = []
+        hashes = {}
+        if incremental and manifest["settings"] == settings:
+            to_index, hashes, removed = plan_incremental(pdfs, manifest["files"])
+            print(f"Incremental: {len(to_index)} new/changed, {len(pdfs) - len(to_index)} unchanged, "
+                  f"{len(removed)} removed PDFs.")
+            dependents = plan_dedup_dependents(manifest["files"], to_index, removed)
+            if dependents:
+                print(f"Re-indexing {len(dependents)} unchanged PDFs whose duplicate chunks were kept in a "
+                      f"changed or removed PDF.")
+                for k in dependents:
+                    to_index.append(Path(k))
+                    hashes[Path(k)] = manifest["files"][k]["sha256"]
+        else:
+            if incremental:
+                print("Chunking/embedding settings changed since the last run; re-indexing every PDF.")
+            to_index = pdfs
+            if incremental:
+                removed = [k for k in manifest["files"] if k not in {str(p.resolve()) for p in pdfs}]
+    prev_files = manifest["files"]
 
-    # chunk
-    chunks: List[Chunk] = []
-    for p in tqdm(pdfs, desc="PDFs"):
-        chunks.extend(chunk_pdf(p, chunk_size, overlap))
+    last = records[-1] if records else {"pdfs_done": 0, "offset": 0, "meta_bytes": 0, "n_chunks": 0}
+    done_results = [PdfResult(path=Path(r.pop("path")), **r) for rec in records for r in rec["results"]]
+    if header is not None:
+        print(f"Resuming: {last['pdfs_done']} of {len(to_index)} PDFs already written "
+              f"(+{last['offset']} chunks of the next), {last['n_chunks']} chunks.")
+    else:
+        checkpoint.start({"settings": settings, "incremental": incremental, "recreate": recreate,
+                          "pdfs": [str(p) for p in to_index], "hashes": {str(k): v for k, v in hashes.items()},
+                          "removed": removed})
 
-    if not chunks:
-        raise SystemExit("No chunks extracted.")
+    print(f"Chunking {len(to_index) - last['pdfs_done']} PDFs with {workers} worker(s), embedding with {emb_model}…")
 
-    print(f"Embedding {len(chunks)} chunks with {emb_model}…")
+    # PDFs -> chunk batches -> embedded batches -> Chroma, each stage bounded by a small queue
+    print(f"Connecting to Chroma (persist_dir={persist_dir}, shards={shards})…")
+    # a recreate drops the collection, so it waits until the first chunk batch shows there is something to index
+    col = None if recreate else open_collection(persist_dir, collection, False, backend=backend,
+                                                quantization=config["chroma"].get("quantization"), shards=shards)
 
-    # embed texts
-    texts = [c.text for c in chunks]
-    if emb_source.lower().startswith("portkey"):
-        api_key = os.environ['PORTKEY_API_KEY']
-        base_url = os.environ['PORTKEY_BASE_URL']
-        client = Portkey(
-            base_url = base_url,
-            api_key = api_key,
+    results: List[PdfResult] = []
+    dedup = make_deduplicator(config)
+    n_chunks = last["n_chunks"]
+    mode = "a" if header is not None else "w"
+    timings: Dict[str, float] = {}
+    t_start = time.perf_counter()
+    with ExitStack() as stack:
+        dup_f = stack.enter_context(open(Path(persist_dir) / "duplicates.tsv", mode, encoding="utf-8"))
+        bar = stack.enter_context(tqdm(desc="Chunks", unit="chunk", initial=n_chunks))
+
+        if dedup is not None and header is not None:
+            # rebuild the dedup state of the interrupted run from what it already wrote
+            seed_deduplicator(dedup, col, [i for r in done_results for i in r.chunk_ids], upsert_batch)
+
+        # chunking and dedup run on the prefetch thread, ahead of embedding
+        pending = to_index[last["pdfs_done"]:]
+        batches = prefetch(
+            iter_deduped_batches(
+                iter_chunk_batches(iter_chunked_pdfs(pending, chunker, workers, hashes), upsert_batch, results,
+                                   last["pdfs_done"], last["offset"], dedup.filter if dedup is not None else None),
+                dedup, dup_f),
+            prefetch_batches,
         )
-        vecs = embed_texts_portkey(client, emb_model, texts, batch_size, normalize)
+        first = next(batches, None)
+        if first is None and not n_chunks and not incremental:
+            # nothing has been written yet: the existing collection, metadata and manifest are left as they were
+            checkpoint.clear()
+            raise SystemExit("No chunks extracted.")
+        if col is None:
+            col = open_collection(persist_dir, collection, True, backend=backend,
+                                  quantization=config["chroma"].get("quantization"), shards=shards)
+
+        if meta_format == "sqlite":
+            # rows are keyed by chunk id, so rewriting a batch after a resume is harmless
+            store = stack.enter_context(closing(MetadataStore(meta_path)))
+            if recreate:
+                store.clear()
+            store.set_owner(persist_dir, collection)
 
+            def write_meta(chunks: List[Chunk]) -> int:
+                store.add(chunks)
+                return 0
+        else:
+            new_meta_path = meta_path + ".new"
+            ensure_parent(meta_path)
+            if header is not None and Path(new_meta_path).exists():
+                # drop metadata lines of a batch that was being written when the run died
+                with open(new_meta_path, "r+b") as f:
+                    f.truncate(last["meta_bytes"])
+            meta_f = stack.enter_context(open(new_meta_path, mode, encoding="utf-8"))
+
+            def write_meta(chunks: List[Chunk]) -> int:
+                write_db_metadata(meta_f, chunks)
+                meta_f.flush()
+                return meta_f.tell()
+        sparse = None
+        if config.get("sparse", {}).get("enabled", False):
+            sparse = stack.enter_context(closing(SparseIndex(sparse_index_path(persist_dir, collection))))
+            if recreate:
+                sparse.clear()
+            elif incremental and not sparse.count() and col.count():
+                print("Sparse index is empty but the collection is not; rerun with --recreate to index every chunk.")
+        progress = {"pdfs_done": last["pdfs_done"], "n_chunks": n_chunks}
+
+        def write_batch(batch: ChunkBatch, vecs: np.ndarray):
+            for c in batch.chunks:
+                c.tag = tag
+            upsert_chunks(col, batch.chunks, [c.text for c in batch.chunks], vecs)
+            if sparse is not None:
+                sparse.add([c.id for c in batch.chunks], [c.text for c in batch.chunks])
+            meta_bytes = write_meta(batch.chunks)
+            # results[] is filled by the producer before a PDF's chunks are batched, so these are available
+            completed = results[progress["pdfs_done"] - last["pdfs_done"]:batch.pdfs_done - last["pdfs_done"]]
+            progress["pdfs_done"] = batch.pdfs_done
+            progress["n_chunks"] += len(batch.chunks)
+            checkpoint.record({"pdfs_done": batch.pdfs_done, "offset": batch.offset, "meta_bytes": meta_bytes,
+                               "n_chunks": progress["n_chunks"],
+                               "results": [_result_summary(r) for r in completed]})
+            bar.update(len(batch.chunks))
+
+        # upserts run on the writer thread while the next batch is being embedded
+        with BackgroundWriter(write_batch, prefetch_batches) as writer:
+            stream = batches if first is None else chain([first], batches)
+            for batch, vecs in iter_embedded_batches(stream, embed_fn, timings):
+                writer.submit(batch, vecs)
+                n_chunks += len(batch.chunks)
+
+    print_timing_report(results)
+    if dedup is not None:
+        print(dedup.report())
+    print(f"Stages: {time.perf_counter() - t_start:.1f}s wall, {timings.get('embed', 0.0):.1f}s embedding, "
+          f"{writer.write_seconds:.1f}s writing (embedder waited {writer.wait_seconds:.1f}s on the writer)")
+
+    # dropped id -> kept id for every duplicate of this run (the log is appended to when resuming)
+    with open(Path(persist_dir) / "duplicates.tsv", "r", encoding="utf-8") as f:
+        dup_map = dict(line.rstrip("\n").split("\t") for line in f if line.strip())
+
+    # drop chunks of removed PDFs, and chunks of changed PDFs that the new version no longer produces
+    files = {} if not incremental else {k: v for k, v in prev_files.items() if k not in removed}
+    stale: List[str] = []
+    for k in removed:
+        stale.extend(prev_files[k]["chunk_ids"])
+    for res in done_results + results:
+        if res.error:
+            continue
+        key = str(res.path.resolve())
+        if key in prev_files:
+            stale.extend(set(prev_files[key]["chunk_ids"]) - set(res.chunk_ids))
+        st = res.path.stat()
+        files[key] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": res.sha256,
+                      "chunk_ids": res.chunk_ids}
+        dups = {i: dup_map[i] for i in res.chunk_ids if i in dup_map}
+        if dups:
+            # lets a later incremental run re-index this PDF if the kept copies go away
+            files[key]["dups"] = dups
+    # identical content under another path maps to the same ids, so only drop ids no live file still owns
+    written = {i for res in done_results + results for i in res.chunk_ids}
+    live = {i for ent in files.values() for i in ent["chunk_ids"]}
+    stale = [i for i in dict.fromkeys(stale) if i not in live]
+    if stale:
+        print(f"Deleting {len(stale)} stale chunks…")
+        delete_chunk_ids(col, stale, upsert_batch)
+
+    if stale and sparse is not None:
+        with closing(SparseIndex(sparse.path)) as sparse:
+            sparse.delete(stale)
+    if meta_format == "sqlite":
+        if stale:
+            with closing(MetadataStore(meta_path)) as store:
+                store.delete(stale)
+    elif incremental:
+        merge_db_metadata(meta_path, new_meta_path, set(stale) | written)
     else:
-        # default to sentence transformer
-        model = SentenceTransformer(emb_model)
-        vecs = embed_texts_sentence_transformer(model, texts, batch_size, normalize)
+        os.replace(new_meta_path, meta_path)
+    finish_collection(col, config["chroma"].get("compact_dead_fraction"))
+    save_manifest(manifest_path, {"settings": settings, "files": files})
+    checkpoint.clear()
 
-    # generate Chroma vector db
-    print(f"Connecting to Chroma (persist_dir={persist_dir})…")
-    upload_embeddings_to_db(chunks, texts, vecs, persist_dir, collection, recreate)
+    cache = getattr(embed_fn, "cache", None)
+    if cache is not None:
+        st = cache.stats()
+        print(f"Embedding cache: {st['hits']} hits, {st['misses']} misses ({st['hit_rate']:.1%} hit rate), "
+              f"{st['bytes'] / 2**20:.1f} MB on disk")
 
-    # saving metadata
-    create_db_metadata(meta_path, model_path, emb_model, chunks)
+    # saving model name
+    ensure_parent(model_path)
+    Path(model_path).write_text(emb_model, encoding="utf-8")
 
     # Save to disk
     print("Done.")
+    print(f"  Chunks:      {n_chunks} written, {len(stale)} deleted")
     print(f"  Chroma dir:  {persist_dir}")
-    print(f"  Collection:  {collection}")
+    print(f"  Collection:  {collection}" + (f" ({shards} shards)" if shards > 1 else ""))
     print(f"  Metadata:    {meta_path}")
+    if sparse is not None:
+        print(f"  BM25 index:  {sparse.path}")
     print(f"  Model file:  {model_path}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
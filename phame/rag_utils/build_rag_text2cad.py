@@ -1,27 +1,33 @@
 from __future__ import annotations
 
-from phame.rag_utils.build_rag import embed_texts_portkey, embed_texts_sentence_transformer
-from phame.rag_utils.build_rag import load_config, upload_embeddings_to_db, create_db_metadata
+from phame.rag_utils.build_rag import load_config, make_embedder, ensure_parent, write_db_metadata
+from phame.rag_utils.build_rag import ChunkBatch, prefetch, iter_embedded_batches, BackgroundWriter
+from phame.rag_utils.build_rag import open_collection, upsert_chunks, finish_collection
+from phame.rag_utils.blob_store import BlobStore
+from phame.rag_utils.metadata_store import MetadataStore
 
 
-import argparse, os, json, uuid
-from dataclasses import dataclass, asdict
+import argparse, os, time, zipfile
+from contextlib import ExitStack, closing
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Tuple, Dict, Any
+from typing import List, Dict, Iterable, Iterator
 import pandas as pd
-import yaml
 from tqdm import tqdm
-from pypdf import PdfReader
-import numpy as np
-from sentence_transformers import SentenceTransformer
 
-import chromadb
-from chromadb.config import Settings
-
-from globals import DEFAULTS_RAG
-
-from portkey_ai import Portkey
 
+CSV_COLUMNS = ["uid", "abstract", "beginner", "intermediate", "expert", "nli_data"]
+# embeddable views of a part -> Part_Chunk field holding the text
+VIEWS = {
+    "abstract": "abstract_description",
+    "beginner": "beginner_description",
+    "intermediate": "intermediate_description",
+    "expert": "expert_description",
+    "nli": "nli_data",
+}
+# Chroma keeps only these; descriptions go to the metadata store and the code to the BlobStore
+CHROMA_FIELDS = ("uid", "view")
 
 
 @dataclass
@@ -35,59 +41,171 @@ class Part_Chunk:
     cad_query_code: str
 
 
-def chunk_part() -> List[Part_Chunk]:
-    """
-    This function takes a list of page texts, and chunks each one and returns a list of Chunk classes.
-    :param pdf_path: dir to all pdfs
-    :param chunk_size: size for chunk
-    :param overlap: size of overlap between chunks (i.e. the end of one chunk starts another)
-    :return: list of Chunks
-    """
-
-    text2cad = pd.read_csv('text2cad_v1.1.csv')
+@dataclass
+class PartView:
+    id: str  # Chroma id: the uid, or "{uid}:{view}" in a multi-view collection
+    uid: str
+    view: str
+    text: str
 
-    text2cad.loc[
-        text2cad['beginner'].apply(lambda x: type(x) != str), 'beginner'
-    ] = text2cad[text2cad['beginner'].apply(lambda x: type(x) != str)]['abstract']
 
-    out: List[Part_Chunk] = []
-    random_sample = text2cad.sample(100000)
-    for irow, row in random_sample.iterrows():
-        id = str(row['uid'])
-        code_file_name = f'CQ/{id}.py'
-        with open(code_file_name) as fp:
-            code = fp.readlines()
+@dataclass
+class PartBatch:
+    parts: List[Part_Chunk]
+    chunks: List[PartView]  # what gets embedded
 
-        out.append(Part_Chunk(
-            id=id,
-            abstract_description = row['abstract'],
-            beginner_description = row['beginner'],
-            intermediate_description = row['intermediate'],
-            expert_description = row['expert'],
-            nli_data = row['nli_data'],
-            cad_query_code = "".join(code)
-        ))
 
-    return out
+class CQReader:
+    """
+    Reads CadQuery sources by uid, either from the CQ/{uid}.py files or from a zip of that directory
+    (e.g. `zip -r -0 CQ.zip CQ`), on a thread pool. Missing sources come back as None.
+    """
+    def __init__(self, cq_dir: str | Path = "CQ", archive: str | Path | None = None, workers: int = 16):
+        """
+        :param cq_dir: directory holding {uid}.py files
+        :param archive: optional zip archive read instead of cq_dir
+        :param workers: reader threads
+        """
+        self.cq_dir = Path(cq_dir)
+        self.zip = None
+        self.prefix = ""
+        if archive:
+            self.zip = zipfile.ZipFile(archive)
+            self.names = set(self.zip.namelist())
+            # accept archives made from inside or from the parent of the CQ dir
+            if any(n.startswith("CQ/") for n in self.names):
+                self.prefix = "CQ/"
+        self.pool = ThreadPoolExecutor(max_workers=max(1, workers))
+
+    def _read(self, uid: str) -> str | None:
+        if self.zip is not None:
+            name = f"{self.prefix}{uid}.py"
+            if name not in self.names:
+                return None
+            return self.zip.read(name).decode("utf-8")
+        try:
+            return (self.cq_dir / f"{uid}.py").read_text(encoding="utf-8")
+        except FileNotFoundError:
+            return None
+
+    def read_many(self, uids: List[str]) -> List[str | None]:
+        return list(self.pool.map(self._read, uids))
+
+    def close(self):
+        self.pool.shutdown()
+        if self.zip is not None:
+            self.zip.close()
+
+
+def iter_part_batches(csv_path: str | Path, reader: CQReader, batch_size: int = 2048, limit: int | None = None,
+                      stats: Dict[str, int] | None = None) -> Iterator[ChunkBatch]:
+    """
+    Streams the text2cad csv in record batches and yields Part_Chunk batches ready for embedding.
+    Missing beginner descriptions are backfilled with the abstract one, column-wise per batch.
+    :param csv_path: text2cad csv
+    :param reader: CQReader for the CadQuery sources
+    :param batch_size: rows per batch
+    :param limit: max rows to read (None = all)
+    :param stats: optional dict; counts of "rows" read and parts "missing_code" are added to it
+    :return: iterator of ChunkBatch holding Part_Chunks
+    """
+    stats = stats if stats is not None else {}
+    stats.setdefault("rows", 0)
+    stats.setdefault("missing_code", 0)
+    with pd.read_csv(csv_path, usecols=CSV_COLUMNS, dtype=str, chunksize=batch_size, nrows=limit) as csv:
+        for df in csv:
+            df["beginner"] = df["beginner"].fillna(df["abstract"])
+            df = df.fillna("")
+            codes = reader.read_many(df["uid"].tolist())
+            stats["rows"] += len(df)
+
+            parts = []
+            for uid, a, b, i, e, nli, code in zip(df["uid"], df["abstract"], df["beginner"], df["intermediate"],
+                                                  df["expert"], df["nli_data"], codes):
+                if code is None:
+                    stats["missing_code"] += 1
+                    continue
+                parts.append(Part_Chunk(
+                    id=uid,
+                    abstract_description=a,
+                    beginner_description=b,
+                    intermediate_description=i,
+                    expert_description=e,
+                    nli_data=nli,
+                    cad_query_code=code
+                ))
+            if parts:
+                yield ChunkBatch(parts)
+
+
+def iter_view_batches(batches: Iterable[ChunkBatch], views: List[str]) -> Iterator[PartBatch]:
+    """
+    Expands each batch of parts into the texts of the requested views, so all views of a batch are embedded in
+    one pass. Empty views, and views whose text repeats an earlier view of the same part (e.g. a beginner
+    description backfilled from the abstract), are skipped since they would only add an identical vector.
+    :param batches: ChunkBatches of Part_Chunks from iter_part_batches
+    :param views: view names (keys of VIEWS); the first one is the primary view
+    :return: iterator of PartBatch
+    """
+    multi = len(views) > 1
+    for batch in batches:
+        rows = []
+        for p in batch.chunks:
+            seen = set()
+            for v in views:
+                text = getattr(p, VIEWS[v])
+                if not text or text in seen:
+                    continue
+                seen.add(text)
+                rows.append(PartView(f"{p.id}:{v}" if multi else p.id, p.id, v, text))
+        yield PartBatch(batch.chunks, rows)
+
+
+def chunk_part(csv_path: str = "text2cad_v1.1.csv", cq_dir: str = "CQ", limit: int | None = None) -> List[Part_Chunk]:
+    """
+    Loads text2cad parts into a list (see iter_part_batches for the streaming version).
+    :param csv_path: text2cad csv
+    :param cq_dir: directory holding the CadQuery {uid}.py files
+    :param limit: max rows to read (None = all)
+    :return: list of Part_Chunks
+    """
+    reader = CQReader(cq_dir)
+    try:
+        return [p for batch in iter_part_batches(csv_path, reader, limit=limit) for p in batch.chunks]
+    finally:
+        reader.close()
 
 
 def main():
-    ap = argparse.ArgumentParser(description="Build Chroma RAG collection from PDFs.")
+    ap = argparse.ArgumentParser(description="Build Chroma RAG collection from the text2cad dataset.")
     ap.add_argument("--config", type=str, default=None)
-    ap.add_argument("--pdf_dir", type=str, default=None)
+    ap.add_argument("--csv", type=str, default=None, help="text2cad csv")
+    ap.add_argument("--cq_dir", type=str, default=None, help="directory of CadQuery {uid}.py files")
+    ap.add_argument("--cq_archive", type=str, default=None, help="zip of the CQ directory, read instead of --cq_dir")
+    ap.add_argument("--limit", type=int, default=None, help="only index the first N parts")
+    ap.add_argument("--views", type=str, default=None,
+                    help=f"comma-separated description views to embed, from {','.join(VIEWS)}")
     ap.add_argument("--persist_dir", type=str, default=None)
     ap.add_argument("--collection", type=str, default=None)
     ap.add_argument("--recreate", action="store_true")
+    ap.add_argument("--shards", type=int, default=None, help="hash vectors over this many collections")
     args = ap.parse_args()
 
     # load in configs
     config = load_config(args.config)
-    if args.pdf_dir:
-        config["data"]["raw_dir"] = args.pdf_dir
+    t2c = config.setdefault("text2cad", {})
+    for key, val in (("csv_path", args.csv), ("cq_dir", args.cq_dir), ("cq_archive", args.cq_archive),
+                     ("limit", args.limit)):
+        if val is not None:
+            t2c[key] = val
+    if args.views:
+        t2c["views"] = [v.strip() for v in args.views.split(",") if v.strip()]
 
     if args.persist_dir:
         config["chroma"]["persist_dir"] = args.persist_dir
         config["outputs"]["metadata_path"] = args.persist_dir + "/metadata/metadata.jsonl"
+        config["outputs"]["metadata_db_path"] = args.persist_dir + "/metadata/metadata.sqlite"
+        config["outputs"]["code_store_dir"] = args.persist_dir + "/code"
         config["outputs"]["model_name_path"] = args.persist_dir +  "/outputs/index/model_name.txt"
 
     if args.collection:
@@ -96,26 +214,31 @@ def main():
     if args.recreate:
         config["chroma"]["recreate"] = True
 
-    # pull out vars
-    raw_dir = config["data"]["raw_dir"]
-    chunk_size = config["chunking"]["chunk_size"]
-    overlap = config["chunking"]["overlap"]
+    if args.shards:
+        config["chroma"]["shards"] = args.shards
 
+    # pull out vars
     emb_source = config["embedding"]["source"]
     emb_model = config["embedding"]["model"]
-    batch_size = config["embedding"]["batch_size"]
-    normalize = config["embedding"]["normalize"]
 
     persist_dir = config["chroma"]["persist_dir"]
     collection = config["chroma"]["collection"]
     recreate = config["chroma"]["recreate"]
+    backend = config["chroma"].get("backend", "chroma")
+    upsert_batch = config["chroma"].get("upsert_batch_size", 2048)
+    prefetch_batches = config["chroma"].get("prefetch_batches", 2)
 
-    meta_path = config["outputs"]["metadata_path"]
+    meta_format = config["outputs"].get("metadata_format", "jsonl")
+    meta_path = config["outputs"]["metadata_path"] if meta_format == "jsonl" else config["outputs"]["metadata_db_path"]
+    code_dir = config["outputs"]["code_store_dir"]
     model_path = config["outputs"]["model_name_path"]
 
+    views = list(dict.fromkeys(t2c.get("views") or ["beginner"]))
+    unknown = [v for v in views if v not in VIEWS]
+    if unknown:
+        raise ValueError(f"Unknown text2cad views {unknown}; choose from {list(VIEWS)}")
+
     #
-    api_key = None
-    base_url = None
     if emb_source.lower().startswith("portkey"):
         api_key = os.environ.get('PORTKEY_API_KEY')
         base_url = os.environ.get('PORTKEY_BASE_URL')
@@ -123,44 +246,92 @@ def main():
         if not api_key or not base_url:
             raise ValueError("Missing or empty PORTKEY_API_KEY or PORTKEY_BASE_URL environment variable.")
 
-    # chunk
-    chunks = chunk_part()
-
-    if not chunks:
-        raise SystemExit("No chunks extracted.")
-
-    print(f"Embedding {len(chunks)} chunks with {emb_model}…")
-
-    # embed texts
-    texts = [c.beginner_description for c in chunks]
-    if emb_source.lower().startswith("portkey"):
-        api_key = os.environ['PORTKEY_API_KEY']
-        base_url = os.environ['PORTKEY_BASE_URL']
-        client = Portkey(
-            base_url=base_url,
-            api_key=api_key,
-        )
-        vecs = embed_texts_portkey(client, emb_model, texts, batch_size, normalize)
-
-    else:
-        # default to sentence transformer
-        model = SentenceTransformer(emb_model)
-        vecs = embed_texts_sentence_transformer(model, texts, batch_size, normalize)
-
-    # generate Chroma vector db
     print(f"Connecting to Chroma (persist_dir={persist_dir})…")
-    upload_embeddings_to_db(chunks, texts, vecs, persist_dir, collection, recreate)
-
-    # saving metadata
-    create_db_metadata(meta_path, model_path, emb_model, chunks)
+    # the view list is kept on the collection so queries know to over-fetch and fuse per uid
+    col = open_collection(persist_dir, collection, recreate, {"views": ",".join(views)}, backend,
+                          config["chroma"].get("quantization"), config["chroma"].get("shards", 1))
+    # the metadata is only set when the collection is created, so an existing one must be written with its views
+    stored = (col.metadata or {}).get("views")
+    if not recreate and stored and stored.split(",") != views:
+        raise SystemExit(f"Collection {collection!r} was built with --views {stored}; pass the same views to add "
+                         f"to it, or --recreate to rebuild it with {','.join(views)}.")
+    if not recreate and not stored and len(views) > 1:
+        # built before the views were recorded, i.e. with a single view
+        raise SystemExit(f"Collection {collection!r} was built with a single view; pass one --views to add to it, "
+                         f"or --recreate to rebuild it with {','.join(views)}.")
+    embed_fn = make_embedder(config, show_progress=False)
+
+    # csv parsing and CadQuery reads run on the prefetch thread, ahead of embedding
+    reader = CQReader(t2c.get("cq_dir", "CQ"), t2c.get("cq_archive"), t2c.get("io_workers", 16))
+    stats: Dict[str, int] = {}
+    timings: Dict[str, float] = {}
+    n_parts = 0
+    n_vectors = 0
+    t_start = time.perf_counter()
+    print(f"Embedding text2cad parts ({', '.join(views)}) with {emb_model}…")
+    with ExitStack() as stack:
+        code_store = stack.enter_context(closing(BlobStore(code_dir)))
+        if meta_format == "sqlite":
+            store = stack.enter_context(closing(MetadataStore(meta_path)))
+            if recreate:
+                store.clear()
+            store.set_owner(persist_dir, collection)
+
+            def write_meta(chunks: List[Part_Chunk]):
+                store.add(chunks, exclude=("cad_query_code",))
+        else:
+            ensure_parent(meta_path)
+            meta_f = stack.enter_context(open(meta_path, "w", encoding="utf-8"))
+
+            def write_meta(chunks: List[Part_Chunk]):
+                write_db_metadata(meta_f, chunks, exclude=("cad_query_code",))
+        if recreate:
+            code_store.clear()
+        bar = stack.enter_context(tqdm(desc="Parts", unit="part"))
+
+        batches = prefetch(iter_view_batches(iter_part_batches(t2c.get("csv_path", "text2cad_v1.1.csv"), reader,
+                                                               max(1, upsert_batch // len(views)), t2c.get("limit"),
+                                                               stats), views),
+                           prefetch_batches)
+
+        def write_batch(batch: PartBatch, vecs):
+            # code first: a part is only findable in Chroma once its source can be fetched
+            code_store.put_many([p.id for p in batch.parts], [p.cad_query_code for p in batch.parts])
+            upsert_chunks(col, batch.chunks, [c.text for c in batch.chunks], vecs, CHROMA_FIELDS)
+            write_meta(batch.parts)
+            bar.update(len(batch.parts))
+
+        # upserts run on the writer thread while the next batch is being embedded
+        try:
+            with BackgroundWriter(write_batch, prefetch_batches) as writer:
+                for batch, vecs in iter_embedded_batches(batches, embed_fn, timings):
+                    writer.submit(batch, vecs)
+                    n_parts += len(batch.parts)
+                    n_vectors += len(batch.chunks)
+        finally:
+            reader.close()
+
+    if not n_parts:
+        raise SystemExit("No parts extracted.")
+    finish_collection(col, config["chroma"].get("compact_dead_fraction"))
+    if stats.get("missing_code"):
+        print(f"Skipped {stats['missing_code']} of {stats['rows']} parts without a CadQuery source.")
+    print(f"Stages: {time.perf_counter() - t_start:.1f}s wall, {timings.get('embed', 0.0):.1f}s embedding, "
+          f"{writer.write_seconds:.1f}s writing")
+
+    # saving model name
+    ensure_parent(model_path)
+    Path(model_path).write_text(emb_model, encoding="utf-8")
 
     # Save to disk
     print("Done.")
+    print(f"  Parts:       {n_parts} ({n_vectors} vectors)")
     print(f"  Chroma dir:  {persist_dir}")
     print(f"  Collection:  {collection}")
     print(f"  Metadata:    {meta_path}")
+    print(f"  Code store:  {code_dir}")
     print(f"  Model file:  {model_path}")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,133 @@
+"""
+Exact and near-duplicate chunk removal ahead of embedding.
+
+1) exact: sha1 of the whitespace/case-normalized text
+2) near: MinHash signatures over word shingles, bucketed with LSH bands; a candidate pair is a duplicate when the
+   fraction of matching signature slots (estimated Jaccard similarity) reaches `threshold`
+
+State is kept across calls, so batches from a streaming pipeline are deduplicated against everything seen so far
+in the run. The first occurrence of a text is kept.
+"""
+
+from __future__ import annotations
+import hashlib, re, zlib
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+import numpy as np
+
+
+_PRIME = (1 << 31) - 1
+_WORD = re.compile(r"\w+")
+
+
+class ChunkDeduplicator:
+    def __init__(self, threshold: float = 0.85, num_perm: int = 64, bands: int = 16, shingle: int = 5,
+                 seed: int = 0):
+        """
+        :param threshold: estimated Jaccard similarity at or above which a chunk is a near-duplicate
+        :param num_perm: MinHash signature length
+        :param bands: LSH bands (must divide num_perm); more bands catch lower similarities as candidates
+        :param shingle: words per shingle
+        :param seed: seed for the hash permutations
+        """
+        if num_perm % bands:
+            raise ValueError("bands must divide num_perm")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle = shingle
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, _PRIME, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, _PRIME, size=num_perm, dtype=np.uint64)
+
+        self.exact: Dict[bytes, str] = {}
+        self.buckets: List[Dict[bytes, List[int]]] = [defaultdict(list) for _ in range(bands)]
+        self.sigs: List[np.ndarray] = []
+        self.kept_ids: List[str] = []
+        self.n_seen = 0
+        self.n_exact = 0
+        self.n_near = 0
+
+    def signature(self, text: str) -> np.ndarray:
+        words = _WORD.findall(text.lower())
+        h = np.array([zlib.crc32(w.encode()) for w in words] or [0], dtype=np.uint64)
+        k = min(self.shingle, len(h))
+        # polynomial hash of each k-word window, computed for all windows at once
+        sh = np.zeros(len(h) - k + 1, dtype=np.uint64)
+        for j in range(k):
+            sh = (sh * np.uint64(1000003) + h[j:len(h) - k + 1 + j]) % np.uint64(_PRIME)
+        return ((sh[:, None] * self.a[None, :] + self.b[None, :]) % np.uint64(_PRIME)).min(axis=0).astype(np.uint32)
+
+    def check(self, chunk_id: str, text: str) -> str | None:
+        """
+        Registers a chunk and reports whether it duplicates an earlier one.
+        :param chunk_id: id of the chunk
+        :param text: chunk text
+        :return: id of the kept chunk this one duplicates, or None if it is new (and now kept)
+        """
+        self.n_seen += 1
+        key = hashlib.sha1(" ".join(text.lower().split()).encode()).digest()
+        if key in self.exact:
+            self.n_exact += 1
+            return self.exact[key]
+
+        sig = self.signature(text)
+        band_keys = [sig[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+        candidates = {c for i, bk in enumerate(band_keys) for c in self.buckets[i].get(bk, ())}
+        for c in candidates:
+            if np.mean(self.sigs[c] == sig) >= self.threshold:
+                self.n_near += 1
+                self.exact[key] = self.kept_ids[c]
+                return self.kept_ids[c]
+
+        idx = len(self.sigs)
+        self.sigs.append(sig)
+        self.kept_ids.append(chunk_id)
+        self.exact[key] = chunk_id
+        for i, bk in enumerate(band_keys):
+            self.buckets[i][bk].append(idx)
+        return None
+
+    def filter(self, chunks: List, text_attr: str = "text") -> Tuple[List, List[Tuple[str, str]]]:
+        """
+        Splits a batch of chunks into kept chunks and (dropped id, kept id) pairs.
+        :param chunks: dataclass chunks with an `id` and a text attribute
+        :param text_attr: name of the attribute holding the text
+        :return: (kept chunks, duplicate pairs)
+        """
+        kept, dups = [], []
+        for c in chunks:
+            orig = self.check(c.id, getattr(c, text_attr))
+            if orig is None:
+                kept.append(c)
+            elif orig != c.id:
+                dups.append((c.id, orig))
+        return kept, dups
+
+    def report(self) -> str:
+        removed = self.n_exact + self.n_near
+        pct = removed / self.n_seen if self.n_seen else 0.0
+        return (f"Dedup: removed {removed} of {self.n_seen} chunks ({pct:.1%}): "
+                f"{self.n_exact} exact, {self.n_near} near-duplicates")
+
+
+def iter_deduped_batches(batches: Iterable, dedup: ChunkDeduplicator | None, dup_log=None) -> Iterator:
+    """
+    Drops duplicate chunks from each batch; batches that end up empty are skipped.
+    :param batches: iterator of batches holding their chunks in a `.chunks` list (e.g. build_rag.ChunkBatch)
+    :param dedup: ChunkDeduplicator (batches pass through unchanged if None)
+    :param dup_log: optional text file; one "dropped_id<TAB>kept_id" line is written per duplicate
+    :return: iterator of the same batches with duplicates removed
+    """
+    for batch in batches:
+        if dedup is None:
+            yield batch
+            continue
+        batch.chunks, dups = dedup.filter(batch.chunks)
+        if dup_log is not None:
+            for d, k in dups:
+                dup_log.write(f"{d}\t{k}\n")
+        if batch.chunks:
+            yield batch
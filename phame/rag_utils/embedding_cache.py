@@ -0,0 +1,394 @@
+"""
+Persistent, content-addressed cache for embeddings.
+
+Vectors are keyed by (model name, normalize flag, sha256 of the text). Each (model, normalize) pair gets its own
+directory holding:
+1) vectors.f32 - append-only float32 rows, read back through a memory map
+2) index.sqlite - text hash -> row number, plus a last-used counter for eviction
+3) meta.json - model name, normalize flag and vector dimension
+
+When vectors.f32 grows past max_bytes, the least recently used rows are dropped by rewriting the file.
+An instance may be shared by threads; its reads and writes are serialized by a lock. Processes sharing a directory
+are serialized by an flock on its lock file; where fcntl is missing (Windows) use one process per cache directory.
+
+QueryEmbeddingCache puts an in-process LRU with a TTL in front of it for query embeddings.
+"""
+
+from __future__ import annotations
+import hashlib, json, os, sqlite3, threading, time, unicodedata
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock
+    fcntl = None
+
+
+class EmbeddingCache:
+    def __init__(self, cache_dir: str | Path, model: str, normalize: bool, max_bytes: int = 4 << 30,
+                 namespace: str = ""):
+        """
+        :param cache_dir: root cache directory (shared by all models)
+        :param model: embedding model name
+        :param normalize: whether the cached vectors were normalized
+        :param max_bytes: size bound for the vector file; LRU rows are evicted past this
+        :param namespace: keeps these entries apart from others of the same model (e.g. "query")
+        """
+        ns_key = f"{model}|{bool(normalize)}" + (f"|{namespace}" if namespace else "")
+        ns = hashlib.sha1(ns_key.encode()).hexdigest()[:16]
+        self.dir = Path(cache_dir) / ns
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.model = model
+        self.normalize = bool(normalize)
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.vec_path = self.dir / "vectors.f32"
+        self.meta_path = self.dir / "meta.json"
+        self.hits = 0
+        self.misses = 0
+
+        self.dim = None
+        if self.meta_path.exists():
+            self.dim = json.loads(self.meta_path.read_text(encoding="utf-8"))["dim"]
+
+        # the connection is used from whichever thread holds the lock
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(str(self.dir / "index.sqlite"), check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries (key BLOB PRIMARY KEY, row INTEGER NOT NULL, "
+                        "used INTEGER NOT NULL)")
+        self.db.commit()
+        self._lock_f = open(self.dir / "lock", "ab") if fcntl is not None else None
+        self._mm = None
+        self._mm_ino = None
+
+    @contextmanager
+    def _locked(self):
+        # the thread lock serializes this instance, the file lock the processes sharing the directory
+        with self.lock:
+            if self._lock_f is None:
+                yield
+                return
+            fcntl.flock(self._lock_f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_f, fcntl.LOCK_UN)
+
+    @staticmethod
+    def key(text: str) -> bytes:
+        return hashlib.sha256(text.encode("utf-8")).digest()
+
+    def _rows(self) -> int:
+        if not self.dim or not self.vec_path.exists():
+            return 0
+        return self.vec_path.stat().st_size // (4 * self.dim)
+
+    def _view(self, need_rows: int) -> np.ndarray:
+        # remap when the file has grown past what the current map covers, or was rewritten by another process
+        ino = self.vec_path.stat().st_ino
+        if self._mm is None or self._mm.shape[0] < need_rows or ino != self._mm_ino:
+            self._mm = np.memmap(self.vec_path, dtype="float32", mode="r", shape=(self._rows(), self.dim))
+            self._mm_ino = ino
+        return self._mm
+
+    def get_many(self, texts: List[str]) -> Tuple[np.ndarray | None, List[int]]:
+        """
+        Looks up cached vectors.
+        :param texts: list of texts
+        :return: (array with a row per text, zero rows where missing or None if nothing cached yet,
+                  indices of the texts that were not found)
+        """
+        with self._locked():
+            if not texts or not self.dim:
+                self.misses += len(texts)
+                return None, list(range(len(texts)))
+
+            keys = [self.key(t) for t in texts]
+            found: Dict[bytes, int] = {}
+            uniq = list(dict.fromkeys(keys))
+            for i in range(0, len(uniq), 500):
+                part = uniq[i:i + 500]
+                q = f"SELECT key, row FROM entries WHERE key IN ({','.join('?' * len(part))})"
+                found.update(self.db.execute(q, part).fetchall())
+
+            out = np.zeros((len(texts), self.dim), dtype="float32")
+            missing = [i for i, k in enumerate(keys) if k not in found]
+            if found:
+                hit_idx = [i for i, k in enumerate(keys) if k in found]
+                hit_rows = np.array([found[keys[i]] for i in hit_idx])
+                out[hit_idx] = self._view(int(hit_rows.max()) + 1)[hit_rows]
+                now = time.time_ns()
+                self.db.executemany("UPDATE entries SET used = ? WHERE key = ?", [(now, k) for k in found])
+                self.db.commit()
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+            return out, missing
+
+    def put_many(self, texts: List[str], vecs: np.ndarray):
+        """
+        Appends vectors for texts that are not cached yet.
+        :param texts: list of texts
+        :param vecs: vectors, one row per text
+        """
+        with self._locked():
+            if not texts:
+                return
+            vecs = np.ascontiguousarray(vecs, dtype="float32")
+            if not self.dim:
+                self.dim = int(vecs.shape[1])
+                self.meta_path.write_text(json.dumps({"model": self.model, "normalize": self.normalize,
+                                                      "dim": self.dim}), encoding="utf-8")
+            if vecs.shape[1] != self.dim:
+                raise ValueError(f"cache for {self.model!r} holds dim {self.dim}, got {vecs.shape[1]}")
+
+            keys = [self.key(t) for t in texts]
+            first = {}
+            for i, k in enumerate(keys):
+                first.setdefault(k, i)
+            have = set()
+            uniq = list(first)
+            for i in range(0, len(uniq), 500):
+                part = uniq[i:i + 500]
+                q = f"SELECT key FROM entries WHERE key IN ({','.join('?' * len(part))})"
+                have.update(k for (k,) in self.db.execute(q, part).fetchall())
+            new = [(k, i) for k, i in first.items() if k not in have]
+            if not new:
+                return
+
+            # the index is authoritative: bytes past its last row are left by an append that died before the
+            # commit (possibly mid-row), and appending after them would misalign every later row
+            row0 = self.db.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM entries").fetchone()[0]
+            if self.vec_path.exists() and self.vec_path.stat().st_size > row0 * 4 * self.dim:
+                self._mm = None
+                os.truncate(self.vec_path, row0 * 4 * self.dim)
+            # vectors first, index second: a crash in between only leaves unreferenced rows behind
+            with open(self.vec_path, "ab") as f:
+                f.write(vecs[[i for _, i in new]].tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            now = time.time_ns()
+            self.db.executemany("INSERT OR IGNORE INTO entries (key, row, used) VALUES (?, ?, ?)",
+                                [(k, row0 + j, now) for j, (k, _) in enumerate(new)])
+            self.db.commit()
+
+            if self.vec_path.stat().st_size > self.max_bytes:
+                self._evict()
+
+    def evict(self, target: float = 0.75):
+        """
+        Rewrites the vector file keeping only the most recently used rows, up to target * max_bytes.
+        :param target: fraction of max_bytes to shrink to
+        """
+        with self._locked():
+            self._evict(target)
+
+    def _evict(self, target: float = 0.75):
+        keep = int(target * self.max_bytes) // (4 * self.dim)
+        entries = self.db.execute("SELECT key, row FROM entries ORDER BY used DESC LIMIT ?", (keep,)).fetchall()
+        old = self._view(self._rows())
+        tmp = self.vec_path.with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            for i in range(0, len(entries), 65536):
+                rows = np.array([r for _, r in entries[i:i + 65536]])
+                f.write(np.ascontiguousarray(old[rows]).tobytes())
+        self._mm = None
+        del old
+        os.replace(tmp, self.vec_path)
+        self.db.execute("DELETE FROM entries")
+        self.db.executemany("INSERT INTO entries (key, row, used) VALUES (?, ?, ?)",
+                            [(k, j, len(entries) - j) for j, (k, _) in enumerate(entries)])
+        self.db.commit()
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0,
+                    "rows": self._rows(), "bytes": self._rows() * 4 * (self.dim or 0)}
+
+    def close(self):
+        with self.lock:
+            self._mm = None
+            self.db.close()
+            if self._lock_f is not None:
+                self._lock_f.close()
+
+
+def normalize_query(text: str, casefold: bool = False) -> str:
+    """
+    Canonical form of a query used as its cache key: unicode NFKC, whitespace collapsed, optionally casefolded.
+    :param text: query text
+    :param casefold: also ignore case (only safe for uncased embedding models)
+    :return: normalized text
+    """
+    text = " ".join(unicodedata.normalize("NFKC", text).split())
+    return text.casefold() if casefold else text
+
+
+class QueryEmbeddingCache:
+    """
+    In-process LRU of query embeddings with a time-to-live, optionally backed by an on-disk EmbeddingCache.
+    Keys are the normalized query text (one instance per model), so repeated or near-identical questions skip
+    the embedding call. Same get_many/put_many interface as EmbeddingCache, so it plugs into cached_embedder.
+    """
+    def __init__(self, model: str, max_entries: int = 4096, ttl: float | None = 3600.0,
+                 disk: EmbeddingCache | None = None, casefold: bool = False):
+        """
+        :param model: embedding model name (for reporting; use one instance per model)
+        :param max_entries: LRU capacity (0 = memory tier off)
+        :param ttl: seconds an entry stays valid in memory (None or 0 = forever)
+        :param disk: optional EmbeddingCache consulted on memory misses and filled on puts; it is keyed by the
+                     normalized query text, so give it its own namespace (see make_query_cache)
+        :param casefold: ignore case when matching queries
+        """
+        self.model = model
+        self.max_entries = max_entries
+        self.ttl = float(ttl) if ttl else None
+        self.disk = disk
+        self.casefold = casefold
+        self.entries: "OrderedDict[str, Tuple[float, np.ndarray]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _lookup(self, key: str, now: float) -> np.ndarray | None:
+        item = self.entries.get(key)
+        if item is None:
+            return None
+        expires, vec = item
+        if expires < now:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return vec
+
+    def _store(self, key: str, vec: np.ndarray, now: float):
+        self.entries[key] = (now + self.ttl if self.ttl is not None else float("inf"), vec)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get_many(self, texts: List[str]) -> Tuple[np.ndarray | None, List[int]]:
+        """
+        Looks up cached query vectors (memory first, then the disk tier).
+        :param texts: list of queries
+        :return: (array with a row per query or None if nothing was found, indices of the queries not found)
+        """
+        keys = [normalize_query(t, self.casefold) for t in texts]
+        now = time.monotonic()
+        with self.lock:
+            found = {i: v for i, k in enumerate(keys) if (v := self._lookup(k, now)) is not None}
+            self.hits += len(found)
+
+        missing = [i for i in range(len(texts)) if i not in found]
+        if missing and self.disk is not None:
+            vecs, still = self.disk.get_many([keys[i] for i in missing])
+            still = set(still)
+            with self.lock:
+                for j, i in enumerate(missing):
+                    if j not in still:
+                        found[i] = vecs[j]
+                        self._store(keys[i], vecs[j], now)
+                        self.disk_hits += 1
+            missing = [i for i in missing if i not in found]
+        with self.lock:
+            self.misses += len(missing)
+
+        if not found:
+            return None, missing
+        out = np.zeros((len(texts), len(next(iter(found.values())))), dtype="float32")
+        for i, v in found.items():
+            out[i] = v
+        return out, missing
+
+    def put_many(self, texts: List[str], vecs: np.ndarray):
+        """
+        Caches query vectors in memory and, if configured, on disk.
+        :param texts: list of queries
+        :param vecs: vectors, one row per query
+        """
+        keys = [normalize_query(t, self.casefold) for t in texts]
+        vecs = np.asarray(vecs, dtype="float32")
+        now = time.monotonic()
+        with self.lock:
+            for k, v in zip(keys, vecs):
+                self._store(k, v, now)
+        if self.disk is not None:
+            self.disk.put_many(keys, vecs)
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.disk_hits + self.misses
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / total if total else 0.0, "entries": len(self.entries)}
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+
+def cached_embedder(embed_fn: Callable[[List[str]], np.ndarray], cache: EmbeddingCache | None
+                    ) -> Callable[[List[str]], np.ndarray]:
+    """
+    Puts a cache in front of an embedding function: only texts that miss the cache are sent to embed_fn.
+    :param embed_fn: function mapping a list of texts to a float32 array of vectors
+    :param cache: EmbeddingCache (embed_fn is returned unchanged if None)
+    :return: function with the same signature as embed_fn; the cache and embed_fn are reachable as `.cache`
+             and `.inner`
+    """
+    if cache is None:
+        return embed_fn
+
+    def embed(texts: List[str]) -> np.ndarray:
+        out, missing = cache.get_many(texts)
+        if not missing:
+            return out
+        new = np.asarray(embed_fn([texts[i] for i in missing]), dtype="float32")
+        cache.put_many([texts[i] for i in missing], new)
+        if out is None:
+            return new
+        out[missing] = new
+        return out
+
+    embed.cache = cache
+    embed.inner = embed_fn
+    return embed
+
+
+def make_cache(config: Dict, model: str | None = None, normalize: bool | None = None,
+               namespace: str = "") -> EmbeddingCache | None:
+    """
+    Builds the cache described by the `embedding` config section.
+    :param config: config dictionary
+    :param model: model name override (defaults to config["embedding"]["model"])
+    :param normalize: normalize flag override (defaults to config["embedding"]["normalize"])
+    :param namespace: EmbeddingCache namespace
+    :return: EmbeddingCache, or None if embedding.cache_dir is unset
+    """
+    emb = config["embedding"]
+    if not emb.get("cache_dir"):
+        return None
+    if normalize is None:
+        normalize = emb.get("normalize", False)
+    return EmbeddingCache(emb["cache_dir"], model or emb["model"], normalize,
+                          int(emb.get("cache_max_mb", 4096)) << 20, namespace)
+
+
+def make_query_cache(config: Dict, model: str | None = None) -> QueryEmbeddingCache:
+    """
+    Builds the query-embedding LRU described by the `embedding` config section, with the on-disk cache as its
+    second tier when embedding.cache_dir is set. Query vectors go to their own "query" namespace of the disk
+    cache, so they never share entries with chunk embeddings of the same text.
+    :param config: config dictionary
+    :param model: model name override (defaults to config["embedding"]["model"])
+    :return: QueryEmbeddingCache
+    """
+    emb = config["embedding"]
+    return QueryEmbeddingCache(model or emb["model"], int(emb.get("query_cache_size", 4096)),
+                               emb.get("query_cache_ttl", 3600),
+                               make_cache(config, model, normalize=False, namespace="query"),
+                               bool(emb.get("query_cache_casefold", False)))
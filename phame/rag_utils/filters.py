@@ -0,0 +1,90 @@
+"""
+Typed metadata filters for retrieval.
+
+A RetrievalFilter restricts a query to part of the knowledge base (source files, a page range, an ingestion tag).
+It is translated into the store's own filter syntax so the restriction is applied by the index, before the
+similarity search, rather than by dropping hits afterwards:
+1) to_where - Chroma `where` clause (also understood by FlatIndex, which evaluates it as cached row bitmaps)
+2) to_haystack - Haystack filter dict for ChromaEmbeddingRetriever
+Neither syntax has a glob operator, so the source glob is first resolved against the known sources into an
+$in / "in" list.
+"""
+
+from __future__ import annotations
+from dataclasses import dataclass
+from fnmatch import fnmatchcase
+from typing import Any, Dict, Iterable, List
+
+
+@dataclass
+class RetrievalFilter:
+    source: str | None = None  # glob over the source path, case-insensitive (e.g. "*shigley*ch1?.pdf")
+    page_min: int | None = None  # first page, inclusive
+    page_max: int | None = None  # last page, inclusive
+    tag: str | None = None  # tag given at ingestion (build_rag --tag)
+
+    def is_empty(self) -> bool:
+        return self.source is None and self.page_min is None and self.page_max is None and self.tag is None
+
+    def match_sources(self, sources: Iterable[str]) -> List[str]:
+        """
+        :param sources: known source paths
+        :return: the sources matching the glob (all of them when no glob is set)
+        """
+        if self.source is None:
+            return list(sources)
+        pattern = self.source.lower()
+        return [s for s in sources if fnmatchcase(s.lower(), pattern)]
+
+    def to_where(self, sources: List[str] | None = None, source_key: str = "source", page_key: str = "page",
+                 tag_key: str = "tag") -> Dict[str, Any] | None:
+        """
+        :param sources: sources matching the glob (from match_sources); required when source is set
+        :return: Chroma where clause, or None when nothing is filtered
+        """
+        conds: List[Dict[str, Any]] = []
+        if self.source is not None:
+            conds.append({source_key: {"$in": list(sources)}})
+        if self.page_min is not None:
+            conds.append({page_key: {"$gte": self.page_min}})
+        if self.page_max is not None:
+            conds.append({page_key: {"$lte": self.page_max}})
+        if self.tag is not None:
+            conds.append({tag_key: {"$eq": self.tag}})
+        if not conds:
+            return None
+        return conds[0] if len(conds) == 1 else {"$and": conds}
+
+    def to_haystack(self, sources: List[str] | None = None, source_key: str = "meta.file_path",
+                    page_key: str = "meta.page_number", tag_key: str = "meta.tag") -> Dict[str, Any] | None:
+        """
+        :param sources: sources matching the glob (from match_sources); required when source is set
+        :return: Haystack filter dict, or None when nothing is filtered
+        """
+        conds: List[Dict[str, Any]] = []
+        if self.source is not None:
+            conds.append({"field": source_key, "operator": "in", "value": list(sources)})
+        if self.page_min is not None:
+            conds.append({"field": page_key, "operator": ">=", "value": self.page_min})
+        if self.page_max is not None:
+            conds.append({"field": page_key, "operator": "<=", "value": self.page_max})
+        if self.tag is not None:
+            conds.append({"field": tag_key, "operator": "==", "value": self.tag})
+        if not conds:
+            return None
+        return conds[0] if len(conds) == 1 else {"operator": "AND", "conditions": conds}
+
+    def matches(self, meta: Dict[str, Any] | None, source_key: str = "source", page_key: str = "page",
+                tag_key: str = "tag") -> bool:
+        """
+        Checks one record's metadata (for hits that did not come through a filtered index query).
+        """
+        meta = meta or {}
+        if self.source is not None and not fnmatchcase(str(meta.get(source_key, "")).lower(), self.source.lower()):
+            return False
+        page = meta.get(page_key)
+        if self.page_min is not None and (page is None or page < self.page_min):
+            return False
+        if self.page_max is not None and (page is None or page > self.page_max):
+            return False
+        return self.tag is None or meta.get(tag_key) == self.tag
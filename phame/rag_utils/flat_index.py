@@ -0,0 +1,382 @@
+"""
+Exact brute-force vector index: a drop-in replacement for a Chroma collection on small corpora.
+
+Vectors are L2-normalized float32 rows of persist_dir/flat/<collection>/vectors.npy, memory-mapped on load. The
+file is pre-allocated and grows by doubling, so appends are amortized O(1); only the first `n` rows are used.
+index.sqlite maps each id to its row and holds the document and metadata. Search is a cosine similarity computed
+as blocked matrix products over the rows, with argpartition for the top-k of each block, so memory stays bounded
+for any corpus size and a batch of queries costs one pass over the matrix.
+
+The upsert/delete/get/query/count methods take and return the same shapes as chromadb's Collection (distances
+are cosine distances, 1 - similarity), so build_rag and query_rag can use either backend. A Chroma-style `where`
+filter is turned into a boolean row mask before the scan; per-value bitmaps (e.g. one per source) are computed on
+first use and kept until the index changes.
+"""
+
+from __future__ import annotations
+import json, operator, shutil, sqlite3
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+
+BLOCK_ROWS = 65536
+
+_COMPARE = {"$gt": operator.gt, "$gte": operator.ge, "$lt": operator.lt, "$lte": operator.le}
+
+
+class FlatIndex:
+    def __init__(self, root: str | Path, metadata: Dict[str, Any] | None = None, readonly: bool = False):
+        """
+        :param root: index directory (holds vectors.npy and index.sqlite)
+        :param metadata: collection-level metadata, stored when the index is created
+        :param readonly: open for queries only
+        """
+        self.root = Path(root)
+        self.name = self.root.name
+        self.vec_path = self.root / "vectors.npy"
+        self.readonly = readonly
+        if readonly:
+            self.db = sqlite3.connect(f"file:{(self.root / 'index.sqlite').as_posix()}?mode=ro", uri=True,
+                                      check_same_thread=False)
+        else:
+            self.root.mkdir(parents=True, exist_ok=True)
+            self.db = sqlite3.connect(str(self.root / "index.sqlite"), check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS records (id TEXT PRIMARY KEY, row INTEGER NOT NULL, "
+                            "document TEXT, metadata TEXT)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)")
+            self.db.execute("INSERT OR IGNORE INTO info VALUES ('metadata', ?)", (json.dumps(metadata or {}),))
+            self.db.execute("INSERT OR IGNORE INTO info VALUES ('rows', '0')")
+            self.db.commit()
+        info = dict(self.db.execute("SELECT key, value FROM info").fetchall())
+        self.metadata: Dict[str, Any] = json.loads(info["metadata"])
+        self.n = int(info["rows"])  # rows of vectors.npy in use (live and deleted)
+
+        self.vecs: np.ndarray | None = None
+        if self.vec_path.exists():
+            self.vecs = np.load(self.vec_path, mmap_mode="r" if readonly else "r+")
+        self.alive = np.zeros(self.n, dtype=bool)
+        self.row_ids: List[str | None] = [None] * self.n
+        for rid, row in self.db.execute("SELECT id, row FROM records"):
+            self.alive[row] = True
+            self.row_ids[row] = rid
+        self._columns: Dict[Any, np.ndarray] = {}
+        self._bitmaps: Dict[tuple, np.ndarray] = {}
+
+    def count(self) -> int:
+        return int(self.alive.sum())
+
+    def _rows_of(self, ids: List[str]) -> Dict[str, int]:
+        rows: Dict[str, int] = {}
+        for i in range(0, len(ids), 900):
+            part = ids[i:i + 900]
+            q = f"SELECT id, row FROM records WHERE id IN ({','.join('?' * len(part))})"
+            rows.update(self.db.execute(q, part).fetchall())
+        return rows
+
+    def _reserve(self, rows: int, dim: int):
+        # grow the pre-allocated .npy by doubling so appends stay amortized O(1)
+        cap = 0 if self.vecs is None else self.vecs.shape[0]
+        if rows <= cap:
+            return
+        new_cap = max(rows, 2 * cap, 1024)
+        tmp = self.vec_path.with_suffix(".tmp.npy")
+        grown = np.lib.format.open_memmap(tmp, mode="w+", dtype="float32", shape=(new_cap, dim))
+        if self.n:
+            grown[:self.n] = self.vecs[:self.n]
+        grown.flush()
+        del grown
+        self.vecs = None
+        shutil.move(tmp, self.vec_path)
+        self.vecs = np.load(self.vec_path, mmap_mode="r+")
+
+    def upsert(self, ids: List[str], embeddings, documents: List[str] | None = None,
+               metadatas: List[Dict[str, Any]] | None = None):
+        """
+        Inserts or replaces records; existing ids are overwritten in place.
+        :param ids: record ids
+        :param embeddings: vectors, one row per id (normalized on write)
+        :param documents: optional documents
+        :param metadatas: optional metadata dicts
+        """
+        if not ids:
+            return
+        vecs = np.asarray(embeddings, dtype="float32")
+        vecs = vecs / (np.linalg.norm(vecs, axis=1, keepdims=True) + 1e-12)
+        documents = documents or [None] * len(ids)
+        metadatas = metadatas or [None] * len(ids)
+
+        existing = self._rows_of(list(ids))
+        rows = []
+        n_new = 0
+        for rid in ids:
+            if rid in existing:
+                rows.append(existing[rid])
+            else:
+                existing[rid] = self.n + n_new  # repeated ids within a batch share a row
+                rows.append(existing[rid])
+                n_new += 1
+        self._reserve(self.n + n_new, vecs.shape[1])
+        if self.vecs.shape[1] != vecs.shape[1]:
+            raise ValueError(f"index {self.name!r} holds dim {self.vecs.shape[1]}, got {vecs.shape[1]}")
+
+        rows_arr = np.array(rows)
+        self.vecs[rows_arr] = vecs
+        self.vecs.flush()
+        # vectors first, records second: a crash in between leaves unreferenced rows, never dangling ids
+        self.n += n_new
+        self.db.executemany("INSERT OR REPLACE INTO records (id, row, document, metadata) VALUES (?, ?, ?, ?)",
+                            [(rid, r, d, json.dumps(m) if m is not None else None)
+                             for rid, r, d, m in zip(ids, rows, documents, metadatas)])
+        self.db.execute("UPDATE info SET value = ? WHERE key = 'rows'", (str(self.n),))
+        self.db.commit()
+
+        if len(self.alive) < self.n:
+            self.alive = np.concatenate([self.alive, np.zeros(self.n - len(self.alive), dtype=bool)])
+            self.row_ids.extend([None] * (self.n - len(self.row_ids)))
+        self.alive[rows_arr] = True
+        for rid, r in zip(ids, rows):
+            self.row_ids[r] = rid
+        self._clear_filters()
+
+    def delete(self, ids: List[str]):
+        """
+        Removes records; their rows become dead until compact().
+        :param ids: record ids
+        """
+        rows = self._rows_of(list(ids))
+        for i in range(0, len(ids), 900):
+            part = ids[i:i + 900]
+            self.db.execute(f"DELETE FROM records WHERE id IN ({','.join('?' * len(part))})", part)
+        self.db.commit()
+        for r in rows.values():
+            self.alive[r] = False
+            self.row_ids[r] = None
+        self._clear_filters()
+
+    def dead_fraction(self) -> float:
+        """
+        :return: fraction of the rows of vectors.npy held by deleted records
+        """
+        return 1.0 - self.count() / self.n if self.n else 0.0
+
+    def compact(self, min_dead_fraction: float = 0.0):
+        """
+        Rewrites vectors.npy without dead rows.
+        :param min_dead_fraction: only compact when at least this fraction of the rows is dead
+        """
+        live = np.flatnonzero(self.alive)
+        if len(live) == self.n or self.dead_fraction() < min_dead_fraction:
+            return
+        dim = self.vecs.shape[1]
+        tmp = self.vec_path.with_suffix(".tmp.npy")
+        out = np.lib.format.open_memmap(tmp, mode="w+", dtype="float32", shape=(max(len(live), 1), dim))
+        for i in range(0, len(live), BLOCK_ROWS):
+            out[i:i + BLOCK_ROWS] = self.vecs[live[i:i + BLOCK_ROWS]]
+        out.flush()
+        del out
+        self.vecs = None
+        shutil.move(tmp, self.vec_path)
+        self.vecs = np.load(self.vec_path, mmap_mode="r+")
+        self.db.executemany("UPDATE records SET row = ? WHERE id = ?",
+                            [(j, self.row_ids[r]) for j, r in enumerate(live)])
+        self.n = len(live)
+        self.db.execute("UPDATE info SET value = ? WHERE key = 'rows'", (str(self.n),))
+        self.db.commit()
+        self.row_ids = [self.row_ids[r] for r in live]
+        self.alive = np.ones(self.n, dtype=bool)
+        self._clear_filters()
+
+    def _clear_filters(self):
+        self._columns.clear()
+        self._bitmaps.clear()
+
+    def _column(self, field: str) -> np.ndarray:
+        # one metadata field for every row (None where missing), read once with json_extract
+        if field not in self._columns:
+            col = np.full(self.n, None, dtype=object)
+            for row, v in self.db.execute("SELECT row, json_extract(metadata, ?) FROM records", (f'$."{field}"',)):
+                col[row] = v
+            self._columns[field] = col
+        return self._columns[field]
+
+    def _numeric(self, field: str) -> np.ndarray:
+        key = (field, "numeric")
+        if key not in self._columns:
+            self._columns[key] = np.array([v if isinstance(v, (int, float)) else np.nan
+                                           for v in self._column(field)], dtype="float64")
+        return self._columns[key]
+
+    def _bitmap(self, field: str, value: Any) -> np.ndarray:
+        key = (field, value)
+        if key not in self._bitmaps:
+            self._bitmaps[key] = self._column(field) == value
+        return self._bitmaps[key]
+
+    def distinct(self, field: str) -> List[Any]:
+        """
+        :param field: metadata field
+        :return: sorted distinct values of the field over live rows
+        """
+        return sorted({v for v in self._column(field)[self.alive] if v is not None})
+
+    def where_mask(self, where: Dict[str, Any]) -> np.ndarray:
+        """
+        Evaluates a Chroma where filter ($and/$or; $eq/$ne/$in/$nin/$gt/$gte/$lt/$lte) to a row mask.
+        :param where: filter dict
+        :return: boolean mask over the first n rows
+        """
+        masks = []
+        for key, cond in where.items():
+            if key in ("$and", "$or"):
+                parts = [self.where_mask(c) for c in cond]
+                masks.append(np.logical_and.reduce(parts) if key == "$and" else np.logical_or.reduce(parts))
+                continue
+            if not isinstance(cond, dict):
+                cond = {"$eq": cond}
+            for op, value in cond.items():
+                if op == "$eq":
+                    masks.append(self._bitmap(key, value))
+                elif op == "$ne":
+                    masks.append(~self._bitmap(key, value))
+                elif op in ("$in", "$nin"):
+                    m = np.zeros(self.n, dtype=bool)
+                    for v in value:
+                        m |= self._bitmap(key, v)
+                    masks.append(m if op == "$in" else ~m)
+                elif op in _COMPARE:
+                    with np.errstate(invalid="ignore"):
+                        masks.append(_COMPARE[op](self._numeric(key), value))
+                else:
+                    raise ValueError(f"Unsupported where operator {op!r}")
+        return np.logical_and.reduce(masks) if masks else np.ones(self.n, dtype=bool)
+
+    def _records(self, ids: List[str]) -> Dict[str, tuple]:
+        out: Dict[str, tuple] = {}
+        for i in range(0, len(ids), 900):
+            part = ids[i:i + 900]
+            q = f"SELECT id, document, metadata FROM records WHERE id IN ({','.join('?' * len(part))})"
+            for rid, doc, meta in self.db.execute(q, part):
+                out[rid] = (doc, json.loads(meta) if meta else None)
+        return out
+
+    def get(self, ids: List[str], include: List[str] = ("documents", "metadatas")) -> Dict[str, Any]:
+        """
+        :param ids: record ids
+        :param include: any of "documents", "metadatas", "embeddings"
+        :return: Chroma-shaped get result for the ids that exist
+        """
+        recs = self._records(list(ids))
+        found = [i for i in ids if i in recs]
+        res: Dict[str, Any] = {"ids": found}
+        if "documents" in include:
+            res["documents"] = [recs[i][0] for i in found]
+        if "metadatas" in include:
+            res["metadatas"] = [recs[i][1] for i in found]
+        if "embeddings" in include:
+            rows = self._rows_of(found)
+            res["embeddings"] = np.asarray(self.vecs[[rows[i] for i in found]]) if found else np.zeros((0, 0))
+        return res
+
+    def search(self, queries: np.ndarray, k: int, mask: np.ndarray | None = None):
+        """
+        Exact top-k by cosine similarity.
+        :param queries: query vectors, one row per query
+        :param k: hits per query
+        :param mask: optional boolean row mask restricting the candidates (in addition to deleted rows)
+        :return: (rows, similarities), each of shape (n_queries, <=k), best first
+        """
+        q = np.atleast_2d(np.asarray(queries, dtype="float32"))
+        q = q / (np.linalg.norm(q, axis=1, keepdims=True) + 1e-12)
+        allowed = self.alive if mask is None else self.alive & mask[:self.n]
+        k = min(k, int(allowed.sum()))
+        if k == 0 or self.vecs is None:
+            return np.zeros((len(q), 0), dtype=int), np.zeros((len(q), 0), dtype="float32")
+
+        # a selective mask (e.g. one source) gathers just its rows instead of scanning the whole matrix
+        subset = np.flatnonzero(allowed) if mask is not None and 4 * allowed.sum() <= self.n else None
+        total = self.n if subset is None else len(subset)
+        best_s = np.full((len(q), 0), -np.inf, dtype="float32")
+        best_r = np.zeros((len(q), 0), dtype=int)
+        for start in range(0, total, BLOCK_ROWS):
+            end = min(total, start + BLOCK_ROWS)
+            if subset is None:
+                sims = q @ self.vecs[start:end].T  # (n_queries, block)
+                sims[:, ~allowed[start:end]] = -np.inf
+            else:
+                sims = q @ np.asarray(self.vecs[subset[start:end]]).T
+            kb = min(k, end - start)
+            part = np.argpartition(-sims, kb - 1, axis=1)[:, :kb]
+            cand_s = np.concatenate([best_s, np.take_along_axis(sims, part, axis=1)], axis=1)
+            cand_r = np.concatenate([best_r, part + start if subset is None else subset[start:end][part]], axis=1)
+            if cand_s.shape[1] > k:
+                keep = np.argpartition(-cand_s, k - 1, axis=1)[:, :k]
+                cand_s = np.take_along_axis(cand_s, keep, axis=1)
+                cand_r = np.take_along_axis(cand_r, keep, axis=1)
+            best_s, best_r = cand_s, cand_r
+        order = np.argsort(-best_s, axis=1)
+        best_s = np.take_along_axis(best_s, order, axis=1)
+        best_r = np.take_along_axis(best_r, order, axis=1)
+        return best_r, best_s
+
+    def query(self, query_embeddings, n_results: int = 10, include: List[str] = ("documents", "metadatas",
+              "distances"), where: Dict[str, Any] | None = None) -> Dict[str, Any]:
+        """
+        Chroma-compatible batched query.
+        :param query_embeddings: query vectors, one row per query
+        :param n_results: hits per query
+        :param include: any of "documents", "metadatas", "distances", "embeddings"
+        :param where: optional Chroma-style metadata filter, applied as a row mask before the scan
+        :return: Chroma-shaped result with one list per query
+        """
+        mask = self.where_mask(where) if where else None
+        rows, sims = self.search(np.asarray(query_embeddings), n_results, mask)
+        ids = [[self.row_ids[r] for r, s in zip(rr, ss) if s > -np.inf] for rr, ss in zip(rows, sims)]
+        res: Dict[str, Any] = {"ids": ids}
+        if "distances" in include:
+            res["distances"] = [[float(1.0 - s) for s in ss if s > -np.inf] for ss in sims]
+        if "embeddings" in include:
+            res["embeddings"] = [np.asarray(self.vecs[rr[ss > -np.inf]]) for rr, ss in zip(rows, sims)]
+        if "documents" in include or "metadatas" in include:
+            recs = self._records(list({i for qi in ids for i in qi}))
+            if "documents" in include:
+                res["documents"] = [[recs[i][0] for i in qi] for qi in ids]
+            if "metadatas" in include:
+                res["metadatas"] = [[recs[i][1] for i in qi] for qi in ids]
+        return res
+
+    def close(self):
+        if self.vecs is not None and not self.readonly:
+            self.vecs.flush()
+        self.vecs = None
+        self.db.close()
+
+
+def flat_index_dir(persist_dir: str | Path, collection: str) -> Path:
+    return Path(persist_dir) / "flat" / collection
+
+
+def open_flat_index(persist_dir: str | Path, collection: str, recreate: bool = False,
+                    metadata: Dict[str, Any] | None = None, readonly: bool = False,
+                    quantization: str | None = None, rescore_factor: int = 4) -> FlatIndex:
+    """
+    Opens (or creates) the FlatIndex of a collection under persist_dir/flat/.
+    :param persist_dir: persist directory shared with the Chroma backend
+    :param collection: collection name
+    :param recreate: drop the index first if it exists
+    :param metadata: collection-level metadata, set when the index is created
+    :param readonly: open for queries only
+    :param quantization: None, or "int8"/"binary" for a QuantizedIndex (first pass over compact codes)
+    :param rescore_factor: QuantizedIndex candidates per requested hit
+    :return: FlatIndex
+    """
+    root = flat_index_dir(persist_dir, collection)
+    if recreate and root.exists():
+        shutil.rmtree(root)
+    if readonly and not (root / "index.sqlite").exists():
+        raise FileNotFoundError(f"No flat index for collection {collection!r} under {persist_dir}")
+    if quantization:
+        from phame.rag_utils.quantized_index import QuantizedIndex
+        return QuantizedIndex(root, metadata, readonly, quantization, rescore_factor)
+    return FlatIndex(root, metadata, readonly)
@@ -1,23 +1,85 @@
 DEFAULTS_RAG = {
-    "data": {"raw_dir": "data/raw"},
-    "chunking": {"chunk_size": 1200, "overlap": 200},
+    "data": {"raw_dir": "data/raw",
+             "tag": None},  # tag stored on every chunk of a build_rag run (filter with RetrievalFilter.tag)
+    "text2cad": {
+        "csv_path": "text2cad_v1.1.csv",
+        "cq_dir": "CQ",  # CadQuery sources, one {uid}.py per part
+        "cq_archive": None,  # optional zip of the CQ dir, read instead of cq_dir
+        "io_workers": 16,  # threads reading CadQuery sources
+        "views": ["beginner"],  # description views embedded per part (abstract, beginner, intermediate, expert, nli)
+        "limit": None  # max parts to index (None = full dataset)
+    },
+    "chunking": {
+        "method": "chars",  # chars | tokens | sentences
+        "chunk_size": 1200,  # chars / sentences: max characters per chunk
+        "overlap": 200,
+        "tokenizer": None,  # tokens: HF tokenizer name, defaults to embedding.model
+        "max_tokens": 256,
+        "overlap_tokens": 32,
+        "workers": 1
+    },
+    "dedup": {
+        "enabled": False,  # drop exact / near-duplicate chunks before embedding
+        "threshold": 0.85,  # estimated Jaccard similarity for near-duplicates
+        "num_perm": 64,
+        "bands": 16,
+        "shingle": 5
+    },
     "embedding": {
         "source": "sentence-transformers",
         "model": "sentence-transformers/all-MiniLM-L6-v2",
         "batch_size": 64,
-        "normalize": False
+        "normalize": False,
+        "concurrency": 1,  # portkey: >1 sends that many embedding requests at once (async client)
+        "max_retries": 6,
+        "cache_dir": None,  # e.g. outputs/embedding_cache to keep embeddings on disk (opt-in)
+        "cache_max_mb": 4096,
+        "query_cache_size": 4096,  # in-process LRU of query embeddings (0 = off)
+        "query_cache_ttl": 3600,  # seconds (None or 0 = no expiry)
+        "query_cache_casefold": False  # match queries ignoring case (uncased models only)
     },
     "chroma": {
         "persist_dir": "outputs/chroma",
+        "backend": "chroma",  # chroma | flat (exact NumPy index under persist_dir/flat/, for small corpora)
+        "quantization": None,  # flat backend only: None | int8 | binary (compact first pass + exact rescoring)
+        "rescore_factor": 4,  # quantized candidates rescored per requested hit
         "collection": "rag_chunks",
-        "recreate": False
+        "shards": 1,  # >1: hash chunks over N collections under persist_dir/shards/ (same value for build and query)
+        "recreate": False,
+        "upsert_batch_size": 2048,
+        "prefetch_batches": 2,
+        "incremental": False,
+        "compact_dead_fraction": 0.25  # flat backend: rewrite vectors.npy once this fraction of rows is deleted
+    },
+    "sparse": {
+        "enabled": False,  # build a BM25 index (persist_dir/sparse/<collection>.sqlite) alongside the vectors
+        "k1": 1.2,  # BM25 parameters, applied at query time
+        "b": 0.75
     },
     "outputs": {
+        "metadata_format": "jsonl",  # jsonl | sqlite (indexed store, see metadata_store.py)
+        "metadata_db_path": "outputs/metadata/metadata.sqlite",
         "metadata_path": "outputs/metadata/metadata.jsonl",
+        "code_store_dir": "outputs/code_store",  # text2cad CadQuery sources, fetched by uid
         "model_name_path": "outputs/index/model_name.txt"
     },
     "retrieval": {"top_k": 5,
-                  "llm": "Qwen/Qwen3-30B-A3B-Thinking-2507-FP8"}
+                  "query_batch_size": 256,  # queries per batched embed + ANN call in run_query_batch
+                  "rrf_k": 60,  # reciprocal-rank fusion constant (multi-view collections and hybrid search)
+                  "hybrid": False,  # fuse BM25 hits with the dense hits (needs the sparse index)
+                  "hybrid_depth": 50,  # hits taken from each ranker before fusion
+                  "mmr": False,  # pick top_k hits by maximal marginal relevance instead of plain similarity
+                  "mmr_lambda": 0.5,  # 1.0 = pure relevance, 0.0 = pure diversity
+                  "mmr_fetch_k": 20,  # candidates MMR chooses from
+                  "llm": "Qwen/Qwen3-30B-A3B-Thinking-2507-FP8"},
+    "rerank": {
+        "model": "cross-encoder/ms-marco-MiniLM-L-6-v2",  # small CPU cross-encoder
+        "candidates": 30,  # documents retrieved for reranking
+        "top_n": 5,  # documents kept for the prompt
+        "batch_size": 16,  # (query, document) pairs per forward pass
+        "max_length": 256,  # tokens per pair
+        "budget_ms": 250  # stop scoring when the next batch would overrun this (None = no limit)
+    }
 }
 
 
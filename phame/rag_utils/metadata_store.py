@@ -0,0 +1,162 @@
+"""
+SQLite-backed chunk metadata store (replaces metadata.jsonl).
+
+Only provenance is kept here: id, source, page, start, end, plus any other small dataclass fields as JSON. The
+chunk text is left out since Chroma already stores it as the document. Source and (source, page) are indexed,
+and readers open the file read-only with SQLite's memory-mapped I/O, so joining retrieval hits back to
+provenance is an index lookup instead of a scan over a JSONL file. The build that writes a store records its
+persist dir and collection (set_owner), so readers only trust a store written for the collection they query.
+"""
+
+from __future__ import annotations
+import json, sqlite3
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Tuple
+
+COLUMNS = ("id", "source", "page", "start", "end")
+_INSERT = 'INSERT OR REPLACE INTO chunks (id, source, page, "start", "end", extra) VALUES (?, ?, ?, ?, ?, ?)'
+
+
+def _to_row(d: Dict[str, Any], exclude: Tuple[str, ...]) -> Tuple:
+    extra = {k: v for k, v in d.items() if k not in COLUMNS and k not in exclude and v is not None}
+    return (d["id"], d.get("source"), d.get("page"), d.get("start"), d.get("end"),
+            json.dumps(extra, ensure_ascii=False) if extra else None)
+
+
+class MetadataStore:
+    def __init__(self, path: str | Path, readonly: bool = False, mmap_bytes: int = 1 << 30):
+        """
+        :param path: sqlite file
+        :param readonly: open for lookups only (shared, memory-mapped)
+        :param mmap_bytes: how much of the file SQLite may memory-map
+        """
+        self.path = Path(path)
+        if readonly:
+            self.db = sqlite3.connect(f"file:{self.path.as_posix()}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.db = sqlite3.connect(str(self.path), check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute('CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, source TEXT, page INTEGER, '
+                            '"start" INTEGER, "end" INTEGER, extra TEXT)')
+            self.db.execute("CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS chunks_source_page ON chunks (source, page)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)")
+            self.db.commit()
+        self.db.execute(f"PRAGMA mmap_size={int(mmap_bytes)}")
+
+    def add(self, chunks: Iterable, exclude: Tuple[str, ...] = ("text",)):
+        """
+        Inserts or replaces chunks (idempotent, so re-written batches are harmless).
+        :param chunks: dataclass chunks
+        :param exclude: fields not to store (large text already held by Chroma)
+        """
+        self.db.executemany(_INSERT, [_to_row(asdict(c), exclude) for c in chunks])
+        self.db.commit()
+
+    def delete(self, ids: List[str], batch_size: int = 900):
+        for i in range(0, len(ids), batch_size):
+            part = ids[i:i + batch_size]
+            self.db.execute(f"DELETE FROM chunks WHERE id IN ({','.join('?' * len(part))})", part)
+        self.db.commit()
+
+    def clear(self):
+        self.db.execute("DELETE FROM chunks")
+        self.db.commit()
+
+    def set_owner(self, persist_dir: str | Path, collection: str):
+        """
+        Records the collection the chunks belong to.
+        :param persist_dir: persist directory of the collection
+        :param collection: collection name
+        """
+        owner = json.dumps({"persist_dir": str(Path(persist_dir).resolve()), "collection": collection})
+        self.db.execute("INSERT OR REPLACE INTO info VALUES ('owner', ?)", (owner,))
+        self.db.commit()
+
+    def is_owned_by(self, persist_dir: str | Path, collection: str) -> bool:
+        """
+        :return: whether set_owner recorded this persist directory and collection (False for older stores)
+        """
+        try:
+            row = self.db.execute("SELECT value FROM info WHERE key = 'owner'").fetchone()
+        except sqlite3.OperationalError:  # written before owners were recorded
+            return False
+        return row is not None and json.loads(row[0]) == {"persist_dir": str(Path(persist_dir).resolve()),
+                                                           "collection": collection}
+
+    @staticmethod
+    def _row(r: Tuple) -> Dict[str, Any]:
+        # columns a record type does not have (e.g. page for text2cad parts) are left out
+        d = {k: v for k, v in zip(COLUMNS, r[:5]) if v is not None}
+        if r[5]:
+            d.update(json.loads(r[5]))
+        return d
+
+    def get(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Looks up chunks by id.
+        :param ids: chunk ids (e.g. the ids of retrieval hits)
+        :return: dict of id -> metadata for the ids that exist
+        """
+        out = {}
+        for i in range(0, len(ids), 900):
+            part = ids[i:i + 900]
+            q = f'SELECT id, source, page, "start", "end", extra FROM chunks WHERE id IN ({",".join("?" * len(part))})'
+            for r in self.db.execute(q, part):
+                out[r[0]] = self._row(r)
+        return out
+
+    def by_source(self, source: str, page_min: int | None = None, page_max: int | None = None) -> List[Dict[str, Any]]:
+        """
+        Lists chunks of a source, optionally restricted to a page range.
+        :param source: source path, or a glob pattern (e.g. "*Shigley_Chapter1?.pdf")
+        :param page_min: first page (inclusive)
+        :param page_max: last page (inclusive)
+        :return: list of metadata dicts ordered by source, page, start
+        """
+        op = "GLOB" if any(ch in source for ch in "*?[") else "="
+        q = f'SELECT id, source, page, "start", "end", extra FROM chunks WHERE source {op} ?'
+        args: List[Any] = [source]
+        if page_min is not None:
+            q += " AND page >= ?"
+            args.append(page_min)
+        if page_max is not None:
+            q += " AND page <= ?"
+            args.append(page_max)
+        q += ' ORDER BY source, page, "start"'
+        return [self._row(r) for r in self.db.execute(q, args)]
+
+    def sources(self) -> List[str]:
+        return [r[0] for r in self.db.execute("SELECT DISTINCT source FROM chunks ORDER BY source")]
+
+    def count(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+
+def convert_jsonl(jsonl_path: str | Path, db_path: str | Path, batch_size: int = 10000) -> int:
+    """
+    One-off conversion of an existing metadata.jsonl into a MetadataStore.
+    :param jsonl_path: metadata.jsonl written by create_db_metadata
+    :param db_path: sqlite file to create/extend
+    :param batch_size: rows per transaction
+    :return: number of rows written
+    """
+    store = MetadataStore(db_path)
+    n, rows = 0, []
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        for line in f:
+            rows.append(_to_row(json.loads(line), ("text",)))
+            n += 1
+            if len(rows) >= batch_size:
+                store.db.executemany(_INSERT, rows)
+                store.db.commit()
+                rows = []
+    store.db.executemany(_INSERT, rows)
+    store.db.commit()
+    store.close()
+    return n
@@ -0,0 +1,46 @@
+"""
+Maximal-marginal-relevance (MMR) selection of retrieval hits.
+
+Sliding-window chunks overlap, so the plain top-k often holds several near-identical windows of one page. MMR
+picks hits greedily by lambda * sim(query, hit) - (1 - lambda) * max sim(hit, already picked), trading a little
+relevance for coverage.
+"""
+
+from __future__ import annotations
+from typing import List
+
+import numpy as np
+
+
+def mmr_select(query_vec: np.ndarray, cand_vecs: np.ndarray, k: int, lambda_mult: float = 0.5) -> List[int]:
+    """
+    Selects k of the candidates by MMR. All similarities come from two matrix products up front; the greedy loop
+    only updates a running max, so each pick is O(n).
+    :param query_vec: query embedding
+    :param cand_vecs: candidate embeddings, one row per candidate (e.g. the fetch_k nearest hits)
+    :param k: hits to select
+    :param lambda_mult: 1.0 = pure relevance (plain top-k), 0.0 = pure diversity
+    :return: indices into cand_vecs, in selection order
+    """
+    cand = np.asarray(cand_vecs, dtype="float32")
+    if k <= 0 or not len(cand):
+        return []
+    cand = cand / (np.linalg.norm(cand, axis=1, keepdims=True) + 1e-12)
+    q = np.asarray(query_vec, dtype="float32").reshape(-1)
+    q = q / (np.linalg.norm(q) + 1e-12)
+    rel = cand @ q
+    sim = cand @ cand.T
+
+    first = int(np.argmax(rel))
+    picked = [first]
+    max_sim = sim[first].copy()
+    free = np.ones(len(cand), dtype=bool)
+    free[first] = False
+    for _ in range(min(k, len(cand)) - 1):
+        score = lambda_mult * rel - (1.0 - lambda_mult) * max_sim
+        score[~free] = -np.inf
+        j = int(np.argmax(score))
+        picked.append(j)
+        free[j] = False
+        np.maximum(max_sim, sim[j], out=max_sim)
+    return picked
@@ -0,0 +1,254 @@
+"""
+Quantized first-pass search over a FlatIndex, with full-precision rescoring.
+
+Compact codes are kept in RAM next to the memory-mapped float32 vectors.npy:
+1) int8 - per-dimension scalar quantization (4x smaller); scored with a dot product against the scaled query
+2) binary - one sign bit per dimension (32x smaller); scored by Hamming distance (XOR + popcount)
+
+A query scans the codes for rescore_factor * k candidates and then rescores only those rows with their exact
+float32 vectors. The vectors are read from the memory map, so a warm retriever only needs the codes resident.
+
+Run as a script to build the codes of an index, or to print a recall-vs-memory benchmark:
+    python phame/rag_utils/quantized_index.py --persist_dir DIR --collection NAME --build int8
+    python phame/rag_utils/quantized_index.py --persist_dir DIR --collection NAME --bench
+"""
+
+from __future__ import annotations
+import argparse, time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+from phame.rag_utils.flat_index import FlatIndex, BLOCK_ROWS, flat_index_dir
+
+MODES = ("int8", "binary")
+
+if hasattr(np, "bitwise_count"):
+    _popcount = np.bitwise_count
+else:
+    _POP = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+    _popcount = lambda a: _POP[a]
+
+
+def quantize_int8(vecs: np.ndarray, scale: np.ndarray) -> np.ndarray:
+    return np.clip(np.rint(vecs / scale), -127, 127).astype(np.int8)
+
+
+def quantize_binary(vecs: np.ndarray) -> np.ndarray:
+    return np.packbits(vecs > 0, axis=1)
+
+
+class QuantizedIndex(FlatIndex):
+    """
+    FlatIndex whose search runs over int8 or binary codes first and rescores the candidates exactly.
+    Codes are written by build_codes() into codes_<mode>.npy; until then (or when they cover fewer rows than the
+    index, e.g. after new upserts or compact()) search falls back to the exact float32 scan.
+    """
+    def __init__(self, root: str | Path, metadata: Dict[str, Any] | None = None, readonly: bool = False,
+                 mode: str = "int8", rescore_factor: int = 4):
+        """
+        :param root: index directory
+        :param metadata: collection-level metadata, stored when the index is created
+        :param readonly: open for queries only
+        :param mode: "int8" or "binary"
+        :param rescore_factor: candidates taken from the codes per requested hit
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown quantization {mode!r}; choose from {MODES}")
+        super().__init__(root, metadata, readonly)
+        self.mode = mode
+        self.rescore_factor = rescore_factor
+        self.codes_path = self.root / f"codes_{mode}.npy"
+        self.scale_path = self.root / "int8_scale.npy"
+        self.codes: np.ndarray | None = None
+        self.scale: np.ndarray | None = None
+        self.load_codes()
+
+    def load_codes(self):
+        self.codes = None
+        if self.codes_path.exists():
+            codes = np.load(self.codes_path)
+            if codes.shape[0] == self.n:
+                self.codes = codes
+                if self.mode == "int8":
+                    self.scale = np.load(self.scale_path)
+            else:
+                print(f"Quantized codes of {self.name!r} cover {codes.shape[0]} of {self.n} rows; "
+                      f"searching full precision until build_codes() is rerun.")
+
+    def build_codes(self, save: bool = True):
+        """
+        (Re)computes the codes for all rows from vectors.npy, block by block.
+        :param save: write codes_<mode>.npy (and the int8 scale); False only keeps them in memory
+        """
+        if self.vecs is None or not self.n:
+            return
+        dim = self.vecs.shape[1]
+        if self.mode == "int8":
+            scale = np.zeros(dim, dtype="float32")
+            for i in range(0, self.n, BLOCK_ROWS):
+                scale = np.maximum(scale, np.abs(self.vecs[i:min(self.n, i + BLOCK_ROWS)]).max(axis=0))
+            scale = np.maximum(scale, 1e-8) / 127.0
+            codes = np.empty((self.n, dim), dtype=np.int8)
+            for i in range(0, self.n, BLOCK_ROWS):
+                codes[i:i + BLOCK_ROWS] = quantize_int8(self.vecs[i:min(self.n, i + BLOCK_ROWS)], scale)
+        else:
+            scale = None
+            codes = np.empty((self.n, (dim + 7) // 8), dtype=np.uint8)
+            for i in range(0, self.n, BLOCK_ROWS):
+                codes[i:i + BLOCK_ROWS] = quantize_binary(self.vecs[i:min(self.n, i + BLOCK_ROWS)])
+        if not save:
+            self.codes, self.scale = codes, scale
+            return
+        if scale is not None:
+            np.save(self.scale_path, scale)
+        np.save(self.codes_path, codes)
+        self.load_codes()
+
+    def compact(self, min_dead_fraction: float = 0.0):
+        n = self.n
+        super().compact(min_dead_fraction)
+        if self.n != n:
+            self.load_codes()  # the codes now cover the old rows; exact search until build_codes()
+
+    def code_bytes(self) -> int:
+        n = 0 if self.codes is None else self.codes.nbytes
+        return n + (0 if self.scale is None else self.scale.nbytes)
+
+    @staticmethod
+    def _words(bits: np.ndarray) -> np.ndarray:
+        # popcount over 64-bit words instead of bytes when the code width allows it
+        return bits.view(np.uint64) if bits.shape[1] % 8 == 0 and bits.flags.c_contiguous else bits
+
+    def _candidates(self, q: np.ndarray, m: int, allowed: np.ndarray) -> np.ndarray:
+        # first pass over the codes: top-m rows per query (higher is better for both scores)
+        best_s = np.full((len(q), 0), -np.inf, dtype="float32")
+        best_r = np.zeros((len(q), 0), dtype=int)
+        if self.mode == "int8":
+            qs = q * self.scale[None, :]
+        else:
+            qb = self._words(quantize_binary(q))
+        for start in range(0, self.n, BLOCK_ROWS):
+            end = min(self.n, start + BLOCK_ROWS)
+            if self.mode == "int8":
+                sims = qs @ self.codes[start:end].astype("float32").T
+            else:
+                block = self._words(self.codes[start:end])
+                sims = np.stack([-_popcount(block ^ b).sum(axis=1, dtype=np.int32) for b in qb]).astype("float32")
+            sims[:, ~allowed[start:end]] = -np.inf
+            kb = min(m, end - start)
+            part = np.argpartition(-sims, kb - 1, axis=1)[:, :kb]
+            cand_s = np.concatenate([best_s, np.take_along_axis(sims, part, axis=1)], axis=1)
+            cand_r = np.concatenate([best_r, part + start], axis=1)
+            if cand_s.shape[1] > m:
+                keep = np.argpartition(-cand_s, m - 1, axis=1)[:, :m]
+                cand_s = np.take_along_axis(cand_s, keep, axis=1)
+                cand_r = np.take_along_axis(cand_r, keep, axis=1)
+            best_s, best_r = cand_s, cand_r
+        return best_r
+
+    def search(self, queries: np.ndarray, k: int, mask: np.ndarray | None = None):
+        """
+        Approximate top-k: code scan for rescore_factor * k candidates, then exact rescoring.
+        :param queries: query vectors, one row per query
+        :param k: hits per query
+        :param mask: optional boolean row mask restricting the candidates
+        :return: (rows, similarities), each of shape (n_queries, <=k), best first
+        """
+        if self.codes is None:
+            return super().search(queries, k, mask)
+        q = np.atleast_2d(np.asarray(queries, dtype="float32"))
+        q = q / (np.linalg.norm(q, axis=1, keepdims=True) + 1e-12)
+        allowed = self.alive if mask is None else self.alive & mask[:self.n]
+        k = min(k, int(allowed.sum()))
+        if k == 0:
+            return np.zeros((len(q), 0), dtype=int), np.zeros((len(q), 0), dtype="float32")
+
+        m = min(int(allowed.sum()), k * max(1, self.rescore_factor))
+        cand = self._candidates(q, m, allowed)
+        rows_out = np.zeros((len(q), k), dtype=int)
+        sims_out = np.zeros((len(q), k), dtype="float32")
+        for i in range(len(q)):
+            rows = np.sort(cand[i])  # sorted rows read the memory map sequentially
+            exact = np.asarray(self.vecs[rows]) @ q[i]
+            top = np.argsort(-exact)[:k]
+            rows_out[i], sims_out[i] = rows[top], exact[top]
+        return rows_out, sims_out
+
+
+def benchmark(index: FlatIndex, n_queries: int = 200, k: int = 10, factors: List[int] = (1, 2, 4, 8),
+              noise: float = 0.05, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Recall@k of int8/binary search (at several rescore factors) against the exact scan, with the resident
+    memory each needs. Queries are stored vectors plus gaussian noise, so no embedding model is needed.
+    Codes missing on disk are built in memory, so the index directory is left untouched.
+    :param index: FlatIndex to benchmark (its vectors are the ground truth)
+    :param n_queries: number of queries
+    :param k: hits per query
+    :param factors: rescore factors to try
+    :param noise: std of the noise added to each sampled vector (relative to unit norm)
+    :param seed: random seed
+    :return: one row per configuration
+    """
+    rng = np.random.default_rng(seed)
+    live = np.flatnonzero(index.alive)
+    rows = rng.choice(live, size=min(n_queries, len(live)), replace=False)
+    dim = index.vecs.shape[1]
+    q = np.asarray(index.vecs[np.sort(rows)]) + rng.normal(scale=noise / np.sqrt(dim), size=(len(rows), dim))
+    q = q.astype("float32")
+
+    t0 = time.perf_counter()
+    truth, _ = FlatIndex.search(index, q, k)
+    exact_ms = (time.perf_counter() - t0) * 1000 / len(q)
+    n_live = len(live)
+    out = [{"mode": "float32", "rescore_factor": None, "recall": 1.0, "ms_per_query": exact_ms,
+            "resident_mb": n_live * dim * 4 / 2**20}]
+
+    for mode in MODES:
+        qi = QuantizedIndex(index.root, readonly=True, mode=mode)
+        if qi.codes is None:
+            qi.build_codes(save=False)
+        if qi.codes is None:
+            continue
+        for f in factors:
+            qi.rescore_factor = f
+            t0 = time.perf_counter()
+            got, _ = qi.search(q, k)
+            ms = (time.perf_counter() - t0) * 1000 / len(q)
+            recall = np.mean([len(set(g) & set(t)) / len(t) for g, t in zip(got, truth)])
+            out.append({"mode": mode, "rescore_factor": f, "recall": float(recall), "ms_per_query": ms,
+                        "resident_mb": qi.code_bytes() / 2**20})
+        qi.close()
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Build quantized codes for a flat index, or benchmark them.")
+    ap.add_argument("--persist_dir", type=str, required=True)
+    ap.add_argument("--collection", type=str, required=True)
+    ap.add_argument("--build", type=str, choices=MODES, default=None, help="(re)build codes of this kind")
+    ap.add_argument("--bench", action="store_true", help="print recall@k vs memory for int8/binary")
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--queries", type=int, default=200)
+    args = ap.parse_args()
+
+    root = flat_index_dir(args.persist_dir, args.collection)
+    if args.build:
+        qi = QuantizedIndex(root, mode=args.build)
+        qi.build_codes()
+        print(f"Built {args.build} codes for {qi.n} rows ({qi.code_bytes() / 2**20:.1f} MB) in {qi.codes_path}")
+        qi.close()
+
+    if args.bench:
+        index = FlatIndex(root, readonly=True)
+        rows = benchmark(index, args.queries, args.k)
+        print(f"{'mode':8} {'rescore':>7} {'recall@' + str(args.k):>9} {'ms/query':>9} {'resident MB':>12}")
+        for r in rows:
+            f = "-" if r["rescore_factor"] is None else str(r["rescore_factor"])
+            print(f"{r['mode']:8} {f:>7} {r['recall']:>9.3f} {r['ms_per_query']:>9.2f} {r['resident_mb']:>12.1f}")
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,9 +3,11 @@ Query a local Chroma RAG collection using the same embedding model.
 """
 
 from __future__ import annotations
-import argparse
+import argparse, json, os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Callable, Tuple
 
 import yaml
 import numpy as np
@@ -17,7 +19,15 @@ from chromadb.config import Settings
 from phame.rag_utils.globals import DEFAULTS_RAG
 
 from portkey_ai import Portkey
-from phame.rag_utils.build_rag import load_config
+from phame.rag_utils.build_rag import load_config, embed_texts_sentence_transformer, embed_texts_portkey
+from phame.rag_utils.async_embed import embed_texts_portkey_async
+from phame.rag_utils.flat_index import open_flat_index
+from phame.rag_utils.embedding_cache import make_query_cache, cached_embedder
+from phame.rag_utils.sparse_index import SparseIndex, sparse_index_path
+from phame.rag_utils.mmr import mmr_select
+from phame.rag_utils.filters import RetrievalFilter
+from phame.rag_utils.metadata_store import MetadataStore
+from phame.rag_utils.shards import open_shards
 
 
 TENANT = "default_tenant"
@@ -35,7 +45,7 @@ def embed_query_sentence_transformer(
     :param normalize: bool for normalizing resulting embeddings
     :return: list of vectors
     """
-    vec = model.encode(query, convert_to_numpy=True, show_progress_bar=True)
+    vec = model.encode(query, convert_to_numpy=True, show_progress_bar=False)
     return vec.astype("float32")
 
 
@@ -54,38 +64,26 @@ def embed_query_portkey(
 
     response = client.embeddings.create(
         model = model,
-        input=query[start: end],
+        input=query,
         encoding_format="float"
     )
-    vec = response.data.d.embedding
+    vec = np.array(response.data[0].embedding, dtype="float32")
 
     return vec
 
 
-def find_k_similar_docs(q_vec: numpy.ndarray, persist_dir: str, collection: str, top_k: int=5):
-
-    print(f"Connecting to Chroma (dir={persist_dir}) collection={collection}")
-    client =  chromadb.PersistentClient(path=persist_dir, tenant=TENANT, database=DATABASE)
-    col = client.get_collection(name=collection)
-
-    res = col.query(
-        query_embeddings=[q_vec],
-        n_results=top_k,
-        #where=make_where(),
-        include=["documents", "metadatas", "distances"]
-    )
-    return res
-
-def run_query(query: str, config: Dict):
+def make_query_embedder(config: Dict) -> Callable[[List[str]], np.ndarray]:
+    """
+    Builds a function embedding a list of queries with the model in the `embedding` config section,
+    behind the on-disk embedding cache when embedding.cache_dir is set. Lists are embedded in batched forward
+    passes / gateway requests of embedding.batch_size texts.
+    :param config: config dictionary
+    :return: function mapping a list of queries to a float32 array of vectors
+    """
     emb_source = config['embedding']['source']
     emb_model = config['embedding']['model']
-    persist_dir = config['chroma']['persist_dir']
-    collection = config['chroma']['collection']
-    top_k = config['retrieval']['top_k']
+    batch_size = config['embedding']['batch_size']
 
-    # embed query
-    api_key = None
-    base_url = None
     if emb_source.lower().startswith("portkey"):
         api_key = os.environ.get('PORTKEY_API_KEY')
         base_url = os.environ.get('PORTKEY_BASE_URL')
@@ -97,18 +95,472 @@ def run_query(query: str, config: Dict):
             base_url = base_url,
             api_key = api_key,
         )
-        q_vec = embed_query_portkey(client, emb_model, query)
+        concurrency = config['embedding'].get('concurrency', 1)
+
+        def embed_fn(queries: List[str]) -> np.ndarray:
+            # one request reuses the warm client; larger sweeps fan out over concurrent requests
+            if concurrency > 1 and len(queries) > batch_size:
+                return embed_texts_portkey_async(queries, emb_model, base_url, api_key, batch_size=batch_size,
+                                                 concurrency=concurrency,
+                                                 max_retries=config['embedding'].get('max_retries', 6))
+            return embed_texts_portkey(client, emb_model, queries, batch_size, False, False)
 
     else:
         # default to sentence transformer
         model = SentenceTransformer(emb_model)
-        q_vec = embed_query_sentence_transformer(model, query)
+        embed_fn = lambda queries: embed_texts_sentence_transformer(model, queries, batch_size, False, False)
+
+    # in-process LRU in front of the on-disk cache; query vectors are kept in the cache's "query" namespace,
+    # apart from chunk vectors of the same model
+    return cached_embedder(embed_fn, make_query_cache(config))
+
+
+def rrf_fuse(res: Dict[str, Any], top_k: int, k: int = 60) -> Dict[str, Any]:
+    """
+    Fuses the hits of a multi-view collection (one vector per part and description view) into one ranking per
+    part uid with reciprocal-rank fusion: score(uid) = sum over views of 1 / (k + rank of uid in that view).
+    Each view's ranking is read off the single over-fetched result list, so fusion costs one query.
+    :param res: Chroma query result for one query, with metadatas carrying "uid" and "view"
+    :param top_k: number of fused hits to keep
+    :param k: RRF constant; larger values flatten the weight of top ranks
+    :return: Chroma-shaped result with one hit per uid (ids are uids; document/metadata/distance of its best view)
+    """
+    ids, docs, metas, dists = res["ids"][0], res["documents"][0], res["metadatas"][0], res["distances"][0]
+    view_rank: Dict[str, int] = {}
+    scores: Dict[str, float] = {}
+    best: Dict[str, int] = {}
+    for i, m in enumerate(metas):
+        uid = m.get("uid", ids[i])
+        view = m.get("view", "")
+        rank = view_rank[view] = view_rank.get(view, 0) + 1
+        scores[uid] = scores.get(uid, 0.0) + 1.0 / (k + rank)
+        best.setdefault(uid, i)
+    # ties (e.g. parts found by a single view at the same rank) go to the closer hit
+    order = sorted(scores, key=lambda u: (-scores[u], dists[best[u]]))[:top_k]
+    return {
+        "ids": [order],
+        "documents": [[docs[best[u]] for u in order]],
+        "metadatas": [[metas[best[u]] for u in order]],
+        "distances": [[dists[best[u]] for u in order]],
+        "scores": [[scores[u] for u in order]],
+    }
+
+
+def rrf_merge(rankings: List[List[str]], top_k: int, k: int = 60) -> List[Tuple[str, float]]:
+    """
+    Reciprocal-rank fusion of several rankings of the same ids: score(id) = sum of 1 / (k + rank).
+    :param rankings: id lists, best first (e.g. dense hits and BM25 hits)
+    :param top_k: number of fused hits to keep
+    :param k: RRF constant
+    :return: list of (id, fused score), best first; ties go to the earlier ranking
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, i in enumerate(ranking, start=1):
+            scores[i] = scores.get(i, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda kv: -kv[1])[:top_k]
+
+
+def split_results(res: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Splits a batched Chroma query result into one Chroma-shaped result per query.
+    :param res: result of col.query with several query embeddings
+    :return: list of results, each holding a single query's hits
+    """
+    keys = [k for k in ("ids", "documents", "metadatas", "distances", "embeddings") if res.get(k) is not None]
+    return [{k: [res[k][i]] for k in keys} for i in range(len(res["ids"]))]
+
+
+def take_hits(res: Dict[str, Any], idx: List[int]) -> Dict[str, Any]:
+    """
+    :param res: Chroma-shaped result of one query
+    :param idx: positions of the hits to keep, in the order wanted
+    :return: result holding only those hits (embeddings dropped)
+    """
+    keys = [k for k in ("ids", "documents", "metadatas", "distances", "scores") if res.get(k) is not None]
+    return {k: [[res[k][0][i] for i in idx]] for k in keys}
+
+
+def empty_result() -> Dict[str, Any]:
+    return {"ids": [[]], "documents": [[]], "metadatas": [[]], "distances": [[]]}
+
+
+def open_readonly_collection(persist_dir: str, collection: str, backend: str = "chroma", shards: int = 1,
+                             quantization: str | None = None, rescore_factor: int = 4):
+    """
+    Opens an existing collection for queries.
+    :param persist_dir: persist directory given to build_rag
+    :param collection: collection name
+    :param backend: "chroma" or "flat"
+    :param shards: shard count used at build time; >1 opens a ShardedCollection queried by scatter-gather
+    :param quantization: flat backend only, as in build_rag
+    :param rescore_factor: QuantizedIndex candidates per requested hit
+    :return: Chroma collection, FlatIndex or ShardedCollection
+    """
+    if shards > 1:
+        return open_shards(persist_dir, shards, lambda path, _: open_readonly_collection(
+            str(path), collection, backend, 1, quantization, rescore_factor))
+    if backend == "flat":
+        return open_flat_index(persist_dir, collection, readonly=True, quantization=quantization,
+                               rescore_factor=rescore_factor)
+    client = chromadb.PersistentClient(path=persist_dir, tenant=TENANT, database=DATABASE)
+    return client.get_collection(name=collection)
+
+
+def collection_meta_db(persist_dir: str | Path, collection: str, *candidates: str | Path | None) -> Path | None:
+    """
+    Finds the MetadataStore written by the build of a collection. A store shared by several builds (e.g. the
+    default outputs/metadata/metadata.sqlite) only counts for the collection that wrote it last.
+    :param persist_dir: persist directory of the collection
+    :param collection: collection name
+    :param candidates: store paths to try after persist_dir/metadata/metadata.sqlite
+    :return: path of the store, or None when no store is tied to this collection
+    """
+    for path in (Path(persist_dir) / "metadata" / "metadata.sqlite", *candidates):
+        if path and Path(path).exists():
+            with closing(MetadataStore(path, readonly=True)) as store:
+                if store.is_owned_by(persist_dir, collection):
+                    return Path(path)
+    return None
+
+
+def collection_sources(col, meta_db_path: str | Path | None = None) -> List[str]:
+    """
+    Lists the distinct chunk sources of a collection, for resolving a source glob into an $in list: the flat
+    index's source column, else the metadata store, else (slow) a paged scan of the collection's metadata.
+    :param col: Chroma collection or FlatIndex
+    :param meta_db_path: MetadataStore of this collection (from collection_meta_db)
+    :return: sorted source paths
+    """
+    if hasattr(col, "distinct"):
+        return col.distinct("source")
+    if meta_db_path and Path(meta_db_path).exists():
+        with closing(MetadataStore(meta_db_path, readonly=True)) as store:
+            return store.sources()
+    if hasattr(col, "shards"):
+        return sorted(set().union(*(collection_sources(shard) for shard in col.shards)))
+    out, offset = set(), 0
+    while True:
+        got = col.get(include=["metadatas"], limit=10000, offset=offset)
+        if not got["ids"]:
+            break
+        out.update(m["source"] for m in got["metadatas"] if m and m.get("source"))
+        offset += len(got["ids"])
+    return sorted(out)
 
-    # get matches
-    res = find_k_similar_docs(q_vec, persist_dir, collection, top_k)
 
+class Retriever:
+    """
+    Long-lived retriever: the query embedder and the Chroma collection handle are opened once and reused, so
+    steady-state queries only pay for one embedding and one ANN search (one per shard, run concurrently, when
+    chroma.shards > 1). With retrieval.hybrid the BM25 index
+    built next to the collection is searched on a worker thread while the queries are embedded, and both
+    rankings are fused with RRF. With retrieval.mmr the final top_k are picked from mmr_fetch_k candidates by
+    maximal marginal relevance.
+    """
+    def __init__(self, config: Dict):
+        """
+        :param config: config dictionary (embedding, chroma and retrieval sections)
+        """
+        self.persist_dir = config['chroma']['persist_dir']
+        self.collection = config['chroma']['collection']
+        self.top_k = config['retrieval']['top_k']
+        self.rrf_k = config['retrieval'].get('rrf_k', 60)
+        self.embed = make_query_embedder(config)
+        # build_rag --persist_dir keeps the metadata store inside the persist dir; else the configured one, if
+        # this collection wrote it
+        self.meta_db = collection_meta_db(self.persist_dir, self.collection,
+                                          config['outputs'].get('metadata_db_path'))
+        self._sources: Tuple[int, List[str]] | None = None
+
+        self.backend = config['chroma'].get('backend', 'chroma')
+        self.shards = config['chroma'].get('shards', 1)
+        print(f"Opening {self.backend} collection={self.collection} (dir={self.persist_dir}"
+              + (f", {self.shards} shards)" if self.shards > 1 else ")"))
+        self.col = open_readonly_collection(self.persist_dir, self.collection, self.backend, self.shards,
+                                            config['chroma'].get('quantization'),
+                                            config['chroma'].get('rescore_factor', 4))
+        # multi-view collections hold one vector per (part, view): over-fetch so every view can contribute top_k
+        views = (self.col.metadata or {}).get("views")
+        self.n_views = len(views.split(",")) if views else 1
+
+        self.sparse = None
+        self.hybrid_depth = config['retrieval'].get('hybrid_depth', 50)
+        if config['retrieval'].get('hybrid', False):
+            path = sparse_index_path(self.persist_dir, self.collection)
+            if path.exists():
+                sp = config.get('sparse', {})
+                self.sparse = SparseIndex(path, readonly=True, k1=sp.get('k1', 1.2), b=sp.get('b', 0.75))
+                self._pool = ThreadPoolExecutor(max_workers=1)
+            else:
+                print(f"No sparse index at {path}; hybrid retrieval disabled (rebuild with sparse.enabled).")
+
+        self.mmr = config['retrieval'].get('mmr', False)
+        self.mmr_lambda = config['retrieval'].get('mmr_lambda', 0.5)
+        self.mmr_fetch_k = config['retrieval'].get('mmr_fetch_k', 20)
+        if self.mmr and self.n_views > 1:
+            # fused hits are parts, not vectors; the views of one part are already collapsed by the fusion
+            print("MMR is not applied to multi-view collections.")
+            self.mmr = False
+        self.warm_up()
+
+    def warm_up(self):
+        """
+        Runs one throwaway query so the embedding model and the HNSW index are loaded before the first real one.
+        """
+        if self.col.count():
+            # straight to the model: a throwaway query must not land in the query cache or count as a miss
+            embed = getattr(self.embed, "inner", self.embed)
+            self.search(embed(["warm up"]), 1)
+
+    def cache_stats(self) -> Dict[str, float]:
+        """
+        :return: hit/miss counts and hit rate of the query-embedding cache
+        """
+        return self.embed.cache.stats()
+
+    def sources(self) -> List[str]:
+        """
+        :return: distinct chunk sources, cached until the collection size changes
+        """
+        n = self.col.count()
+        if self._sources is None or self._sources[0] != n:
+            self._sources = (n, collection_sources(self.col, self.meta_db))
+        return self._sources[1]
+
+    def where_for(self, filters: RetrievalFilter) -> Dict[str, Any] | None:
+        """
+        :param filters: non-empty filter
+        :return: where clause for the collection, or None when the source glob matches no source
+        """
+        sources = None
+        if filters.source is not None:
+            sources = filters.match_sources(self.sources())
+            if not sources:
+                return None
+        return filters.to_where(sources)
+
+    def search(self, q_vecs: np.ndarray, top_k: int | None = None,
+               where: Dict[str, Any] | None = None) -> List[Dict[str, Any]]:
+        """
+        Runs one batched ANN query for already embedded queries.
+        :param q_vecs: query vectors, one row per query
+        :param top_k: hits per query (defaults to retrieval.top_k)
+        :param where: optional metadata filter, applied by the index before the search
+        :return: one Chroma-shaped result per query
+        """
+        top_k = top_k or self.top_k
+        res = self.col.query(
+            query_embeddings=np.atleast_2d(q_vecs),
+            n_results=top_k * self.n_views,
+            where=where,
+            include=["documents", "metadatas", "distances"] + (["embeddings"] if self.mmr else [])
+        )
+        out = split_results(res)
+        if self.n_views > 1:
+            out = [rrf_fuse(r, top_k, self.rrf_k) for r in out]
+        return out
+
+    def query(self, text: str, top_k: int | None = None, filters: RetrievalFilter | None = None) -> Dict[str, Any]:
+        """
+        :param text: query text
+        :param top_k: hits to return (defaults to retrieval.top_k)
+        :param filters: optional restriction to sources / pages / tag
+        :return: Chroma-shaped result (res['ids'][0], res['documents'][0], ...)
+        """
+        return self.query_many([text], top_k, filters)[0]
+
+    def query_many(self, texts: List[str], top_k: int | None = None,
+                   filters: RetrievalFilter | None = None) -> List[Dict[str, Any]]:
+        """
+        :param texts: query texts
+        :param top_k: hits per query (defaults to retrieval.top_k)
+        :param filters: optional restriction to sources / pages / tag, applied to every query
+        :return: one Chroma-shaped result per query, in input order
+        """
+        if not texts:
+            return []
+        where = None
+        if filters is not None and not filters.is_empty():
+            where = self.where_for(filters)
+            if where is None:
+                return [empty_result() for _ in texts]
+        top_k = top_k or self.top_k
+        n_hits = max(top_k, self.mmr_fetch_k) if self.mmr else top_k
+        if self.sparse is None:
+            q_vecs = self.embed(texts)
+            out = dense = self.search(q_vecs, n_hits, where)
+        else:
+            depth = max(n_hits, self.hybrid_depth)
+            # the lexical search runs on the worker thread while the queries are embedded and searched densely
+            sparse = self._pool.submit(self.sparse.search_many, texts, depth)
+            q_vecs = self.embed(texts)
+            dense = self.search(q_vecs, depth, where)
+            sparse_hits = sparse.result()
+            if where is not None:
+                sparse_hits = self.filter_sparse(sparse_hits, dense, filters)
+            out = self.fuse_hybrid(dense, sparse_hits, n_hits)
+        if self.mmr:
+            out = self.diversify(q_vecs, out, top_k, dense)
+        return out
+
+    def diversify(self, q_vecs: np.ndarray, results: List[Dict[str, Any]], top_k: int,
+                  dense: List[Dict[str, Any]] = ()) -> List[Dict[str, Any]]:
+        """
+        Picks top_k hits per query by MMR over the candidates' stored embeddings. Candidates the ANN query did not
+        return vectors for (BM25-only hits) are read from the collection in one call.
+        :param q_vecs: query vectors, one row per query
+        :param results: Chroma-shaped candidate results, one per query
+        :param top_k: hits to keep per query
+        :param dense: ANN results carrying embeddings, when results were fused from them
+        :return: one Chroma-shaped result per query, in MMR selection order
+        """
+        known: Dict[str, np.ndarray] = {}
+        for r in list(results) + list(dense):
+            if r.get("embeddings") is not None:
+                known.update(zip(r["ids"][0], r["embeddings"][0]))
+        missing = list(dict.fromkeys(i for r in results for i in r["ids"][0] if i not in known))
+        if missing:
+            got = self.col.get(ids=missing, include=["embeddings"])
+            known.update(zip(got["ids"], got["embeddings"]))
+        out = []
+        for q, r in zip(np.atleast_2d(q_vecs), results):
+            idx = [j for j, i in enumerate(r["ids"][0]) if i in known]
+            keep = mmr_select(q, np.array([known[r["ids"][0][j]] for j in idx]), top_k, self.mmr_lambda) if idx else []
+            out.append(take_hits(r, [idx[j] for j in keep]))
+        return out
+
+    def filter_sparse(self, sparse: List[List[Tuple[str, float]]], dense: List[Dict[str, Any]],
+                      filters: RetrievalFilter) -> List[List[Tuple[str, float]]]:
+        """
+        Drops BM25 hits outside the filter (the BM25 index holds no metadata). Metadata of hits the filtered dense
+        search did not return is read from the collection in one call.
+        """
+        meta = {i: m for d in dense for i, m in zip(d["ids"][0], d["metadatas"][0])}
+        need = list(dict.fromkeys(i for hits in sparse for i, _ in hits if i not in meta))
+        if need:
+            got = self.col.get(ids=need, include=["metadatas"])
+            meta.update(zip(got["ids"], got["metadatas"]))
+        return [[(i, sc) for i, sc in hits if i in meta and filters.matches(meta[i])] for hits in sparse]
+
+    def fuse_hybrid(self, dense: List[Dict[str, Any]], sparse: List[List[Tuple[str, float]]],
+                    top_k: int) -> List[Dict[str, Any]]:
+        """
+        RRF-fuses dense and BM25 rankings per query. Documents and metadata of hits only BM25 found are fetched
+        from the collection in one call; their distance is None.
+        :param dense: Chroma-shaped dense results, one per query
+        :param sparse: BM25 (id, score) lists, one per query
+        :param top_k: fused hits per query
+        :return: one Chroma-shaped result per query, with an extra "scores" entry holding the fused scores
+        """
+        fused = [rrf_merge([d["ids"][0], [i for i, _ in s]], top_k, self.rrf_k) for d, s in zip(dense, sparse)]
+        found = [dict(zip(d["ids"][0], zip(d["documents"][0], d["metadatas"][0], d["distances"][0])))
+                 for d in dense]
+        missing = list(dict.fromkeys(i for f, known in zip(fused, found) for i, _ in f if i not in known))
+        extra = {}
+        if missing:
+            got = self.col.get(ids=missing, include=["documents", "metadatas"])
+            extra = {i: (doc, meta, None) for i, doc, meta in zip(got["ids"], got["documents"], got["metadatas"])}
+        out = []
+        for f, known in zip(fused, found):
+            # ids the collection no longer has (sparse index older than the vectors) are dropped
+            hits = [(i, sc, known.get(i) or extra[i]) for i, sc in f if i in known or i in extra]
+            out.append({
+                "ids": [[i for i, _, _ in hits]],
+                "documents": [[h[0] for _, _, h in hits]],
+                "metadatas": [[h[1] for _, _, h in hits]],
+                "distances": [[h[2] for _, _, h in hits]],
+                "scores": [[sc for _, sc, _ in hits]],
+            })
+        return out
+
+
+# warm retrievers shared by run_query calls in the same process
+_RETRIEVERS: Dict[str, Retriever] = {}
+
+
+def retriever_key(config: Dict) -> str:
+    """
+    :param config: config dictionary
+    :return: key covering every setting a Retriever reads, so configs that differ in any of them get their own
+    """
+    used = {section: config.get(section, {}) for section in ("chroma", "embedding", "retrieval", "sparse")}
+    used["metadata_db_path"] = config.get("outputs", {}).get("metadata_db_path")
+    return json.dumps(used, sort_keys=True, default=str)
+
+
+def get_retriever(config: Dict) -> Retriever:
+    """
+    Returns the process-wide Retriever for this config, creating it on first use.
+    :param config: config dictionary
+    :return: Retriever
+    """
+    key = retriever_key(config)
+    if key not in _RETRIEVERS:
+        _RETRIEVERS[key] = Retriever(config)
+    return _RETRIEVERS[key]
+
+
+def find_k_similar_docs(q_vec: np.ndarray, persist_dir: str, collection: str, top_k: int=5, rrf_k: int = 60,
+                        mmr_lambda: float | None = None, fetch_k: int = 20, filters: RetrievalFilter | None = None,
+                        shards: int = 1):
+
+    print(f"Connecting to Chroma (dir={persist_dir}) collection={collection}")
+    col = open_readonly_collection(persist_dir, collection, shards=shards)
+
+    views = (col.metadata or {}).get("views")
+    n_views = len(views.split(",")) if views else 1
+    where = None
+    if filters is not None and not filters.is_empty():
+        sources = None
+        if filters.source is not None:
+            sources = filters.match_sources(collection_sources(col, collection_meta_db(persist_dir, collection)))
+            if not sources:
+                return empty_result()
+        where = filters.to_where(sources)
+    mmr = mmr_lambda is not None and n_views == 1
+    res = col.query(
+        query_embeddings=[q_vec],
+        n_results=max(top_k, fetch_k) if mmr else top_k * n_views,
+        where=where,
+        include=["documents", "metadatas", "distances"] + (["embeddings"] if mmr else [])
+    )
+    if mmr:
+        # spend the top_k slots on distinct passages instead of overlapping windows of one page
+        res = take_hits(res, mmr_select(q_vec, np.asarray(res["embeddings"][0]), top_k, mmr_lambda))
+    if n_views > 1:
+        res = rrf_fuse(res, top_k, rrf_k)
     return res
 
+def run_query(query: str, config: Dict, filters: RetrievalFilter | None = None):
+    """
+    Retrieves the top_k hits for a query through the warm process-wide Retriever.
+    :param query: query text
+    :param config: config dictionary
+    :param filters: optional restriction, e.g. RetrievalFilter(source="*shigley*", page_min=400, page_max=460)
+    :return: Chroma-shaped result
+    """
+    return get_retriever(config).query(query, filters=filters)
+
+
+def run_query_batch(queries: List[str], config: Dict, batch_size: int | None = None,
+                    filters: RetrievalFilter | None = None) -> List[Dict[str, Any]]:
+    """
+    Retrieves the top_k hits for many queries. Each group of batch_size queries is embedded in batched calls
+    and searched with a single batched ANN query.
+    :param queries: query texts
+    :param config: config dictionary
+    :param batch_size: queries per group (defaults to retrieval.query_batch_size)
+    :param filters: optional restriction applied to every query
+    :return: one Chroma-shaped result per query, in input order
+    """
+    retriever = get_retriever(config)
+    batch_size = batch_size or config['retrieval'].get('query_batch_size', 256)
+    out: List[Dict[str, Any]] = []
+    for i in range(0, len(queries), batch_size):
+        out.extend(retriever.query_many(queries[i:i + batch_size], filters=filters))
+    return out
+
 
 
 def main():
@@ -0,0 +1,70 @@
+"""
+Cross-encoder reranking of retrieved passages under a latency budget.
+
+A cross-encoder reads query and passage together, so it ranks far better than the embedding distance, but it
+costs one forward pass per pair. Candidates are therefore scored in retrieval order, batch_size pairs per pass,
+and a running per-pair cost estimate is checked against the deadline before each batch: when the next batch
+would overrun it, scoring stops and the unscored candidates keep their retrieval order behind the scored ones.
+"""
+
+from __future__ import annotations
+import time
+from typing import List, Tuple
+
+import numpy as np
+from sentence_transformers import CrossEncoder
+
+
+class CrossEncoderReranker:
+    def __init__(self, model: str = "cross-encoder/ms-marco-MiniLM-L-6-v2", batch_size: int = 16,
+                 max_length: int = 256, device: str = "cpu"):
+        """
+        :param model: cross-encoder model name
+        :param batch_size: (query, passage) pairs per forward pass
+        :param max_length: tokens per pair (longer passages are truncated)
+        :param device: torch device
+        """
+        self.model_name = model
+        self.batch_size = batch_size
+        self.model = CrossEncoder(model, max_length=max_length, device=device)
+        self.pair_seconds: float | None = None  # running estimate of the cost of one pair
+        self.last: dict = {}
+
+    def _predict(self, pairs: List[Tuple[str, str]]) -> np.ndarray:
+        t0 = time.perf_counter()
+        scores = self.model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False,
+                                    convert_to_numpy=True)
+        per_pair = (time.perf_counter() - t0) / len(pairs)
+        self.pair_seconds = per_pair if self.pair_seconds is None else 0.8 * self.pair_seconds + 0.2 * per_pair
+        return np.asarray(scores, dtype="float32").reshape(-1)
+
+    def warm_up(self):
+        """
+        Runs one full batch so lazy initialization is out of the way and the cost estimate is seeded.
+        """
+        self.model.predict([("warm up", "warm up")], show_progress_bar=False)
+        self.pair_seconds = None
+        self._predict([("warm up", "warm up")] * self.batch_size)
+
+    def rerank(self, query: str, texts: List[str], top_n: int,
+               budget_ms: float | None = None) -> List[Tuple[int, float | None]]:
+        """
+        :param query: query text
+        :param texts: candidate passages, in retrieval order
+        :param top_n: passages to keep
+        :param budget_ms: latency budget for scoring (None = score everything)
+        :return: list of (index into texts, cross-encoder score or None if not scored), best first
+        """
+        t0 = time.perf_counter()
+        deadline = None if budget_ms is None else t0 + budget_ms / 1000.0
+        scores: List[float] = []
+        for i in range(0, len(texts), self.batch_size):
+            batch = texts[i:i + self.batch_size]
+            if (deadline is not None and self.pair_seconds is not None
+                    and time.perf_counter() + self.pair_seconds * len(batch) > deadline):
+                break
+            scores.extend(self._predict([(query, t) for t in batch]).tolist())
+        n = len(scores)
+        order = sorted(range(n), key=lambda j: -scores[j]) + list(range(n, len(texts)))
+        self.last = {"scored": n, "skipped": len(texts) - n, "ms": (time.perf_counter() - t0) * 1000}
+        return [(j, scores[j] if j < n else None) for j in order[:top_n]]
@@ -0,0 +1,166 @@
+"""
+Hash-partitioned (sharded) collections.
+
+One logical collection is split over N collections, each in its own directory persist_dir/shards/<i>/ with its
+own Chroma client, sqlite file and HNSW index (or its own FlatIndex), so no single index has to hold the whole
+corpus. A record lives in shard hash(id) mod N; the hash is blake2b rather than Python's salted hash(), so every
+process agrees on the placement.
+
+ShardedCollection takes and returns the same shapes as chromadb's Collection for the methods build_rag and
+query_rag use (upsert, delete, get, query, count, metadata):
+1) writes are split by shard and the shards are written in parallel from a thread pool
+2) a query is scattered to every shard from the same pool, and the per-shard hit lists, each already sorted by
+   distance, are merged with a heap into the global top n_results
+"""
+
+from __future__ import annotations
+import hashlib, heapq
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+
+def shard_of(record_id: str, n_shards: int) -> int:
+    """
+    :param record_id: chunk / record id
+    :param n_shards: number of shards
+    :return: index of the shard the record belongs to
+    """
+    digest = hashlib.blake2b(record_id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % n_shards
+
+
+def shard_dir(persist_dir: str | Path, shard: int) -> Path:
+    return Path(persist_dir) / "shards" / f"{shard:03d}"
+
+
+class ShardedCollection:
+    def __init__(self, shards: List[Any], workers: int | None = None):
+        """
+        :param shards: one Chroma collection (or FlatIndex) per shard, in shard order
+        :param workers: threads used to write / query the shards concurrently (defaults to one per shard)
+        """
+        for i, col in enumerate(shards):
+            built = (col.metadata or {}).get("shards")
+            if built is not None and int(built) != len(shards):
+                raise ValueError(f"Shard {i} belongs to a {built}-shard collection, not {len(shards)}; "
+                                 "set chroma.shards to the value used at build time.")
+        self.shards = shards
+        self.name = shards[0].name
+        self.pool = ThreadPoolExecutor(max_workers=workers or min(32, len(shards)))
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        return self.shards[0].metadata
+
+    def _split(self, ids: List[str]) -> Dict[int, List[int]]:
+        """
+        :return: shard index -> positions in ids of the records it holds
+        """
+        parts: Dict[int, List[int]] = {}
+        for pos, i in enumerate(ids):
+            parts.setdefault(shard_of(i, len(self.shards)), []).append(pos)
+        return parts
+
+    def _map(self, fn: Callable, items) -> List[Any]:
+        return list(self.pool.map(fn, items))
+
+    def count(self) -> int:
+        return sum(self._map(lambda col: col.count(), self.shards))
+
+    def upsert(self, ids: List[str], embeddings, documents: List[str] | None = None,
+               metadatas: List[Dict[str, Any]] | None = None):
+        vecs = np.asarray(embeddings)
+
+        def write(part):
+            shard, pos = part
+            self.shards[shard].upsert(
+                ids=[ids[p] for p in pos],
+                embeddings=vecs[pos],
+                documents=None if documents is None else [documents[p] for p in pos],
+                metadatas=None if metadatas is None else [metadatas[p] for p in pos],
+            )
+        self._map(write, self._split(ids).items())
+
+    def delete(self, ids: List[str]):
+        def drop(part):
+            shard, pos = part
+            self.shards[shard].delete(ids=[ids[p] for p in pos])
+        self._map(drop, self._split(ids).items())
+
+    def get(self, ids: List[str], include: List[str] = ("documents", "metadatas")) -> Dict[str, Any]:
+        """
+        :param ids: record ids
+        :param include: any of "documents", "metadatas", "embeddings"
+        :return: Chroma-shaped get result for the ids that exist (grouped by shard, not in input order)
+        """
+        parts = self._split(list(ids))
+        got = self._map(lambda part: self.shards[part[0]].get(ids=[ids[p] for p in part[1]], include=list(include)),
+                        parts.items())
+        out: Dict[str, Any] = {"ids": []}
+        for k in include:
+            out[k] = []
+        for res in got:
+            out["ids"].extend(res["ids"])
+            for k in include:
+                out[k].extend(list(res[k]) if res.get(k) is not None else [None] * len(res["ids"]))
+        return out
+
+    def query(self, query_embeddings, n_results: int = 10, where: Dict[str, Any] | None = None,
+              include: List[str] = ("documents", "metadatas", "distances")) -> Dict[str, Any]:
+        """
+        Scatter-gather query: every shard returns its own top n_results, then the sorted lists are heap-merged.
+        :param query_embeddings: query vectors, one row per query
+        :param n_results: hits per query
+        :param where: optional metadata filter, applied by each shard
+        :param include: any of "documents", "metadatas", "distances", "embeddings"
+        :return: Chroma-shaped result with one list per query
+        """
+        q = np.atleast_2d(np.asarray(query_embeddings, dtype="float32"))
+        fetch = list(dict.fromkeys(list(include) + ["distances"]))
+        got = self._map(lambda col: col.query(query_embeddings=q, n_results=n_results, where=where, include=fetch),
+                        self.shards)
+        out: Dict[str, Any] = {"ids": []}
+        for k in include:
+            out[k] = []
+        for qi in range(len(q)):
+            lists = [zip(res["distances"][qi], [s] * len(res["ids"][qi]), range(len(res["ids"][qi])))
+                     for s, res in enumerate(got)]
+            best = list(islice(heapq.merge(*lists), n_results))
+            out["ids"].append([got[s]["ids"][qi][j] for _, s, j in best])
+            for k in include:
+                out[k].append([got[s][k][qi][j] for _, s, j in best])
+        return out
+
+    def compact(self, min_dead_fraction: float = 0.0):
+        """
+        Compacts, in parallel, the shards (FlatIndex) whose fraction of dead rows is at least min_dead_fraction.
+        """
+        self._map(lambda col: col.compact(min_dead_fraction) if hasattr(col, "compact") else None, self.shards)
+
+    def build_codes(self):
+        """
+        Rebuilds the quantized codes of every shard that has them, in parallel.
+        """
+        self._map(lambda col: col.build_codes() if hasattr(col, "build_codes") else None, self.shards)
+
+    def close(self):
+        self.pool.shutdown()
+        for col in self.shards:
+            if hasattr(col, "close"):
+                col.close()
+
+
+def open_shards(persist_dir: str | Path, n_shards: int, open_fn: Callable[[Path, int], Any],
+                workers: int | None = None) -> ShardedCollection:
+    """
+    :param persist_dir: persist directory holding shards/
+    :param n_shards: number of shards
+    :param open_fn: opens the collection of one shard, given its directory and index
+    :param workers: threads for the scatter-gather pool
+    :return: ShardedCollection
+    """
+    return ShardedCollection([open_fn(shard_dir(persist_dir, i), i) for i in range(n_shards)], workers)
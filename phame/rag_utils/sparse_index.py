@@ -0,0 +1,189 @@
+"""
+BM25 sparse lexical index, persisted in SQLite next to the dense collection.
+
+Dense embeddings blur exact identifiers (part numbers, material grades such as 6061-T6, standard numbers); a
+lexical index matches them literally. Postings (term, row, tf) live in a WITHOUT ROWID table clustered by term,
+so scoring a query reads one contiguous range per query term. Document lengths are loaded into memory when the
+index is opened, and BM25's k1/b are applied at query time, so they can be tuned without rebuilding.
+"""
+
+from __future__ import annotations
+import json, math, re, sqlite3
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+STOPWORDS = frozenset(
+    "a an and are as at be by can for from has have in is it its of on or that the their this to was were "
+    "which will with".split()
+)
+_TOKEN = re.compile(r"[^\W_]+(?:[-./_][^\W_]+)*")
+_SPLIT = re.compile(r"[-./_]")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lower-cases text and splits it into alphanumeric tokens. Compound tokens such as "6061-t6" or "m8x1.25" are
+    kept whole and also indexed by their parts, so both the exact identifier and its pieces match.
+    :param text: text to tokenize
+    :return: list of tokens (with repeats)
+    """
+    out = []
+    for t in _TOKEN.findall(text.lower()):
+        if t in STOPWORDS:
+            continue
+        out.append(t)
+        if not t.isalnum():
+            out.extend(p for p in _SPLIT.split(t) if p and p not in STOPWORDS)
+    return out
+
+
+def sparse_index_path(persist_dir: str | Path, collection: str) -> Path:
+    """
+    :return: location of the sparse index belonging to a collection
+    """
+    return Path(persist_dir) / "sparse" / f"{collection}.sqlite"
+
+
+class SparseIndex:
+    def __init__(self, path: str | Path, readonly: bool = False, k1: float = 1.2, b: float = 0.75):
+        """
+        :param path: sqlite file
+        :param readonly: open for queries only
+        :param k1: BM25 term-frequency saturation
+        :param b: BM25 document-length normalization
+        """
+        self.path = Path(path)
+        self.k1, self.b = k1, b
+        if readonly:
+            self.db = sqlite3.connect(f"file:{self.path.as_posix()}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.db = sqlite3.connect(str(self.path), check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS docs (row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, "
+                            "length INTEGER NOT NULL, content TEXT, meta TEXT)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, row INTEGER NOT NULL, "
+                            "tf INTEGER NOT NULL, PRIMARY KEY (term, row)) WITHOUT ROWID")
+            self.db.execute("CREATE INDEX IF NOT EXISTS postings_row ON postings (row)")
+            self.db.commit()
+        self._lengths: np.ndarray | None = None
+        self.n = 0
+        self.avgdl = 0.0
+
+    def _load_stats(self):
+        rows = np.array(self.db.execute("SELECT row, length FROM docs").fetchall(), dtype=np.int64).reshape(-1, 2)
+        self._lengths = np.zeros(int(rows[:, 0].max()) + 1 if len(rows) else 0, dtype="float32")
+        self._lengths[rows[:, 0]] = rows[:, 1]
+        self.n = len(rows)
+        self.avgdl = float(rows[:, 1].mean()) if len(rows) else 0.0
+
+    def _rows_of(self, ids: List[str]) -> List[int]:
+        rows = []
+        for i in range(0, len(ids), 900):
+            part = ids[i:i + 900]
+            q = f"SELECT row FROM docs WHERE id IN ({','.join('?' * len(part))})"
+            rows.extend(r for (r,) in self.db.execute(q, part))
+        return rows
+
+    def _delete_rows(self, rows: List[int]):
+        for i in range(0, len(rows), 900):
+            part = rows[i:i + 900]
+            marks = ",".join("?" * len(part))
+            self.db.execute(f"DELETE FROM postings WHERE row IN ({marks})", part)
+            self.db.execute(f"DELETE FROM docs WHERE row IN ({marks})", part)
+
+    def add(self, ids: List[str], texts: List[str], metas: List[Dict[str, Any]] | None = None,
+            store_text: bool = False):
+        """
+        Indexes documents, replacing earlier versions of the same ids (so re-written batches are harmless).
+        :param ids: document ids (chunk ids of the dense collection)
+        :param texts: document texts
+        :param metas: optional metadata to keep with each document
+        :param store_text: also keep the text, for callers that have no other store to read hits back from
+        """
+        docs = dict(zip(ids, zip(texts, metas or [None] * len(ids))))
+        self._delete_rows(self._rows_of(list(docs)))
+        postings = []
+        for doc_id, (text, meta) in docs.items():
+            counts = Counter(tokenize(text or ""))
+            cur = self.db.execute("INSERT INTO docs (id, length, content, meta) VALUES (?, ?, ?, ?)",
+                                  (doc_id, sum(counts.values()), text if store_text else None,
+                                   json.dumps(meta, ensure_ascii=False, default=str) if meta else None))
+            postings.extend((t, cur.lastrowid, c) for t, c in counts.items())
+        self.db.executemany("INSERT INTO postings (term, row, tf) VALUES (?, ?, ?)", postings)
+        self.db.commit()
+        self._lengths = None
+
+    def delete(self, ids: List[str]):
+        self._delete_rows(self._rows_of(ids))
+        self.db.commit()
+        self._lengths = None
+
+    def clear(self):
+        self.db.execute("DELETE FROM postings")
+        self.db.execute("DELETE FROM docs")
+        self.db.commit()
+        self._lengths = None
+
+    def count(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """
+        Scores documents containing any query term with BM25.
+        :param query: query text
+        :param k: hits to return
+        :return: list of (id, score), best first
+        """
+        if self._lengths is None:
+            self._load_stats()
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or not self.n:
+            return []
+        rows, weights = [], []
+        for t in terms:
+            p = np.array(self.db.execute("SELECT row, tf FROM postings WHERE term = ?", (t,)).fetchall(),
+                         dtype=np.int64).reshape(-1, 2)
+            if not len(p):
+                continue
+            idf = math.log(1.0 + (self.n - len(p) + 0.5) / (len(p) + 0.5))
+            tf = p[:, 1].astype("float32")
+            norm = self.k1 * (1.0 - self.b + self.b * self._lengths[p[:, 0]] / self.avgdl)
+            rows.append(p[:, 0])
+            weights.append(idf * tf * (self.k1 + 1.0) / (tf + norm))
+        if not rows:
+            return []
+        uniq, inv = np.unique(np.concatenate(rows), return_inverse=True)
+        scores = np.bincount(inv, weights=np.concatenate(weights))
+        k = min(k, len(uniq))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        id_of = {}
+        for i in range(0, len(top), 900):
+            part = uniq[top[i:i + 900]].tolist()
+            q = f"SELECT row, id FROM docs WHERE row IN ({','.join('?' * len(part))})"
+            id_of.update(self.db.execute(q, part))
+        return [(id_of[int(r)], float(s)) for r, s in zip(uniq[top], scores[top])]
+
+    def search_many(self, queries: List[str], k: int) -> List[List[Tuple[str, float]]]:
+        return [self.search(q, k) for q in queries]
+
+    def documents(self, ids: List[str]) -> Dict[str, Tuple[str | None, Dict[str, Any]]]:
+        """
+        Reads back stored text and metadata.
+        :param ids: document ids
+        :return: dict of id -> (text or None, metadata)
+        """
+        out = {}
+        for i in range(0, len(ids), 900):
+            part = ids[i:i + 900]
+            q = f"SELECT id, content, meta FROM docs WHERE id IN ({','.join('?' * len(part))})"
+            out.update((d, (c, json.loads(m) if m else {})) for d, c, m in self.db.execute(q, part))
+        return out
+
+    def close(self):
+        self.db.close()
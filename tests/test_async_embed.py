@@ -0,0 +1,106 @@
+import json, threading, time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from phame.rag_utils.async_embed import embed_texts_portkey_async
+
+
+def vector(text):
+    # "text 7" -> [7, -7]
+    n = float(text.split()[1])
+    return [n, -n]
+
+
+@contextmanager
+def stub_server(respond):
+    """
+    Local /embeddings endpoint. respond(inputs, calls) returns (status, headers, body or None); a None body means
+    a normal response, with the data items in reverse order so the client has to sort them by index.
+    """
+    calls = []
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            inputs = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["input"]
+            with lock:
+                calls.append(inputs)
+            status, headers, body = respond(inputs, calls)
+            if body is None:
+                data = [{"index": i, "embedding": vector(t)} for i, t in enumerate(inputs)]
+                body = {"data": data[::-1]}
+            raw = json.dumps(body).encode()
+            self.send_response(status)
+            for k, v in {**headers, "Content-Type": "application/json", "Content-Length": str(len(raw))}.items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}/v1", calls
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def embed(url, texts, **kwargs):
+    return embed_texts_portkey_async(texts, "stub-model", url, "key", backoff_base=0.01, **kwargs)
+
+
+def expected(texts):
+    return np.array([vector(t) for t in texts], dtype="float32")
+
+
+def test_results_keep_input_order_when_responses_arrive_out_of_order():
+    texts = [f"text {i}" for i in range(8)]
+
+    def respond(inputs, calls):
+        # the earliest batches answer last
+        time.sleep(0.05 * (8 - int(inputs[0].split()[1])) / 2)
+        return 200, {}, None
+
+    with stub_server(respond) as (url, calls):
+        vecs = embed(url, texts, batch_size=2, concurrency=4)
+    assert len(calls) == 4
+    np.testing.assert_array_equal(vecs, expected(texts))
+
+
+def test_rate_limited_requests_are_retried():
+    texts = [f"text {i}" for i in range(6)]
+    limited = set()
+
+    def respond(inputs, calls):
+        # every batch is refused once before it is served
+        if inputs[0] not in limited:
+            limited.add(inputs[0])
+            return 429, {"Retry-After": "0.01"}, {"error": "rate limited"}
+        return 200, {}, None
+
+    with stub_server(respond) as (url, calls):
+        vecs = embed(url, texts, batch_size=2, concurrency=3)
+    assert len(calls) == 6
+    np.testing.assert_array_equal(vecs, expected(texts))
+
+
+def test_payload_too_large_splits_the_request():
+    texts = [f"text {i}" for i in range(10)]
+
+    def respond(inputs, calls):
+        if len(inputs) > 2:
+            return 413, {}, {"error": "payload too large"}
+        return 200, {}, None
+
+    with stub_server(respond) as (url, calls):
+        vecs = embed(url, texts, batch_size=8, concurrency=2)
+    served = [c for c in calls if len(c) <= 2]
+    assert any(len(c) > 2 for c in calls)
+    assert sorted(t for c in served for t in c) == sorted(texts)
+    np.testing.assert_array_equal(vecs, expected(texts))
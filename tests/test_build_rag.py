@@ -0,0 +1,40 @@
+import json
+import sys
+
+import numpy as np
+import pytest
+import yaml
+from pypdf import PdfWriter
+
+from phame.rag_utils import build_rag
+from phame.rag_utils.flat_index import open_flat_index
+
+
+def test_recreate_without_chunks_leaves_the_existing_index_alone(tmp_path, monkeypatch):
+    persist = tmp_path / "db"
+    index = open_flat_index(persist, "col")
+    index.upsert(["a", "b"], np.eye(2, 4, dtype="float32"), metadatas=[{}, {}])
+    index.close()
+    manifest = {"settings": {}, "files": {"/old.pdf": {"chunk_ids": ["a", "b"]}}}
+    (persist / "manifest.json").write_text(json.dumps(manifest), encoding="utf-8")
+    (persist / "metadata").mkdir()
+    (persist / "metadata" / "metadata.jsonl").write_text('{"id": "a"}\n{"id": "b"}\n', encoding="utf-8")
+
+    pdfs = tmp_path / "pdfs"
+    pdfs.mkdir()
+    writer = PdfWriter()
+    writer.add_blank_page(width=72, height=72)
+    writer.write(pdfs / "blank.pdf")
+    config = tmp_path / "config.yaml"
+    config.write_text(yaml.safe_dump({"chroma": {"backend": "flat"}}), encoding="utf-8")
+
+    monkeypatch.setattr(build_rag, "make_embedder", lambda config, show_progress=True: None)
+    monkeypatch.setattr(sys, "argv", ["build_rag", "--config", str(config), "--pdf_dir", str(pdfs),
+                                      "--persist_dir", str(persist), "--collection", "col", "--recreate"])
+    with pytest.raises(SystemExit, match="No chunks extracted"):
+        build_rag.main()
+
+    assert open_flat_index(persist, "col").count() == 2
+    assert json.loads((persist / "manifest.json").read_text(encoding="utf-8")) == manifest
+    assert (persist / "metadata" / "metadata.jsonl").read_text(encoding="utf-8") == '{"id": "a"}\n{"id": "b"}\n'
+    assert not (persist / "ingest_state.jsonl").exists()
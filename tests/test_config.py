@@ -0,0 +1,34 @@
+import yaml
+
+from phame.rag_utils.build_rag import load_config
+from phame.rag_utils.globals import DEFAULTS_RAG
+
+
+def write_yaml(path, data):
+    path.write_text(yaml.safe_dump(data), encoding="utf-8")
+    return str(path)
+
+
+def test_configs_loaded_in_a_row_stay_independent(tmp_path):
+    a = write_yaml(tmp_path / "a.yml", {"retrieval": {"hybrid": True, "mmr": True},
+                                        "chunking": {"chunk_size": 400}})
+    b = write_yaml(tmp_path / "b.yml", {"retrieval": {"top_k": 7}})
+
+    cfg_a = load_config(a)
+    cfg_b = load_config(b)
+
+    assert cfg_a["retrieval"]["hybrid"] is True
+    assert cfg_a["chunking"]["chunk_size"] == 400
+    assert cfg_b["retrieval"]["top_k"] == 7
+    assert cfg_b["retrieval"]["hybrid"] == DEFAULTS_RAG["retrieval"]["hybrid"] is False
+    assert cfg_b["retrieval"]["mmr"] is False
+    assert cfg_b["chunking"]["chunk_size"] == DEFAULTS_RAG["chunking"]["chunk_size"] != 400
+
+
+def test_load_config_does_not_modify_defaults(tmp_path):
+    load_config(write_yaml(tmp_path / "a.yml", {"chroma": {"collection": "other"}}))
+    cfg = load_config(None)
+    cfg["chroma"]["collection"] = "mutated"
+
+    assert DEFAULTS_RAG["chroma"]["collection"] == "rag_chunks"
+    assert load_config(None)["chroma"]["collection"] == "rag_chunks"
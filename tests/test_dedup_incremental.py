@@ -0,0 +1,74 @@
+from pathlib import Path
+
+from phame.rag_utils.build_rag import Chunk, PdfResult, iter_chunk_batches, plan_dedup_dependents, seed_deduplicator
+from phame.rag_utils.dedup import ChunkDeduplicator
+
+
+def entry(chunk_ids, dups=None):
+    ent = {"size": 1, "mtime_ns": 1, "sha256": "h", "chunk_ids": chunk_ids}
+    if dups:
+        ent["dups"] = dups
+    return ent
+
+
+def test_removing_the_owner_of_kept_copies_reindexes_the_dependent_pdf():
+    # b2 was dropped as a duplicate of a2; c is unrelated
+    files = {"/a.pdf": entry(["a1", "a2"]), "/b.pdf": entry(["b1", "b2"], {"b2": "a2"}), "/c.pdf": entry(["c1"])}
+
+    assert plan_dedup_dependents(files, [], ["/a.pdf"]) == ["/b.pdf"]
+    assert plan_dedup_dependents(files, [], ["/c.pdf"]) == []
+    assert plan_dedup_dependents(files, [], []) == []
+
+
+def test_reindexing_the_owner_reindexes_the_dependent_pdf(tmp_path):
+    a = tmp_path / "a.pdf"
+    files = {str(a.resolve()): entry(["a1", "a2"]), "/b.pdf": entry(["b1", "b2"], {"b2": "a2"})}
+
+    assert plan_dedup_dependents(files, [a], []) == ["/b.pdf"]
+
+
+def test_dependent_that_is_itself_removed_is_not_reindexed():
+    files = {"/a.pdf": entry(["a1"]), "/b.pdf": entry(["b1"], {"b1": "a1"})}
+
+    assert plan_dedup_dependents(files, [], ["/a.pdf", "/b.pdf"]) == []
+
+
+class FakeCollection:
+    def __init__(self, chunks):
+        self.docs = {c.id: c.text for c in chunks}
+
+    def get(self, ids, include):
+        found = [i for i in ids if i in self.docs]
+        return {"ids": found, "documents": [self.docs[i] for i in found]}
+
+
+def make_chunks(texts, source):
+    return [Chunk(id=f"{source}-{i}", source=source, page=1, start=i, end=i + 1, text=t) for i, t in enumerate(texts)]
+
+
+def test_resumed_run_drops_the_same_duplicates_as_a_clean_run():
+    base = "the bolt preload is set by the nut factor and the applied torque on the thread"
+    first = make_chunks([base, "shaft fatigue under reversed bending loads", base + " again"], "a")
+    second = make_chunks([base, "gear tooth bending strength", "shaft fatigue under reversed bending loads"], "b")
+
+    clean = ChunkDeduplicator(threshold=0.5)
+    kept_clean = [c.id for c in clean.filter(first + second)[0]]
+
+    # interrupted after the first PDF: only its kept chunks are in the collection
+    before = ChunkDeduplicator(threshold=0.5)
+    written = before.filter(first)[0]
+    resumed = ChunkDeduplicator(threshold=0.5)
+    seed_deduplicator(resumed, FakeCollection(written), [c.id for c in first])
+    kept_resumed = [c.id for c in written] + [c.id for c in resumed.filter(second)[0]]
+
+    assert kept_resumed == kept_clean
+    assert "b-0" not in kept_resumed and "b-2" not in kept_resumed
+
+
+def test_chunks_skipped_on_resume_are_replayed():
+    res = PdfResult(path=Path("a.pdf"), chunks=make_chunks(["one", "two", "three"], "a"))
+    skipped = []
+    batches = list(iter_chunk_batches([res], 10, skip=2, on_skip=skipped.extend))
+
+    assert [c.id for c in skipped] == ["a-0", "a-1"]
+    assert [c.id for b in batches for c in b.chunks] == ["a-2"]
@@ -0,0 +1,90 @@
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from phame.rag_utils.embedding_cache import EmbeddingCache, QueryEmbeddingCache, make_cache, make_query_cache
+
+
+def vec(text, dim=8):
+    return np.random.default_rng(abs(hash(text)) % 2**32).random(dim, dtype="float32")
+
+
+def test_shared_cache_survives_concurrent_reads_and_writes(tmp_path):
+    cache = EmbeddingCache(tmp_path, "model", False, max_bytes=64 * 4 * 8)  # small enough to evict on the way
+
+    def work(worker):
+        for step in range(30):
+            texts = [f"text {worker} {step} {j}" for j in range(5)]
+            cache.put_many(texts, np.stack([vec(t) for t in texts]))
+            out, missing = cache.get_many(texts)
+            for j in set(range(len(texts))) - set(missing):
+                assert np.array_equal(out[j], vec(texts[j]))
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(work, range(8)))
+    assert cache.stats()["rows"] <= 64
+    cache.close()
+
+
+def test_rows_written_after_a_torn_append_stay_aligned(tmp_path):
+    cache = EmbeddingCache(tmp_path, "model", False)
+    before = [f"before {i}" for i in range(3)]
+    cache.put_many(before, np.stack([vec(t) for t in before]))
+    with open(cache.vec_path, "ab") as f:
+        f.write(b"\x00" * 10)  # an append that died mid-row, before its index rows were committed
+
+    after = [f"after {i}" for i in range(3)]
+    cache.put_many(after, np.stack([vec(t) for t in after]))
+    out, missing = cache.get_many(before + after)
+    assert missing == []
+    assert np.array_equal(out, np.stack([vec(t) for t in before + after]))
+    cache.close()
+
+
+def _fill(cache_dir, worker):
+    cache = EmbeddingCache(cache_dir, "model", False, max_bytes=64 * 4 * 8)
+    for step in range(20):
+        texts = [f"text {worker} {step} {j}" for j in range(5)]
+        cache.put_many(texts, np.stack([vec(t) for t in texts]))
+    cache.close()
+
+
+def test_processes_sharing_a_directory_do_not_corrupt_it(tmp_path):
+    procs = [multiprocessing.get_context("fork").Process(target=_fill, args=(tmp_path, w)) for w in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+        assert p.exitcode == 0
+
+    cache = EmbeddingCache(tmp_path, "model", False, max_bytes=64 * 4 * 8)
+    texts = [f"text {w} {s} {j}" for w in range(4) for s in range(20) for j in range(5)]
+    out, missing = cache.get_many(texts)
+    assert len(texts) - len(missing) > 0
+    for j in set(range(len(texts))) - set(missing):
+        assert np.array_equal(out[j], vec(texts[j]))
+    cache.close()
+
+
+def test_query_vectors_do_not_share_entries_with_chunk_vectors(tmp_path):
+    config = {"embedding": {"model": "model", "normalize": False, "cache_dir": str(tmp_path)}}
+    chunks = make_cache(config)
+    queries = make_query_cache(config)
+    chunks.put_many(["bolt preload"], np.ones((1, 4), dtype="float32"))
+
+    assert queries.disk.dir != chunks.dir
+    assert queries.get_many(["bolt preload"]) == (None, [0])
+    chunks.close()
+    queries.close()
+
+
+def test_query_cache_size_zero_keeps_nothing_and_ttl_zero_never_expires():
+    off = QueryEmbeddingCache("model", max_entries=0)
+    off.put_many(["bolt preload"], np.ones((1, 4), dtype="float32"))
+    assert off.get_many(["bolt preload"]) == (None, [0])
+
+    forever = QueryEmbeddingCache("model", ttl=0)
+    forever.put_many(["bolt preload"], np.ones((1, 4), dtype="float32"))
+    out, missing = forever.get_many(["bolt preload"])
+    assert missing == [] and np.array_equal(out, np.ones((1, 4), dtype="float32"))
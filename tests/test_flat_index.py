@@ -0,0 +1,45 @@
+import numpy as np
+
+from phame.rag_utils.build_rag import finish_collection
+from phame.rag_utils.flat_index import open_flat_index
+from phame.rag_utils.quantized_index import benchmark
+
+
+def make_index(tmp_path, n=200, dim=16, quantization=None):
+    index = open_flat_index(tmp_path, "col", quantization=quantization)
+    vecs = np.random.default_rng(0).normal(size=(n, dim)).astype("float32")
+    index.upsert([f"id{i}" for i in range(n)], vecs, metadatas=[{"i": i} for i in range(n)])
+    return index
+
+
+def test_benchmark_leaves_no_codes_on_disk(tmp_path):
+    index = make_index(tmp_path)
+    before = sorted(p.name for p in index.root.iterdir())
+
+    rows = benchmark(index, n_queries=20, k=5, factors=[4])
+    assert {r["mode"] for r in rows} == {"float32", "int8", "binary"}
+    assert sorted(p.name for p in index.root.iterdir()) == before
+    index.close()
+
+
+def test_finish_collection_compacts_once_enough_rows_are_dead(tmp_path):
+    index = make_index(tmp_path, n=100)
+    index.delete([f"id{i}" for i in range(10)])
+    finish_collection(index, compact_dead_fraction=0.25)
+    assert index.n == 100  # 10% dead: left alone
+
+    index.delete([f"id{i}" for i in range(10, 30)])
+    finish_collection(index, compact_dead_fraction=0.25)
+    assert index.n == index.count() == 70
+    rows, _ = index.search(np.asarray(index.vecs[:1]), 1)
+    assert index.row_ids[rows[0][0]] == "id30"
+    index.close()
+
+
+def test_quantized_codes_are_rebuilt_after_compaction(tmp_path):
+    index = make_index(tmp_path, n=100, quantization="int8")
+    finish_collection(index)
+    index.delete([f"id{i}" for i in range(50)])
+    finish_collection(index, compact_dead_fraction=0.25)
+    assert index.n == 50 and index.codes is not None and index.codes.shape[0] == 50
+    index.close()
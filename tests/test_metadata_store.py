@@ -0,0 +1,45 @@
+from contextlib import closing
+
+from phame.rag_utils.build_rag import Chunk
+from phame.rag_utils.metadata_store import MetadataStore
+from phame.rag_utils.query_rag import collection_meta_db, collection_sources
+
+
+def write_store(path, persist_dir, collection, sources):
+    with closing(MetadataStore(path)) as store:
+        store.add([Chunk(id=f"{s}-0", source=s, page=1, start=0, end=1, text="") for s in sources])
+        if collection is not None:
+            store.set_owner(persist_dir, collection)
+
+
+class ScannedCollection:
+    def __init__(self, sources):
+        self.metas = [{"source": s} for s in sources]
+
+    def get(self, include, limit, offset):
+        part = self.metas[offset:offset + limit]
+        return {"ids": [str(i) for i in range(len(part))], "metadatas": part}
+
+
+def test_shared_store_of_another_build_is_not_used(tmp_path):
+    shared = tmp_path / "outputs" / "metadata.sqlite"
+    write_store(shared, tmp_path / "other", "rag_chunks", ["other.pdf"])
+
+    assert collection_meta_db(tmp_path / "db", "rag_chunks", shared) is None
+    col = ScannedCollection(["mine.pdf"])
+    assert collection_sources(col, collection_meta_db(tmp_path / "db", "rag_chunks", shared)) == ["mine.pdf"]
+
+
+def test_store_written_for_the_collection_is_used(tmp_path):
+    shared = tmp_path / "outputs" / "metadata.sqlite"
+    write_store(shared, tmp_path / "db", "rag_chunks", ["mine.pdf"])
+
+    assert collection_meta_db(tmp_path / "db", "rag_chunks", shared) == shared
+    assert collection_meta_db(tmp_path / "db", "other_collection", shared) is None
+
+
+def test_store_without_an_owner_is_not_trusted(tmp_path):
+    local = tmp_path / "db" / "metadata" / "metadata.sqlite"
+    write_store(local, None, None, ["old.pdf"])
+
+    assert collection_meta_db(tmp_path / "db", "rag_chunks") is None
@@ -0,0 +1,54 @@
+import copy
+
+import numpy as np
+import pytest
+
+from phame.rag_utils import query_rag
+from phame.rag_utils.embedding_cache import QueryEmbeddingCache, cached_embedder
+from phame.rag_utils.flat_index import open_flat_index
+from phame.rag_utils.globals import DEFAULTS_RAG
+from phame.rag_utils.query_rag import retriever_key
+
+
+@pytest.mark.parametrize("section, name, value", [
+    ("sparse", "k1", 2.0),
+    ("sparse", "b", 0.5),
+    ("chroma", "rescore_factor", 8),
+    ("chroma", "quantization", "int8"),
+    ("embedding", "query_cache_size", 0),
+    ("embedding", "query_cache_casefold", True),
+    ("embedding", "normalize", True),
+    ("retrieval", "hybrid", True),
+    ("outputs", "metadata_db_path", "other/metadata.sqlite"),
+])
+def test_retriever_settings_change_the_key(section, name, value):
+    config = copy.deepcopy(DEFAULTS_RAG)
+    config[section][name] = value
+    assert retriever_key(config) != retriever_key(DEFAULTS_RAG)
+
+
+def test_settings_the_retriever_does_not_read_share_the_key():
+    config = copy.deepcopy(DEFAULTS_RAG)
+    config["chunking"]["chunk_size"] = 500
+    config["rerank"]["top_n"] = 3
+    assert retriever_key(config) == retriever_key(DEFAULTS_RAG)
+
+
+def test_warm_up_leaves_the_query_cache_untouched(tmp_path, monkeypatch):
+    index = open_flat_index(tmp_path, "col")
+    index.upsert(["a", "b"], np.eye(2, 4, dtype="float32"), metadatas=[{}, {}])
+    index.close()
+    calls = []
+
+    def embed_fn(texts):
+        calls.append(texts)
+        return np.ones((len(texts), 4), dtype="float32")
+
+    monkeypatch.setattr(query_rag, "make_query_embedder",
+                        lambda config: cached_embedder(embed_fn, QueryEmbeddingCache("model")))
+    config = copy.deepcopy(DEFAULTS_RAG)
+    config["chroma"].update(persist_dir=str(tmp_path), collection="col", backend="flat")
+
+    retriever = query_rag.Retriever(config)
+    assert calls == [["warm up"]]
+    assert retriever.cache_stats() == {"hits": 0, "disk_hits": 0, "misses": 0, "hit_rate": 0.0, "entries": 0}